@@ -12,7 +12,7 @@ from ebooklib import ITEM_DOCUMENT, epub
 from rich import print
 from tqdm import tqdm
 
-from book_maker.utils import num_tokens_from_text, prompt_config_to_kwargs
+from book_maker.utils import count_many, num_tokens_from_text, prompt_config_to_kwargs
 
 from .base_loader import BaseBookLoader
 from .helper import EPUBBookLoaderHelper, is_text_link, not_trans
@@ -208,9 +208,8 @@ class EPUBBookLoader(BaseBookLoader):
     def translate_paragraphs_acc(self, p_list, send_num):
         count = 0
         wait_p_list = []
-        for i in range(len(p_list)):
-            p = p_list[i]
-            print(f"translating {i}/{len(p_list)}")
+        temp_texts = []
+        for p in p_list:
             temp_p = copy(p)
 
             for p_exclude in self.exclude_translate_tags.split(","):
@@ -223,10 +222,20 @@ class EPUBBookLoader(BaseBookLoader):
             if any(
                 [not p.text, self._is_special_text(temp_p.text), not_trans(temp_p.text)]
             ):
+                temp_texts.append(None)
+            else:
+                temp_texts.append(temp_p.text)
+        # count the tokens of the whole chapter at once
+        lengths = iter(count_many([text for text in temp_texts if text is not None]))
+
+        for i in range(len(p_list)):
+            p = p_list[i]
+            print(f"translating {i}/{len(p_list)}")
+            if temp_texts[i] is None:
                 if i == len(p_list) - 1:
                     self.helper.deal_old(wait_p_list, self.single_translate)
                 continue
-            length = num_tokens_from_text(temp_p.text)
+            length = next(lengths)
             if length > send_num:
                 self.helper.deal_new(p, wait_p_list, self.single_translate)
                 continue
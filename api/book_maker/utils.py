@@ -1,5 +1,10 @@
+import logging
+from functools import lru_cache
+
 import tiktoken
 
+logger = logging.getLogger(__name__)
+
 # Borrowed from : https://github.com/openai/whisper
 LANGUAGES = {
     "en": "english",
@@ -131,34 +136,62 @@ def prompt_config_to_kwargs(prompt_config):
     )
 
 
-# ref: https://platform.openai.com/docs/guides/chat/introduction
-def num_tokens_from_text(text, model="gpt-3.5-turbo-0301"):
-    messages = (
-        {
-            "role": "user",
-            "content": text,
-        },
-    )
+DEFAULT_TOKEN_MODEL = "gpt-3.5-turbo-0301"
+MAX_CACHED_TOKEN_COUNTS = 100_000
 
-    """Returns the number of tokens used by a list of messages."""
+_token_counts = {}
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """Returns the tiktoken encoding of the model, or None if its files can't be loaded (e.g. offline)."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model == "gpt-3.5-turbo-0301":  # note: future models may deviate from this
-        num_tokens = 0
-        for message in messages:
-            num_tokens += (
-                4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
-            )
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":  # if there's a name, the role is omitted
-                    num_tokens += -1  # role is always required and always 1 token
-        num_tokens += 2  # every reply is primed with <im_start>assistant
-        return num_tokens
-    else:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Could not load the tokenizer of {model}, estimating token counts: {e}")
+        return None
+
+
+def estimate_tokens(text):
+    """Rough token count: about four ASCII characters per token and a token per other character."""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return -(-ascii_chars // 4) + len(text) - ascii_chars
+
+
+def count_tokens_many(texts, model=DEFAULT_TOKEN_MODEL):
+    """Returns the number of tokens of each text, encoding each distinct text only once."""
+    counts = {text: _token_counts.get((model, text)) for text in texts}
+    missing = [text for text, count in counts.items() if count is None]
+    if missing:
+        encoding = get_encoding(model)
+        if encoding is None:
+            new_counts = [estimate_tokens(text) for text in missing]
+        else:
+            new_counts = [len(tokens) for tokens in encoding.encode_ordinary_batch(missing)]
+        if len(_token_counts) + len(missing) > MAX_CACHED_TOKEN_COUNTS:
+            _token_counts.clear()
+        for text, count in zip(missing, new_counts):
+            counts[text] = _token_counts[(model, text)] = count
+    return [counts[text] for text in texts]
+
+
+# ref: https://platform.openai.com/docs/guides/chat/introduction
+def count_many(texts, model=DEFAULT_TOKEN_MODEL):
+    """Returns the number of tokens of each text sent as a chat message."""
+    if model != "gpt-3.5-turbo-0301":  # note: future models may deviate from this
         raise NotImplementedError(
             f"""num_tokens_from_messages() is not presently implemented for model {model}.
   See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
         )
+    # every message follows <im_start>{role/name}\n{content}<im_end>\n
+    # and every reply is primed with <im_start>assistant
+    (role_tokens,) = count_tokens_many(["user"], model)
+    return [4 + role_tokens + count + 2 for count in count_tokens_many(texts, model)]
+
+
+def num_tokens_from_text(text, model=DEFAULT_TOKEN_MODEL):
+    """Returns the number of tokens of the text sent as a chat message."""
+    return count_many([text], model)[0]
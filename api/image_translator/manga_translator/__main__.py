@@ -3,12 +3,12 @@ import asyncio
 import logging
 from argparse import Namespace
 
-from manga_translator.share import MangaShare
 from .manga_translator import (
     MangaTranslator,
     set_main_logger,
 )
 from .args import parser
+from .translators.http_client import close_http_client
 from .utils import (
     BASE_PATH,
     init_logging,
@@ -52,6 +52,7 @@ async def dispatch(args: Namespace):
 
             except Exception as e:
                 logger.error(f'Error processing {path}: {e}')
+        await close_http_client()
 
     else:
         logger.error(f"Mode '{args.mode}' is not supported in this script.")
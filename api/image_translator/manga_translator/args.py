@@ -98,6 +98,8 @@ parser.add_argument('--ignore-errors', action='store_true', help='Skip image on
 parser.add_argument('--overwrite', action='store_true', help='Overwrite already translated images in batch mode.')
 parser.add_argument('--skip-no-text', action='store_true', help='Skip image without text (Will not be saved).')
 parser.add_argument('--model-dir', default=None, type=dir_path, help='Model directory (by default ./models in project root)')
+parser.add_argument('--model-mirror', default=os.getenv('MT_MODEL_MIRROR') or None, type=dir_path, help='Local directory (e.g. an extracted offline bundle) that is searched for model files before downloading them')
+parser.add_argument('--model-memory-budget', default=float(os.getenv('MT_MODEL_MEMORY_BUDGET', 0)), type=float, help='Maximum memory in GB used by loaded models. Least recently used models are unloaded when it is exceeded, 0 means no limit')
 parser.add_argument('--skip-lang', default=None, type=str, help='Skip translation if source image is one of the provide languages, use comma to separate multiple languages. Example: JPN,ENG')
 
 g = parser.add_mutually_exclusive_group()
@@ -107,6 +109,10 @@ g.add_argument('--use-gpu-limited', action='store_true', help='Turn on/off gpu (
 parser.add_argument('--detector', default='default', type=str, choices=DETECTORS, help='Text detector used for creating a text mask from an image, DO NOT use craft for manga, it\'s not designed for it')
 parser.add_argument('--ocr', default='48px', type=str, choices=OCRS, help='Optical character recognition (OCR) model to use')
 parser.add_argument('--use-mocr-merge', action='store_true', help='Use bbox merge when Manga OCR inference.')
+parser.add_argument('--use-mocr-48px-colors', action='store_true', help='Predict the text colors of Manga OCR regions with the 48px model instead of estimating them. More accurate but runs a second model.')
+parser.add_argument('--ocr-cache-size', default=int(os.getenv('MT_OCR_CACHE_SIZE', 4096)), type=int, help='Number of OCR results of textline crops kept in memory to reuse for identical crops, 0 disables the cache')
+parser.add_argument('--ocr-cache', default=os.getenv('MT_OCR_CACHE') or None, type=str, help='SQLite file that keeps OCR results of textline crops across runs')
+parser.add_argument('--ocr-decoding', default='beam', type=str, choices=['beam', 'greedy'], help='Decoding of the 48px OCR. Greedy decoding is faster but can be slightly less accurate than beam search.')
 parser.add_argument('--inpainter', default='lama_large', type=str, choices=INPAINTERS, help='Inpainting model to use')
 parser.add_argument('--upscaler', default='esrgan', type=str, choices=UPSCALERS, help='Upscaler to use. --upscale-ratio has to be set for it to take effect')
 parser.add_argument('--upscale-ratio', default=None, type=float, help='Image upscale ratio applied before detection. Can improve text detection.')
@@ -123,6 +129,12 @@ parser.add_argument('--det-rotate', action='store_true', help='Rotate the image
 parser.add_argument('--det-auto-rotate', action='store_true', help='Rotate the image for detection to prefer vertical textlines. Might improve detection.')
 parser.add_argument('--det-invert', action='store_true', help='Invert the image colors for detection. Might improve detection.')
 parser.add_argument('--det-gamma-correct', action='store_true', help='Applies gamma correction for detection. Might improve detection.')
+parser.add_argument('--panel-split', action='store_true', help='Split pages into panels and run detection and inpainting per panel. Text is only merged within a panel and ordered by panel.')
+parser.add_argument('--skip-textless', action='store_true', help='Run a fast low resolution detection first and leave pages that are confidently textless (covers, illustrations, blank pages) untouched instead of running the whole pipeline on them.')
+parser.add_argument('--textless-threshold', default=float(os.getenv('MT_TEXTLESS_THRESHOLD', 0.3)), type=float, help='Pages whose text confidence from the --skip-textless pass is below this value (0 to 1) are skipped. Lower it to skip fewer pages.')
+parser.add_argument('--triage-size', default=512, type=int, help='Size of image used for the --skip-textless detection pass')
+parser.add_argument('--dedup', action='store_true', help='Translate only one of the duplicate or near-duplicate pages of a folder and reuse its translation for the others')
+parser.add_argument('--dedup-threshold', default=6, type=int, help='Largest Hamming distance of the perceptual hashes (256 bits) of pages considered duplicates')
 parser.add_argument('--unclip-ratio', default=2.3, type=float, help='How much to extend text skeleton to form bounding box')
 parser.add_argument('--box-threshold', default=0.8, type=float, help='Threshold for bbox generation')
 parser.add_argument('--text-threshold', default=0.85, type=float, help='Threshold for text detection')
@@ -132,6 +144,8 @@ parser.add_argument('--inpainting-size', default=2048, type=int, help='Size of i
 parser.add_argument('--inpainting-precision', default='fp32', type=str, help='Inpainting precision for lama, use bf16 while you can.', choices=['fp32', 'fp16', 'bf16'])
 parser.add_argument('--colorization-size', default=576, type=int, help='Size of image used for colorization. Set to -1 to use full image size')
 parser.add_argument('--denoise-sigma', default=30, type=int, help='Used by colorizer and affects color strength, range from 0 to 255 (default 30). -1 turns it off.')
+parser.add_argument('--colorization-batch-size', default=4, type=int, help='Pages of the same size colorized per forward pass')
+parser.add_argument('--colorize-ahead', action='store_true', help='Colorize the pages of a folder in batches ahead of the rest of the pipeline')
 parser.add_argument('--mask-dilation-offset', default=0, type=int, help='By how much to extend the text mask to remove left-over text pixels of the original image.')
 
 parser.add_argument('--disable-font-border', action='store_true', help='Disable font border')
@@ -170,6 +184,9 @@ parser.add_argument('--gimp-font', default='Sans-serif', type=str, help='Font fa
 parser.add_argument('--host', default='127.0.0.1', type=str, help='Used by web module to decide which host to attach to')
 parser.add_argument('--port', default=5003, type=int, help='Used by web module to decide which port to attach to')
 parser.add_argument('--nonce', default=os.getenv('MT_WEB_NONCE', ''), type=str, help='Used by web module as secret for securing internal web server communication')
+parser.add_argument('--workers', default=0, type=int, help='Number of translator client processes started by web mode. 0 picks a count based on the available CPU cores and memory')
+parser.add_argument('--worker-id', default='', type=str, help='Used by web module to tell its translator client processes apart')
+parser.add_argument('--share-image-format', default='raw', type=str, choices=['raw', 'png', 'webp'], help='Image encoding used by shared mode to send results. raw is fastest, png/webp (lossless) are smaller')
 # parser.add_argument('--log-web', action='store_true', help='Used by web module to decide if web logs should be surfaced')
 parser.add_argument('--ws-url', default='ws://localhost:5000', type=str, help='Server URL for WebSocket mode')
 parser.add_argument('--save-quality', default=100, type=int, help='Quality of saved JPEG image, range from 0 to 100 with 100 being best')
@@ -0,0 +1,72 @@
+"""
+Measures the colorization throughput in pages per minute for several batch
+sizes, and how much of the inference area the previous padded sizing spent on
+padding compared to the aspect-adaptive sizing. The fixtures are a directory
+of monochrome pages, ideally all from one volume so that they share a size.
+
+    python -m image_translator.manga_translator.benchmarks.colorization fixtures/pages --batch-sizes 1,2,4
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from ..colorization import dispatch_batch
+from ..colorization.manga_colorization_v2 import get_colorization_sizes
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def padded_area(width: int, height: int) -> int:
+    """Inference area of the previous sizing, which padded the scaled page to the next multiple of 32."""
+    if height < width:
+        return (width + 32 - width % 32) * height
+    return width * (height + 32 - height % 32)
+
+
+async def run(args: argparse.Namespace):
+    pages = []
+    for name in sorted(os.listdir(args.fixtures)):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            pages.append(Image.open(os.path.join(args.fixtures, name)).convert('RGB'))
+    if not pages:
+        raise SystemExit(f'No fixtures found in {args.fixtures}')
+
+    content, padded, adaptive = 0, 0, 0
+    for page in pages:
+        (w, h), (iw, ih) = get_colorization_sizes(page.width, page.height, args.colorization_size)
+        content += w * h
+        padded += padded_area(w, h)
+        adaptive += iw * ih
+    print(f'{len(pages)} pages, inference area over the page area: padded {padded / content:.3f}, adaptive {adaptive / content:.3f}')
+
+    kwargs = dict(colorization_size=args.colorization_size, denoise_sigma=args.denoise_sigma)
+    # Warm up
+    await dispatch_batch(args.colorizer, pages[:1], args.device, **kwargs)
+    print(f'{"batch size":>10} {"pages/min":>10}')
+    for batch_size in (int(b) for b in args.batch_sizes.split(',')):
+        start = time.perf_counter()
+        for i in range(0, len(pages), batch_size):
+            await dispatch_batch(args.colorizer, pages[i:i + batch_size], args.device,
+                                 colorization_batch_size=batch_size, **kwargs)
+        elapsed = time.perf_counter() - start
+        print(f'{batch_size:>10} {len(pages) / elapsed * 60:>10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the colorization throughput')
+    parser.add_argument('fixtures', help='Directory with monochrome pages')
+    parser.add_argument('--colorizer', default='mc2')
+    parser.add_argument('--batch-sizes', default='1,4')
+    parser.add_argument('--colorization-size', default=576, type=int)
+    parser.add_argument('--denoise-sigma', default=30, type=int)
+    parser.add_argument('--device', default='cpu')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Compares auto rotation through a downscaled orientation pre-pass with the
+previous approach of rerunning the full detection on the rotated page. The
+fixtures are a directory of pages, ideally a mix of vertical (manga) and
+horizontal (western) layouts.
+
+    python -m image_translator.manga_translator.benchmarks.detection_orientation fixtures/pages --detector default
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from collections import Counter
+
+import cv2
+
+from ..detection import get_detector
+from ..detection.common import CommonDetector
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def load_fixtures(path: str):
+    fixtures = []
+    for name in sorted(os.listdir(path)):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            fixtures.append((name, cv2.cvtColor(cv2.imread(os.path.join(path, name)), cv2.COLOR_BGR2RGB)))
+    return fixtures
+
+
+async def detect_rerun(detector: CommonDetector, img, args: argparse.Namespace):
+    """Auto rotation as it was done before: full detection, then again on the rotated page if needed."""
+    params = (args.detection_size, args.text_threshold, args.box_threshold, args.unclip_ratio, False, False)
+    textlines, raw_mask, mask = await detector.detect(img, *params, rotate=False)
+    orientations = ['h' if txtln.aspect_ratio > 1 else 'v' for txtln in textlines]
+    if not orientations or Counter(orientations).most_common(1)[0][0] == 'h':
+        return True, await detector.detect(img, *params, rotate=True)
+    return False, (textlines, raw_mask, mask)
+
+
+async def detect_prepass(detector: CommonDetector, img, args: argparse.Namespace):
+    params = (args.detection_size, args.text_threshold, args.box_threshold, args.unclip_ratio, False, False)
+    orientation = await detector.detect_orientation(img, *params[1:], detect_size=min(args.detection_size, args.orientation_size))
+    rotate = orientation != 'v'
+    return rotate, await detector.detect(img, *params, rotate=rotate)
+
+
+async def run(args: argparse.Namespace):
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f'No fixtures found in {args.fixtures}')
+    detector = get_detector(args.detector)
+    if hasattr(detector, 'download'):
+        await detector.download()
+        await detector.load(args.device)
+    # Warm up
+    await detect_prepass(detector, fixtures[0][1], args)
+
+    results = {}
+    print(f'{len(fixtures)} fixtures')
+    print(f'{"mode":<8} {"rotated":>8} {"median":>10} {"total":>10}')
+    for mode, fn in (('rerun', detect_rerun), ('prepass', detect_prepass)):
+        latencies = []
+        results[mode] = []
+        for name, img in fixtures:
+            start = time.perf_counter()
+            rotated, (textlines, _, _) = await fn(detector, img, args)
+            latencies.append(time.perf_counter() - start)
+            results[mode].append((rotated, len(textlines)))
+        rotated = sum(r for r, _ in results[mode])
+        print(f'{mode:<8} {rotated:>8} {statistics.median(latencies) * 1000:>8.1f}ms {sum(latencies):>9.2f}s')
+
+    agree = 0
+    for (name, _), (a, na), (b, nb) in zip(fixtures, results['rerun'], results['prepass']):
+        agree += a == b
+        if args.verbose and (a != b or na != nb):
+            print(f'  {name}: rerun rotated={a} textlines={na}, prepass rotated={b} textlines={nb}')
+    print(f'Same rotation on {agree}/{len(fixtures)} pages')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the auto rotation modes of the detection')
+    parser.add_argument('fixtures', help='Directory with pages')
+    parser.add_argument('--detector', default='default')
+    parser.add_argument('--detection-size', default=1536, type=int)
+    parser.add_argument('--orientation-size', default=640, type=int, help='Detection size of the orientation pre-pass')
+    parser.add_argument('--text-threshold', default=0.85, type=float)
+    parser.add_argument('--box-threshold', default=0.8, type=float)
+    parser.add_argument('--unclip-ratio', default=2.3, type=float)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print the pages where the modes differ')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Measures the cold start of a fresh process that imports the translator and
+resolves the backends of one configuration, which is what every EPUB request
+pays as it spawns a new process.
+
+    python -m image_translator.manga_translator.benchmarks.import_time --runs 5
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Modules that are only needed by some backends and should not be imported otherwise
+HEAVY_MODULES = ['diffusers', 'transformers', 'ctranslate2', 'openai', 'deepl', 'httpx', 'manga_ocr', 'groq']
+
+SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+from {package}.manga_translator import MangaTranslator
+from {package}.detection import DETECTORS
+from {package}.ocr import OCRS
+from {package}.inpainting import INPAINTERS
+from {package}.translators import TRANSLATORS
+imported = time.perf_counter()
+DETECTORS[{detector!r}], OCRS[{ocr!r}], INPAINTERS[{inpainter!r}], TRANSLATORS[{translator!r}]
+resolved = time.perf_counter()
+print(json.dumps({{
+    'import': imported - start,
+    'resolve': resolved - imported,
+    'loaded': [m for m in {heavy!r} if m in sys.modules],
+}}))
+'''
+
+
+def run_once(args: argparse.Namespace) -> dict:
+    script = SCRIPT.format(package=__package__.rsplit('.', 1)[0], detector=args.detector, ocr=args.ocr,
+                           inpainter=args.inpainter, translator=args.translator, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time of a minimal translation configuration')
+    parser.add_argument('--runs', default=5, type=int, help='Number of fresh processes to measure')
+    parser.add_argument('--detector', default='default', type=str)
+    parser.add_argument('--ocr', default='48px', type=str)
+    parser.add_argument('--inpainter', default='none', type=str)
+    parser.add_argument('--translator', default='none', type=str)
+    args = parser.parse_args()
+
+    results = [run_once(args) for _ in range(args.runs)]
+    imports = [r['import'] for r in results]
+    resolves = [r['resolve'] for r in results]
+    print(f'Configuration: detector={args.detector} ocr={args.ocr} inpainter={args.inpainter} translator={args.translator}')
+    print(f'Import:  median {statistics.median(imports):.3f}s  min {min(imports):.3f}s  max {max(imports):.3f}s')
+    print(f'Resolve: median {statistics.median(resolves):.3f}s  min {min(resolves):.3f}s  max {max(resolves):.3f}s')
+    print(f'Backend modules imported: {", ".join(results[-1]["loaded"]) or "none"}')
+
+
+if __name__ == '__main__':
+    main()
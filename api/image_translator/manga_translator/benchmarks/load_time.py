@@ -0,0 +1,62 @@
+"""
+Measures how long loading a model takes in a fresh process, once from the
+original checkpoint with torch.load and once from the converted weights cache.
+
+    python -m image_translator.manga_translator.benchmarks.load_time detection:default ocr:48px inpainting:lama_large
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SCRIPT = '''
+import asyncio, json, time
+from {package}.{stage} import get_{getter}
+model = get_{getter}({key!r})
+asyncio.run(model.download())
+start = time.perf_counter()
+asyncio.run(model.load('cpu'))
+print(json.dumps({{'load': time.perf_counter() - start}}))
+'''
+
+GETTERS = {
+    'detection': 'detector',
+    'ocr': 'ocr',
+    'inpainting': 'inpainter',
+    'upscaling': 'upscaler',
+    'colorization': 'colorizer',
+}
+
+
+def measure(model: str, cache: bool) -> float:
+    stage, key = model.split(':')
+    script = SCRIPT.format(package=__package__.rsplit('.', 1)[0], stage=stage, getter=GETTERS[stage], key=key)
+    env = {**os.environ, 'MT_WEIGHTS_CACHE': '1' if cache else '0'}
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])['load']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare model load times with and without the converted weights cache')
+    parser.add_argument('models', nargs='+', help='Models as stage:key, e.g. detection:default ocr:48px')
+    parser.add_argument('--runs', default=3, type=int, help='Number of fresh processes per measurement')
+    args = parser.parse_args()
+
+    for model in args.models:
+        if model.split(':')[0] not in GETTERS:
+            parser.error(f'Unknown stage in "{model}", choose from: {", ".join(GETTERS)}')
+
+    print(f'{"model":<24} {"torch.load":>12} {"conversion":>12} {"cached":>12}')
+    for model in args.models:
+        uncached = statistics.median(measure(model, False) for _ in range(args.runs))
+        # The first cached load converts the checkpoint unless that happened before
+        conversion = measure(model, True)
+        cached = statistics.median(measure(model, True) for _ in range(args.runs))
+        print(f'{model:<24} {uncached:>11.3f}s {conversion:>11.3f}s {cached:>11.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the accuracy and latency of the decoding modes of the 48px OCR over a
+fixture set: a directory of single textline crops (png/jpg) with the expected
+text in a .txt file of the same name. Crops that are taller than wide are read
+as vertical text.
+
+    python -m image_translator.manga_translator.benchmarks.ocr_decoding fixtures/ocr --modes beam greedy
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+from ..ocr import get_ocr
+from ..utils import Quadrilateral
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def edit_distance(a: str, b: str) -> int:
+    row = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        prev, row[0] = row[0], i
+        for j, cb in enumerate(b, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ca != cb))
+    return row[-1]
+
+
+def load_fixtures(path: str):
+    fixtures = []
+    for name in sorted(os.listdir(path)):
+        stem, ext = os.path.splitext(name)
+        label = os.path.join(path, stem + '.txt')
+        if ext.lower() not in IMAGE_EXTENSIONS or not os.path.exists(label):
+            continue
+        img = cv2.cvtColor(cv2.imread(os.path.join(path, name)), cv2.COLOR_BGR2RGB)
+        with open(label, 'r', encoding='utf-8') as f:
+            fixtures.append((name, img, f.read().strip()))
+    return fixtures
+
+
+async def recognize(ocr, img: np.ndarray, mode: str) -> str:
+    h, w = img.shape[:2]
+    textline = Quadrilateral(np.array([[0, 0], [w, 0], [w, h], [0, h]]), '', 0)
+    regions = await ocr.infer(img, [textline], {'ocr_decoding': mode})
+    return regions[0].text if regions else ''
+
+
+async def run(args: argparse.Namespace):
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f'No fixtures found in {args.fixtures}')
+    ocr = get_ocr('48px')
+    await ocr.download()
+    await ocr.load(args.device)
+    # Warm up
+    await recognize(ocr, fixtures[0][1], args.modes[0])
+
+    print(f'{len(fixtures)} fixtures')
+    print(f'{"mode":<8} {"CER":>8} {"exact":>8} {"median":>10} {"total":>10}')
+    for mode in args.modes:
+        errors = 0
+        chars = 0
+        exact = 0
+        latencies = []
+        for name, img, expected in fixtures:
+            start = time.perf_counter()
+            text = await recognize(ocr, img, mode)
+            latencies.append(time.perf_counter() - start)
+            errors += edit_distance(text, expected)
+            chars += len(expected)
+            exact += text == expected
+            if args.verbose and text != expected:
+                print(f'  {mode} {name}: {text!r} != {expected!r}')
+        cer = errors / max(chars, 1)
+        print(f'{mode:<8} {cer:>8.2%} {exact / len(fixtures):>8.2%} {statistics.median(latencies) * 1000:>8.1f}ms {sum(latencies):>9.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the decoding modes of the 48px OCR')
+    parser.add_argument('fixtures', help='Directory with textline crops and their expected text')
+    parser.add_argument('--modes', nargs='+', default=['beam', 'greedy'], choices=['beam', 'greedy'])
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print the mismatches')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the tiled upscaling of the in-process upscalers with running their
+network over the whole page at once. Reports the time, the growth of the peak
+memory of the process and the PSNR of the tiled output against the untiled one.
+The tiled mode runs first since the peak memory only ever grows.
+
+    MT_UPSCALE_MEMORY_MB=1024 python -m image_translator.manga_translator.benchmarks.upscaling fixtures/pages --upscaler 4xultrasharp
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from ..upscaling import get_upscaler
+from ..upscaling.inprocess import InProcessUpscaler, image_to_tensor, tensor_to_image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def peak_memory_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+async def run(args: argparse.Namespace):
+    pages = []
+    for name in sorted(os.listdir(args.fixtures)):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            pages.append(Image.open(os.path.join(args.fixtures, name)).convert('RGB'))
+    if not pages:
+        raise SystemExit(f'No fixtures found in {args.fixtures}')
+    upscaler = get_upscaler(args.upscaler)
+    if not isinstance(upscaler, InProcessUpscaler):
+        raise SystemExit(f'{args.upscaler} is not an in-process upscaler')
+    await upscaler.download()
+    await upscaler.load(args.device)
+    scale = upscaler._MODEL_SCALE
+    print(f'{len(pages)} pages, upscaling by {scale}')
+
+    memory = peak_memory_mb()
+    start = time.perf_counter()
+    tiled = []
+    for i in range(0, len(pages), args.batch_size):
+        tiled += await upscaler.upscale(pages[i:i + args.batch_size], scale)
+    print(f'tiled    {time.perf_counter() - start:>8.2f}s  peak memory +{peak_memory_mb() - memory:.0f}MB')
+
+    if args.skip_untiled:
+        return
+    memory = peak_memory_mb()
+    start = time.perf_counter()
+    untiled = []
+    with torch.no_grad():
+        for page in pages:
+            batch = image_to_tensor(np.array(page))[None].to(args.device)
+            untiled.append(tensor_to_image(upscaler._forward(batch)[0]))
+    print(f'untiled  {time.perf_counter() - start:>8.2f}s  peak memory +{peak_memory_mb() - memory:.0f}MB')
+    scores = [psnr(np.array(a), b) for a, b in zip(tiled, untiled)]
+    print(f'PSNR of tiled against untiled: min {min(scores):.2f}dB, mean {np.mean(scores):.2f}dB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare tiled and untiled in-process upscaling')
+    parser.add_argument('fixtures', help='Directory with pages')
+    parser.add_argument('--upscaler', default='4xultrasharp')
+    parser.add_argument('--batch-size', default=4, type=int, help='Pages per upscale call, their tiles are batched together')
+    parser.add_argument('--skip-untiled', action='store_true', help='Skip the untiled run, e.g. for pages too large for it')
+    parser.add_argument('--device', default='cpu')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,12 @@
+from typing import List
 from PIL import Image
 
 from .common import CommonColorizer, OfflineColorizer
-from .manga_colorization_v2 import MangaColorizationV2
+from ..utils import LazyRegistry
 
-COLORIZERS = {
-    'mc2': MangaColorizationV2,
-}
+COLORIZERS = LazyRegistry(__name__, {
+    'mc2': '.manga_colorization_v2:MangaColorizationV2',
+})
 colorizer_cache = {}
 
 def get_colorizer(key: str, *args, **kwargs) -> CommonColorizer:
@@ -26,3 +27,9 @@ async def dispatch(key: str, device: str = 'cpu', **kwargs) -> Image.Image:
     if isinstance(colorizer, OfflineColorizer):
         await colorizer.load(device)
     return await colorizer.colorize(**kwargs)
+
+async def dispatch_batch(key: str, image_batch: List[Image.Image], device: str = 'cpu', **kwargs) -> List[Image.Image]:
+    colorizer = get_colorizer(key)
+    if isinstance(colorizer, OfflineColorizer):
+        await colorizer.load(device)
+    return await colorizer.colorize_batch(image_batch, **kwargs)
@@ -1,5 +1,6 @@
 from PIL import Image
 from abc import abstractmethod
+from typing import List
 
 from ..utils import InfererModule, ModelWrapper
 
@@ -7,10 +8,15 @@ class CommonColorizer(InfererModule):
     _VALID_UPSCALE_RATIOS = None
 
     async def colorize(self, image: Image.Image, colorization_size: int, **kwargs) -> Image.Image:
-        return await self._colorize(image, colorization_size, **kwargs)
+        return (await self.colorize_batch([image], colorization_size, **kwargs))[0]
+
+    async def colorize_batch(self, image_batch: List[Image.Image], colorization_size: int, **kwargs) -> List[Image.Image]:
+        if not image_batch:
+            return []
+        return await self._colorize(image_batch, colorization_size, **kwargs)
 
     @abstractmethod
-    async def _colorize(self, image: Image.Image, colorization_size: int, **kwargs) -> Image.Image:
+    async def _colorize(self, image_batch: List[Image.Image], colorization_size: int, **kwargs) -> List[Image.Image]:
         pass
 
 class OfflineColorizer(CommonColorizer, ModelWrapper):
@@ -20,5 +26,9 @@ class OfflineColorizer(CommonColorizer, ModelWrapper):
         return await self.infer(*args, **kwargs)
 
     @abstractmethod
-    async def _infer(self, image: Image.Image, colorization_size: int, **kwargs) -> Image.Image:
+    async def _infer(self, image_batch: List[Image.Image], colorization_size: int, **kwargs) -> List[Image.Image]:
+        """
+        Colorizes the images, pages of the same inference size may be processed
+        in one forward pass.
+        """
         pass
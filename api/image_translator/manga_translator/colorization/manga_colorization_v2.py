@@ -1,13 +1,17 @@
+import asyncio
 import os
+import threading
+from collections import defaultdict
+from typing import List, Tuple
+
+import cv2
 import torch
 import numpy as np
 from PIL import Image
-from torchvision.transforms import ToTensor
 
 from .common import OfflineColorizer
 from .manga_colorization_v2_utils.networks.models import Colorizer
 from .manga_colorization_v2_utils.denoising.denoiser import FFDNetDenoiser
-from .manga_colorization_v2_utils.utils.utils import resize_pad
 
 
 # https://github.com/qweasdd/manga-colorization-v2
@@ -34,41 +38,85 @@ class MangaColorizationV2(OfflineColorizer):
             torch.load(self._get_file_path('generator.zip'), map_location=self.device))
         self.colorizer = self.colorizer.eval()
         self.denoiser = FFDNetDenoiser(device, _weights_dir=self.model_dir)
+        # Input tensor reused across calls, grown to the largest batch and viewed at the size of each batch
+        self._buffer = torch.empty(0, device=device)
+        self._buffer_lock = threading.Lock()
 
     async def _unload(self):
         del self.colorizer
         del self.denoiser
+        del self._buffer
 
-    async def _infer(self, image: Image.Image, colorization_size: int, denoise_sigma=25, **kwargs) -> Image.Image:
-        # Size has to be multiple of 32
-        img = np.array(image.convert('RGBA'))
-        max_size = min(*img.shape[:2])
-        max_size -= max_size % 32
-        if colorization_size > 0:
-            size = min(max_size, colorization_size - (colorization_size % 32))
-        else:
-            # size<=576 gives best results
-            size = min(max_size, 576)
-
-        if 0 <= denoise_sigma and denoise_sigma <= 255:
-            img = self.denoiser.get_denoised_image(img, sigma=denoise_sigma)
+    async def _infer(self, image_batch: List[Image.Image], colorization_size: int, denoise_sigma=25,
+                     colorization_batch_size: int = 4, **kwargs) -> List[Image.Image]:
+        # The forward passes run in a thread so that pages colorized ahead overlap with the rest of the pipeline
+        return await asyncio.to_thread(self._colorize_pages, image_batch, colorization_size, denoise_sigma,
+                                       max(colorization_batch_size or 1, 1))
 
-        img, current_pad = resize_pad(img, size)
+    def _colorize_pages(self, image_batch: List[Image.Image], colorization_size: int, denoise_sigma: int,
+                        batch_size: int) -> List[Image.Image]:
+        pages = []
+        for image in image_batch:
+            img = np.array(image.convert('RGBA'))
+            if 0 <= denoise_sigma and denoise_sigma <= 255:
+                with torch.no_grad():
+                    img = self.denoiser.get_denoised_image(img, sigma=denoise_sigma)
+            else:
+                img = img[:, :, :3]
+            output_size, inference_size = get_colorization_sizes(image.width, image.height, colorization_size)
+            gray = cv2.resize(img, inference_size, interpolation=cv2.INTER_AREA)[:, :, 0]
+            pages.append((gray, output_size))
 
-        transform = ToTensor()
-        current_image = transform(img).unsqueeze(0).to(self.device)
-        current_hint = torch.zeros(1, 4, current_image.shape[2], current_image.shape[3]).float().to(self.device)
+        # Pages of the same inference size share forward passes
+        by_size = defaultdict(list)
+        for i, (gray, _) in enumerate(pages):
+            by_size[gray.shape].append(i)
+        results = [None] * len(pages)
+        for indices in by_size.values():
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start:start + batch_size]
+                colored = self._forward([pages[i][0] for i in chunk])
+                for i, result in zip(chunk, colored):
+                    results[i] = Image.fromarray(cv2.resize(result, pages[i][1], interpolation=cv2.INTER_AREA))
+        return results
 
-        with torch.no_grad():
-            fake_color, _ = self.colorizer(torch.cat([current_image, current_hint], 1))
-            fake_color = fake_color.detach()
+    def _forward(self, grays: List[np.ndarray]) -> List[np.ndarray]:
+        h, w = grays[0].shape
+        size = len(grays) * 5 * h * w
+        with self._buffer_lock:
+            if self._buffer.numel() < size:
+                self._buffer = torch.empty(size, device=self.device)
+            batch = self._buffer[:size].view(len(grays), 5, h, w)
+            # Earlier batches of other sizes leave values where the hint channels are now
+            batch[:, 1:] = 0
+            batch[:, 0] = torch.from_numpy(np.stack(grays)).to(self.device).float() / 255
+            with torch.no_grad():
+                fake_color, _ = self.colorizer(batch)
+        result = (fake_color.permute(0, 2, 3, 1) * 0.5 + 0.5).clamp(0, 1) * 255
+        return list(result.cpu().numpy().astype(np.uint8))
 
-        result = fake_color[0].detach().cpu().permute(1, 2, 0) * 0.5 + 0.5
 
-        if current_pad[0] != 0:
-            result = result[:-current_pad[0]]
-        if current_pad[1] != 0:
-            result = result[:, :-current_pad[1]]
+def get_colorization_sizes(width: int, height: int, colorization_size: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    Returns the size of the colorized page and the size it is colorized at.
+    The page is scaled so that its width is `colorization_size` (its height 1.5
+    times that for landscape pages) and then stretched to the closest multiple of
+    32 the network needs, rather than padded, so that no computation is spent on
+    padding and pages with the same aspect ratio can be batched.
+    """
+    # Size has to be multiple of 32
+    max_size = min(width, height)
+    max_size -= max_size % 32
+    if colorization_size > 0:
+        size = min(max_size, colorization_size - (colorization_size % 32))
+    else:
+        # size<=576 gives best results
+        size = min(max_size, 576)
+    size = max(size, 32)
 
-        colored_image = result.numpy() * 255
-        return Image.fromarray(colored_image.astype(np.uint8))
+    if height < width:
+        output_size = (int(np.ceil(width * size * 1.5 / height)), int(size * 1.5))
+    else:
+        output_size = (size, int(np.ceil(height * size / width)))
+    inference_size = tuple(max(32, int(round(s / 32)) * 32) for s in output_size)
+    return output_size, inference_size
@@ -0,0 +1,79 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from . import dispatch_batch
+from ..utils import get_logger
+
+logger = get_logger('colorization')
+
+
+class ColorizationPrefetcher:
+    """
+    Colorizes the pages of a folder ahead of the rest of the pipeline. A background
+    task colorizes the pages in batches of `batch_size` while earlier pages are
+    translated, staying at most `lookahead` pages ahead of the page being translated.
+    Pages that failed to be colorized ahead are colorized inline as before.
+    """
+
+    def __init__(self, colorizer_key: str, paths: List[str], device: str, batch_size: int, lookahead: int = None, **kwargs):
+        self.colorizer_key = colorizer_key
+        self.paths = paths
+        self.device = device
+        self.batch_size = max(batch_size, 1)
+        self.lookahead = max(lookahead or 2 * self.batch_size, self.batch_size)
+        self.kwargs = kwargs
+        self._results: Dict[str, asyncio.Future] = {}
+        self._consumed = 0
+        self._progress = asyncio.Condition()
+        self._task = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._results = {path: loop.create_future() for path in self.paths}
+        self._task = asyncio.create_task(self._run(dict(self._results)))
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def get(self, path: str) -> Optional[Image.Image]:
+        """Returns the colorized page or None if it wasn't colorized ahead."""
+        future = self._results.pop(path, None)
+        if future is None:
+            return None
+        result = await future
+        async with self._progress:
+            self._consumed += 1
+            self._progress.notify_all()
+        return result
+
+    async def _run(self, futures: Dict[str, asyncio.Future]):
+        for start in range(0, len(self.paths), self.batch_size):
+            async with self._progress:
+                await self._progress.wait_for(lambda: start - self._consumed < self.lookahead)
+            chunk = self.paths[start:start + self.batch_size]
+            images = {}
+            for path in chunk:
+                try:
+                    images[path] = Image.open(path)
+                    images[path].load()
+                except Exception:
+                    # Not an image, left to the pipeline
+                    pass
+            colorized = {}
+            if images:
+                try:
+                    results = await dispatch_batch(self.colorizer_key, list(images.values()), self.device, **self.kwargs)
+                    colorized = dict(zip(images, results))
+                except Exception as e:
+                    logger.warning(f'Failed to colorize pages ahead: {e}')
+            for path in chunk:
+                if not futures[path].done():
+                    futures[path].set_result(colorized.get(path))
@@ -0,0 +1,188 @@
+"""
+Detection of duplicate and near-duplicate pages of a volume, such as repeated
+chapter title or credit pages and the same illustration at two resolutions.
+Pages are grouped by the Hamming distance of their perceptual hashes and only
+the representative of each group is translated. Its result is reprojected onto
+the other pages after checking that they really show the same content, since
+pages that only differ in their text (e.g. the chapter number) hash alike.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import imagehash
+import numpy as np
+from PIL import Image
+
+from .utils import get_logger
+
+logger = get_logger('dedup')
+
+HASH_SIZE = 16
+# Size of the longest side pages are compared at
+COMPARE_SIZE = 1024
+COMPARE_BLOCK = 32
+# Largest mean difference (0-255) of a block of aligned duplicates
+BLOCK_TOLERANCE = 20
+
+
+def load_page(path: str) -> Optional[Image.Image]:
+    try:
+        img = Image.open(path)
+        img.load()
+        return img
+    except Exception:
+        return None
+
+
+def compute_hashes(paths: List[str], hash_size: int = HASH_SIZE) -> Tuple[Dict[str, np.ndarray], Dict[str, Tuple[int, int]]]:
+    """
+    Returns the perceptual hash bits and the size of every readable image.
+    """
+    hashes, sizes = {}, {}
+    for path in paths:
+        img = load_page(path)
+        if img is None:
+            continue
+        hashes[path] = imagehash.phash(img, hash_size=hash_size).hash.flatten()
+        sizes[path] = img.size
+    return hashes, sizes
+
+
+def cluster_hashes(hashes: Dict[str, np.ndarray], threshold: int) -> List[List[str]]:
+    """
+    Groups the pages whose hashes are within `threshold` bits of each other,
+    transitively. Only groups of at least two pages are returned, in page order.
+    """
+    paths = list(hashes)
+    if len(paths) < 2:
+        return []
+    bits = np.stack([hashes[path] for path in paths])
+    parent = list(range(len(paths)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(paths) - 1):
+        distances = np.count_nonzero(bits[i + 1:] != bits[i], axis=1)
+        for j in np.nonzero(distances <= threshold)[0] + i + 1:
+            parent[find(j)] = find(i)
+
+    clusters = {}
+    for i, path in enumerate(paths):
+        clusters.setdefault(find(i), []).append(path)
+    return [cluster for cluster in clusters.values() if len(cluster) > 1]
+
+
+def _to_gray(img: Image.Image) -> np.ndarray:
+    return np.array(img.convert('L'))
+
+
+def scale_matrix(source: Image.Image, target: Image.Image) -> Optional[np.ndarray]:
+    """Returns the 2x3 affine matrix that scales `source` onto `target` if they have the same aspect ratio."""
+    sw, sh = source.size
+    tw, th = target.size
+    if abs(sw / sh - tw / th) > 0.01 * tw / th:
+        return None
+    return np.array([[tw / sw, 0, 0], [0, th / sh, 0]], dtype=np.float64)
+
+
+def feature_matrix(source: Image.Image, target: Image.Image) -> Optional[np.ndarray]:
+    """Returns the 2x3 affine matrix that maps `source` onto `target` estimated from matched features."""
+    orb = cv2.ORB_create(2000)
+    kp1, des1 = orb.detectAndCompute(_to_gray(source), None)
+    kp2, des2 = orb.detectAndCompute(_to_gray(target), None)
+    if des1 is None or des2 is None:
+        return None
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(des1, des2)
+    if len(matches) < 10:
+        return None
+    src = np.float32([kp1[m.queryIdx].pt for m in matches])
+    dst = np.float32([kp2[m.trainIdx].pt for m in matches])
+    matrix, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3)
+    if matrix is None or inliers.sum() < 10:
+        return None
+    return matrix
+
+
+def warp_page(img: Image.Image, matrix: np.ndarray, size: Tuple[int, int]) -> Image.Image:
+    """Reprojects `img` into a page of `size` with an affine matrix."""
+    mode = 'RGBA' if img.mode in ('RGBA', 'LA') else 'RGB'
+    warped = cv2.warpAffine(np.array(img.convert(mode)), matrix, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return Image.fromarray(warped)
+
+
+def is_same_content(source: Image.Image, target: Image.Image, matrix: np.ndarray) -> bool:
+    """
+    Compares the aligned pages block by block, so that a single changed word
+    isn't averaged away by the rest of the page.
+    """
+    scale = min(COMPARE_SIZE / max(target.size), 1)
+    size = (max(int(target.width * scale), 1), max(int(target.height * scale), 1))
+    matrix = matrix * scale
+    warped = cv2.warpAffine(_to_gray(source), matrix, size, flags=cv2.INTER_LINEAR)
+    coverage = cv2.warpAffine(np.full(source.size[::-1], 255, dtype=np.uint8), matrix, size, flags=cv2.INTER_NEAREST)
+    # The representative has to cover the whole page for its result to be reused
+    if np.count_nonzero(coverage) < 0.99 * coverage.size:
+        return False
+    reference = cv2.resize(_to_gray(target), size, interpolation=cv2.INTER_AREA)
+    diff = cv2.absdiff(cv2.GaussianBlur(warped, (3, 3), 0), cv2.GaussianBlur(reference, (3, 3), 0)).astype(np.float32)
+    blocks = cv2.resize(diff, (max(size[0] // COMPARE_BLOCK, 1), max(size[1] // COMPARE_BLOCK, 1)), interpolation=cv2.INTER_AREA)
+    return blocks.max() <= BLOCK_TOLERANCE
+
+
+class PageDeduplicator:
+    """
+    Finds the near-duplicate pages among `paths` and reprojects the translation
+    of a group's representative, its largest page, onto the other pages.
+    """
+
+    def __init__(self, paths: List[str], threshold: int):
+        hashes, sizes = compute_hashes(paths)
+        self.clusters = []
+        self.representatives: Dict[str, str] = {}
+        for cluster in cluster_hashes(hashes, threshold):
+            representative = max(cluster, key=lambda path: sizes[path][0] * sizes[path][1])
+            self.clusters.append([representative] + [path for path in cluster if path != representative])
+            for path in cluster:
+                if path != representative:
+                    self.representatives[path] = representative
+        self.reused = 0
+        self.rejected = 0
+
+    def representative_of(self, path: str) -> Optional[str]:
+        return self.representatives.get(path)
+
+    def reproject(self, path: str, translated_path: str) -> Optional[Image.Image]:
+        """
+        Returns the translation of the page at `path` reprojected from the
+        translation of its representative or None if it has to be translated.
+        """
+        representative = self.representatives[path]
+        source, target, translated = load_page(representative), load_page(path), load_page(translated_path)
+        if source is None or target is None or translated is None:
+            return None
+        # Plain rescales are the most common, trimmed or shifted pages need their features matched
+        for align in (scale_matrix, feature_matrix):
+            matrix = align(source, target)
+            if matrix is not None and is_same_content(source, target, matrix):
+                break
+        else:
+            self.rejected += 1
+            logger.info(f'"{path}" differs from "{representative}", translating it separately')
+            return None
+        # The translation may have been saved at another size than its source
+        sx, sy = source.width / translated.width, source.height / translated.height
+        matrix = matrix @ np.array([[sx, 0, 0], [0, sy, 0], [0, 0, 1]])
+        self.reused += 1
+        return warp_page(translated, matrix, target.size)
+
+    def log_report(self):
+        duplicates = sum(len(cluster) - 1 for cluster in self.clusters)
+        logger.info(f'Duplicate pages: {len(self.clusters)} groups with {duplicates} duplicates, '
+                    f'{self.reused} translations reused, {self.rejected} pages translated separately')
+        for cluster in self.clusters:
+            logger.info(f'  {cluster[0]}: {", ".join(cluster[1:])}')
@@ -1,19 +1,18 @@
+import cv2
 import numpy as np
+from typing import List, Tuple
 
-from .default import DefaultDetector
-from .dbnet_convnext import DBConvNextDetector
-from .ctd import ComicTextDetector
-from .craft import CRAFTDetector
-from .none import NoneDetector
 from .common import CommonDetector, OfflineDetector
+from .panel_finder import find_panels, pad_panel
+from ..utils import LazyRegistry, Quadrilateral, get_panel_indices
 
-DETECTORS = {
-    'default': DefaultDetector,
-    'dbconvnext': DBConvNextDetector,
-    'ctd': ComicTextDetector,
-    'craft': CRAFTDetector,
-    'none': NoneDetector,
-}
+DETECTORS = LazyRegistry(__name__, {
+    'default': '.default:DefaultDetector',
+    'dbconvnext': '.dbnet_convnext:DBConvNextDetector',
+    'ctd': '.ctd:ComicTextDetector',
+    'craft': '.craft:CRAFTDetector',
+    'none': '.none:NoneDetector',
+})
 detector_cache = {}
 
 def get_detector(key: str, *args, **kwargs) -> CommonDetector:
@@ -35,3 +34,84 @@ async def dispatch(detector_key: str, image: np.ndarray, detect_size: int, text_
     if isinstance(detector, OfflineDetector):
         await detector.load(device)
     return await detector.detect(image, detect_size, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct, rotate, auto_rotate, verbose)
+
+async def dispatch_text_presence(detector_key: str, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float,
+                                 unclip_ratio: float, device: str = 'cpu', verbose: bool = False) -> float:
+    detector = get_detector(detector_key)
+    if isinstance(detector, OfflineDetector):
+        await detector.load(device)
+    return await detector.text_presence(image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose)
+
+# Pixels added around panels before detecting and inpainting them, to not cut off text touching the border
+PANEL_PADDING = 16
+# Dark or light pixels the area outside of the panels needs to be searched for text, e.g. narration in the gutters
+PANEL_GUTTER_MIN_INK = 50
+
+async def dispatch_panels(detector_key: str, image: np.ndarray, panels: List[Tuple[int, int, int, int]], detect_size: int, text_threshold: float,
+                          box_threshold: float, unclip_ratio: float, invert: bool, gamma_correct: bool, rotate: bool, auto_rotate: bool = False,
+                          device: str = 'cpu', verbose: bool = False):
+    '''
+    Runs the detection on every panel instead of the whole page and returns the
+    textlines and masks in page coordinates. The detection size is scaled down
+    with the panel so that text keeps the resolution it would have on the page.
+    Text outside of the panels is detected on the page with the panels blanked out.
+    '''
+    height, width = image.shape[:2]
+    textlines = []
+    raw_mask = np.zeros((height, width), dtype=np.uint8)
+    mask = None
+    covered = np.zeros((height, width), dtype=bool)
+    for panel in panels:
+        x1, y1, x2, y2 = pad_panel(panel, PANEL_PADDING, width, height)
+        covered[y1:y2, x1:x2] = True
+
+    def add_masks(x1, y1, x2, y2, part_raw_mask, part_mask, keep=None):
+        nonlocal mask
+        # The masks can come at the detection resolution
+        if part_raw_mask.ndim == 3:
+            part_raw_mask = part_raw_mask[:, :, 0]
+        part_raw_mask = cv2.resize(part_raw_mask.astype(np.uint8), (x2 - x1, y2 - y1), interpolation=cv2.INTER_LINEAR)
+        if keep is not None:
+            part_raw_mask[~keep] = 0
+        raw_mask[y1:y2, x1:x2] = np.maximum(raw_mask[y1:y2, x1:x2], part_raw_mask)
+        if part_mask is not None:
+            if mask is None:
+                mask = np.zeros((height, width), dtype=np.uint8)
+            part_mask = cv2.resize(part_mask.astype(np.uint8), (x2 - x1, y2 - y1), interpolation=cv2.INTER_LINEAR)
+            if keep is not None:
+                part_mask[~keep] = 0
+            mask[y1:y2, x1:x2] = np.maximum(mask[y1:y2, x1:x2], part_mask)
+
+    for panel_idx, panel in enumerate(panels):
+        x1, y1, x2, y2 = pad_panel(panel, PANEL_PADDING, width, height)
+        panel_size = max(32, round(detect_size * max(x2 - x1, y2 - y1) / max(width, height)))
+        panel_textlines, panel_raw_mask, panel_mask = await dispatch(detector_key, np.ascontiguousarray(image[y1:y2, x1:x2]), panel_size, text_threshold,
+                                                                     box_threshold, unclip_ratio, invert, gamma_correct, rotate, auto_rotate,
+                                                                     device, verbose)
+        for txtln in panel_textlines:
+            txtln = Quadrilateral(txtln.pts + np.array([x1, y1]), txtln.text, txtln.prob)
+            panel_of = get_panel_indices(txtln.centroid, panels)[0]
+            # The padding overlaps other panels, keep textlines only for the panel they are in. Textlines outside of
+            # all panels are kept once.
+            if panel_of == panel_idx or panel_of == -1 and not any(
+                    (t.xyxy[0] <= txtln.centroid[0] <= t.xyxy[2] and t.xyxy[1] <= txtln.centroid[1] <= t.xyxy[3]) for t in textlines):
+                textlines.append(txtln)
+        add_masks(x1, y1, x2, y2, panel_raw_mask, panel_mask)
+
+    # Text further outside of the panels than the padding, which find_panels allows for up to half of the page
+    if not covered.all():
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        background = int(np.median(gray[~covered]))
+        ink = np.count_nonzero(np.abs(gray[~covered].astype(np.int16) - background) > 64)
+        if ink >= PANEL_GUTTER_MIN_INK:
+            gutters = image.copy()
+            gutters[covered] = background
+            gutter_textlines, gutter_raw_mask, gutter_mask = await dispatch(detector_key, gutters, detect_size, text_threshold, box_threshold,
+                                                                            unclip_ratio, invert, gamma_correct, rotate, auto_rotate,
+                                                                            device, verbose)
+            for txtln in gutter_textlines:
+                x, y = np.clip(np.round(txtln.centroid).astype(int), 0, [width - 1, height - 1])
+                if not covered[y, x]:
+                    textlines.append(txtln)
+            add_masks(0, 0, width, height, gutter_raw_mask, gutter_mask, keep=~covered)
+    return textlines, raw_mask, mask
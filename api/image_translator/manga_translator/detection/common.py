@@ -1,11 +1,15 @@
+import os
 from abc import abstractmethod
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from collections import Counter
 import numpy as np
 import cv2
 
 from ..utils import InfererModule, ModelWrapper, Quadrilateral
 
+# Detection size of the pre-pass that decides the orientation for auto rotation
+ORIENTATION_DETECT_SIZE = int(os.getenv('MT_DET_ORIENTATION_SIZE', 640))
+
 
 class CommonDetector(InfererModule):
 
@@ -15,9 +19,27 @@ class CommonDetector(InfererModule):
         Returns textblock list and text mask.
         '''
 
+        if auto_rotate:
+            # Rotate if horizontal aspect ratios are prevalent to potentially improve detection.
+            # The orientation is taken from a downscaled pre-pass, so that the full detection only runs once.
+            orientation = None
+            if detect_size > ORIENTATION_DETECT_SIZE:
+                orientation = await self.detect_orientation(image, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct,
+                                                             verbose, detect_size=ORIENTATION_DETECT_SIZE)
+            if orientation is None:
+                # At the final size the pre-pass would be the full detection itself, and text too small to survive the
+                # downscale is voted on at the full size too. That detection is kept if it ran with the right rotation.
+                textlines, raw_mask, mask = await self.detect(image, detect_size, text_threshold, box_threshold, unclip_ratio,
+                                                              invert, gamma_correct, rotate, auto_rotate=False, verbose=verbose)
+                orientation = self._majority_orientation(textlines)
+                if orientation is None or (orientation == 'h') == rotate:
+                    return textlines, raw_mask, mask
+            rotate = orientation == 'h'
+            if rotate:
+                self.logger.info('Running detection with 90° rotation')
+
         # Apply filters
         img_h, img_w = image.shape[:2]
-        orig_image = image.copy()
         minimum_image_size = 400
         # Automatically add border if image too small (instead of simply resizing due to them more likely containing large fonts)
         add_border = min(img_w, img_h) < minimum_image_size
@@ -47,22 +69,45 @@ class CommonDetector(InfererModule):
         # Remove filters
         if add_border:
             textlines, raw_mask, mask = self._remove_border(image, img_w, img_h, textlines, raw_mask, mask)
-        if auto_rotate:
-            # Rotate if horizontal aspect ratios are prevalent to potentially improve detection
-            if len(textlines) > 0:
-                orientations = ['h' if txtln.aspect_ratio > 1 else 'v' for txtln in textlines]
-                majority_orientation = Counter(orientations).most_common(1)[0][0]
-            else:
-                majority_orientation = 'h'
-            if majority_orientation == 'h':
-                self.logger.info('Rerunning detection with 90° rotation')
-                return await self.detect(orig_image, detect_size, text_threshold, box_threshold, unclip_ratio, invert, gamma_correct,
-                                         rotate=(not rotate), auto_rotate=False, verbose=verbose)
         if rotate:
             textlines, raw_mask, mask = self._remove_rotation(textlines, raw_mask, mask, img_w, img_h)
 
         return textlines, raw_mask, mask
 
+    async def detect_orientation(self, image: np.ndarray, text_threshold: float, box_threshold: float, unclip_ratio: float,
+                                 invert: bool = False, gamma_correct: bool = False, verbose: bool = False,
+                                 detect_size: int = ORIENTATION_DETECT_SIZE) -> Optional[str]:
+        '''
+        Returns the prevalent textline orientation of the unrotated image ('h' or 'v')
+        from a detection pass at a small `detect_size`, or None if no text was found.
+        Aspect ratios don't depend on the resolution, so this costs a fraction of the
+        full detection.
+        '''
+        textlines, _, _ = await self.detect(image, detect_size, text_threshold, box_threshold, unclip_ratio,
+                                            invert, gamma_correct, rotate=False, auto_rotate=False, verbose=verbose)
+        return self._majority_orientation(textlines)
+
+    @staticmethod
+    def _majority_orientation(textlines: List[Quadrilateral]) -> Optional[str]:
+        if not textlines:
+            return None
+        orientations = ['h' if txtln.aspect_ratio > 1 else 'v' for txtln in textlines]
+        return Counter(orientations).most_common(1)[0][0]
+
+    async def text_presence(self, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float,
+                            unclip_ratio: float, verbose: bool = False) -> float:
+        '''
+        Returns how confident a detection pass at a small `detect_size` is that the image
+        contains text, from 0 to 1. Used to skip textless pages before running the pipeline.
+        '''
+        textlines, raw_mask, _ = await self.detect(image, detect_size, text_threshold, box_threshold, unclip_ratio,
+                                                   invert=False, gamma_correct=False, rotate=False, verbose=verbose)
+        score = max((float(txtln.prob) for txtln in textlines), default=0)
+        if raw_mask is not None and raw_mask.size:
+            # Small text that doesn't form a textline at this resolution still shows up in the probability map
+            score = max(score, float(np.percentile(raw_mask, 99.99)) / 255)
+        return min(score, 1)
+
     @abstractmethod
     async def _detect(self, image: np.ndarray, detect_size: int, text_threshold: float, box_threshold: float,
                       unclip_ratio: float, verbose: bool = False) -> Tuple[List[Quadrilateral], np.ndarray, np.ndarray]:
@@ -19,7 +19,7 @@ from typing import List, Tuple
 from .default_utils.DBNet_resnet34 import TextDetection as TextDetectionDefault
 from .default_utils import imgproc, dbnet_utils, craft_utils
 from .common import OfflineDetector
-from ..utils import TextBlock, Quadrilateral, det_rearrange_forward
+from ..utils import TextBlock, Quadrilateral, det_rearrange_forward, load_weights, load_state_dict
 from shapely.geometry import Polygon, MultiPoint
 from shapely import affinity
 
@@ -132,10 +132,10 @@ class CRAFTDetector(OfflineDetector):
 
     async def _load(self, device: str):
         self.model = CRAFT()
-        self.model.load_state_dict(copyStateDict(torch.load(self._get_file_path('craft_mlt_25k.pth'), map_location='cpu')))
+        load_state_dict(self.model, copyStateDict(load_weights(self._get_file_path('craft_mlt_25k.pth'))))
         self.model.eval()
         self.model_refiner = RefineNet()
-        self.model_refiner.load_state_dict(copyStateDict(torch.load(self._get_file_path('craft_refiner_CTW1500.pth'), map_location='cpu')))
+        load_state_dict(self.model_refiner, copyStateDict(load_weights(self._get_file_path('craft_refiner_CTW1500.pth'))))
         self.model_refiner.eval()
         self.device = device
         if device == 'cuda' or device == 'mps':
@@ -9,7 +9,7 @@ from typing import List, Tuple
 from .default_utils.DBNet_resnet34 import TextDetection as TextDetectionDefault
 from .default_utils import imgproc, dbnet_utils, craft_utils
 from .common import OfflineDetector
-from ..utils import TextBlock, Quadrilateral, det_rearrange_forward
+from ..utils import TextBlock, Quadrilateral, det_rearrange_forward, load_weights, load_state_dict
 
 MODEL = None
 def det_batch_forward_default(batch: np.ndarray, device: str):
@@ -41,8 +41,8 @@ class DefaultDetector(OfflineDetector):
 
     async def _load(self, device: str):
         self.model = TextDetectionDefault()
-        sd = torch.load(self._get_file_path('detect.ckpt'), map_location='cpu')
-        self.model.load_state_dict(sd['model'] if 'model' in sd else sd)
+        sd = load_weights(self._get_file_path('detect.ckpt'))
+        load_state_dict(self.model, sd['model'] if 'model' in sd else sd)
         self.model.eval()
         self.device = device
         if device == 'cuda' or device == 'mps':
@@ -98,6 +98,9 @@ class SegDetectorRepresenter():
         '''
         _bitmap: single map with shape (H, W),
             whose values are binarized as {0, 1}
+
+        Still fits, scores and unclips one contour at a time, only the ordering,
+        scaling and clipping of the remaining boxes run on all of them at once.
         '''
 
         assert len(_bitmap.shape) == 2
@@ -114,33 +117,42 @@ class SegDetectorRepresenter():
         num_contours = min(len(contours), self.max_candidates)
         boxes = np.zeros((num_contours, 4, 2), dtype=np.int64)
         scores = np.zeros((num_contours,), dtype=np.float32)
-
-        for index in range(num_contours):
-            contour = contours[index].squeeze(1)
-            points, sside = self.get_mini_boxes(contour)
-            if sside < self.min_size:
-                continue
-            points = np.array(points)
-            score = self.box_score_fast(pred, contour)
-            if self.box_thresh > score:
-                continue
-
-            box = self.unclip(points, unclip_ratio=self.unclip_ratio).reshape(-1, 1, 2)
-            box, sside = self.get_mini_boxes(box)
-            if sside < self.min_size + 2:
-                continue
-            box = np.array(box)
-            if not isinstance(dest_width, int):
-                dest_width = dest_width.item()
-                dest_height = dest_height.item()
-
-            box[:, 0] = np.clip(np.round(box[:, 0] / width * dest_width), 0, dest_width)
-            box[:, 1] = np.clip(np.round(box[:, 1] / height * dest_height), 0, dest_height)
-            startidx = box.sum(axis=1).argmin()
-            box = np.roll(box, 4-startidx, 0)
-            box = np.array(box)
-            boxes[index, :, :] = box.astype(np.int64)
-            scores[index] = score
+        if num_contours == 0:
+            return boxes, scores
+        contours = [contour.squeeze(1) for contour in contours[:num_contours]]
+
+        rects = [cv2.minAreaRect(contour) for contour in contours]
+        indices = np.flatnonzero(np.array([min(rect[1]) for rect in rects]) >= self.min_size)
+        if len(indices) == 0:
+            return boxes, scores
+        candidate_scores = np.array([self.box_score_fast(pred, contours[i]) for i in indices])
+        keep = candidate_scores >= self.box_thresh
+        indices = indices[keep]
+        candidate_scores = candidate_scores[keep]
+        if len(indices) == 0:
+            return boxes, scores
+
+        points = self.order_box_points(np.array([cv2.boxPoints(rects[i]) for i in indices]))
+        rects = [cv2.minAreaRect(self.unclip(box, unclip_ratio=self.unclip_ratio).reshape(-1, 1, 2)) for box in points]
+        keep = np.array([min(rect[1]) for rect in rects]) >= self.min_size + 2
+        if not keep.any():
+            return boxes, scores
+        indices = indices[keep]
+        candidate_scores = candidate_scores[keep]
+        box = self.order_box_points(np.array([cv2.boxPoints(rect) for rect, k in zip(rects, keep) if k]))
+
+        if not isinstance(dest_width, int):
+            dest_width = dest_width.item()
+            dest_height = dest_height.item()
+
+        box[:, :, 0] = np.clip(np.round(box[:, :, 0] / width * dest_width), 0, dest_width)
+        box[:, :, 1] = np.clip(np.round(box[:, :, 1] / height * dest_height), 0, dest_height)
+        # Start with the top left point
+        startidx = box.sum(axis=2).argmin(axis=1)
+        order = (np.arange(4)[None] + startidx[:, None]) % 4
+        box = np.take_along_axis(box, order[:, :, None], axis=1)
+        boxes[indices] = box.astype(np.int64)
+        scores[indices] = candidate_scores
         return boxes, scores
 
     def unclip(self, box, unclip_ratio=1.8):
@@ -172,13 +184,29 @@ class SegDetectorRepresenter():
         box = [points[index_1], points[index_2], points[index_3], points[index_4]]
         return box, min(bounding_box[1])
 
+    def order_box_points(self, points):
+        '''
+        Orders the corners of a batch of boxes (N, 4, 2) like get_mini_boxes.
+        '''
+        # Stable like sorted() in get_mini_boxes
+        points = np.take_along_axis(points, np.argsort(points[:, :, 0], axis=1, kind='stable')[:, :, None], axis=1)
+        left = points[:, 1, 1] > points[:, 0, 1]
+        right = points[:, 3, 1] > points[:, 2, 1]
+        order = np.stack([
+            np.where(left, 0, 1),
+            np.where(right, 2, 3),
+            np.where(right, 3, 2),
+            np.where(left, 1, 0),
+        ], axis=1)
+        return np.take_along_axis(points, order[:, :, None], axis=1)
+
     def box_score_fast(self, bitmap, _box):
         h, w = bitmap.shape[:2]
         box = _box.copy()
-        xmin = np.clip(np.floor(box[:, 0].min()).astype(np.int32), 0, w - 1)
-        xmax = np.clip(np.ceil(box[:, 0].max()).astype(np.int32), 0, w - 1)
-        ymin = np.clip(np.floor(box[:, 1].min()).astype(np.int32), 0, h - 1)
-        ymax = np.clip(np.ceil(box[:, 1].max()).astype(np.int32), 0, h - 1)
+        xmin = min(max(int(np.floor(box[:, 0].min())), 0), w - 1)
+        xmax = min(max(int(np.ceil(box[:, 0].max())), 0), w - 1)
+        ymin = min(max(int(np.floor(box[:, 1].min())), 0), h - 1)
+        ymax = min(max(int(np.ceil(box[:, 1].max())), 0), h - 1)
 
         mask = np.zeros((ymax - ymin + 1, xmax - xmin + 1), dtype=np.uint8)
         box[:, 0] = box[:, 0] - xmin
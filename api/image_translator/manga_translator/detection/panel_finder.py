@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import List, Tuple
 import sys
 
 import cv2 as cv
@@ -7,6 +8,8 @@ from PIL import Image
 
 KERNEL_SIZE = 7
 BORDER_SIZE = 10
+# Pages whose panels cover less than this share aren't split (splash pages, illustrations)
+MIN_PANEL_COVERAGE = 0.5
 
 
 def panel_process_image(img: Image.Image):
@@ -98,6 +101,41 @@ def calc_panel_contours(im: Image.Image):
     return contours
 
 
+def find_panels(img: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    """Finds the panels of a page.
+
+    Args:
+        img: The page.
+
+    Returns:
+        The bounding boxes (x, y, w, h) of the panels in reading order, clipped
+        to the page. Empty if the page doesn't split into at least two panels.
+    """
+
+    height, width = img.shape[:2]
+    panels = []
+    for contour in calc_panel_contours(img):
+        x, y, w, h = cv.boundingRect(contour)
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, width), min(y + h, height)
+        if x2 > x1 and y2 > y1:
+            panels.append((x1, y1, x2 - x1, y2 - y1))
+    if len(panels) < 2:
+        return []
+    coverage = np.zeros((height, width), dtype=bool)
+    for x, y, w, h in panels:
+        coverage[y:y + h, x:x + w] = True
+    if coverage.mean() < MIN_PANEL_COVERAGE:
+        return []
+    return panels
+
+
+def pad_panel(panel: Tuple[int, int, int, int], padding: int, width: int, height: int) -> Tuple[int, int, int, int]:
+    """Returns the panel extended by `padding` on every side as (x1, y1, x2, y2), clipped to the page."""
+    x, y, w, h = panel
+    return max(x - padding, 0), max(y - padding, 0), min(x + w + padding, width), min(y + h + padding, height)
+
+
 def determine_panel_order_from_contours(contours):
     """
     build a tree of regions that are determined vertically
@@ -168,6 +206,9 @@ def order_panels(contours, img_gray):
       their vertical position.
     """
 
+    if not contours:
+        return []
+
     # Get the bounding boxes for each contour.
     bounding_boxes = [cv.boundingRect(contour) for contour in contours]
 
@@ -0,0 +1,196 @@
+"""
+Pre- and post-translation dictionaries. A dictionary file has one entry per
+line, a regular expression and its replacement, which are applied in order.
+Files are parsed once and reloaded when they change. Runs of consecutive
+literal entries that can't affect each other are matched in a single pass
+over the text, which gives the same result as applying them one by one.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from .utils import get_logger
+
+logger = get_logger('dictionary')
+
+# Longer literal entries are applied on their own, the conflict checks grow quadratically with the length
+MAX_LITERAL_LENGTH = 64
+
+
+def parse_dictionary(file_path: str) -> List[Tuple[str, str]]:
+    """Returns the (pattern, replacement) entries of a dictionary file."""
+    entries = []
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            # Ignore empty lines and lines starting with '#' or '//'
+            if not line.strip() or line.strip().startswith('#') or line.strip().startswith('//'):
+                continue
+            # Remove comment parts
+            line = line.split('#')[0].strip()
+            line = line.split('//')[0].strip()
+            parts = line.split()
+            if len(parts) == 1:
+                # If there is only the left part, the right part defaults to an empty string, meaning delete the left part
+                entries.append((parts[0], ''))
+            elif len(parts) == 2:
+                entries.append((parts[0], parts[1]))
+            else:
+                logger.error(f'Invalid dictionary entry at line {line_number}: {line.strip()}')
+    return entries
+
+
+def is_literal(pattern: str, replacement: str) -> bool:
+    """Whether the entry matches and replaces plain text, i.e. neither side has regex syntax."""
+    return 0 < len(pattern) <= MAX_LITERAL_LENGTH and re.escape(pattern) == pattern and '\\' not in replacement
+
+
+def _substrings(text: str) -> Set[str]:
+    return {text[i:j] for i in range(len(text)) for j in range(i + 1, len(text) + 1)}
+
+
+class _Overlaps:
+    """Strings that a later pattern must not overlap with in any alignment."""
+
+    def __init__(self):
+        self.strings = set()
+        self.substrings = set()
+        self.prefixes = set()
+        self.suffixes = set()
+
+    def add(self, text: str):
+        self.strings.add(text)
+        self.substrings |= _substrings(text)
+        self.prefixes.update(text[:k] for k in range(1, len(text)))
+        self.suffixes.update(text[-k:] for k in range(1, len(text)))
+
+    def overlaps(self, pattern: str) -> bool:
+        if pattern in self.substrings:
+            return True
+        if any(s in self.strings for s in _substrings(pattern)):
+            return True
+        return any(pattern[-k:] in self.prefixes or pattern[:k] in self.suffixes for k in range(1, len(pattern)))
+
+
+def _trie_regex(words: List[str]) -> str:
+    """
+    Alternation of `words` factored into a trie, so that the regex engine
+    tries one branch per character instead of every word. None of the words
+    may be a prefix of another.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        if len(branches) <= 1:
+            return ''.join(branches)
+        return '(?:' + '|'.join(branches) + ')'
+
+    return build(trie)
+
+
+class _LiteralBlock:
+    """Consecutive literal entries applied in one pass."""
+
+    def __init__(self):
+        self.replacements: Dict[str, str] = {}
+        self._patterns = _Overlaps()
+        self._replacements = _Overlaps()
+        self._deletes = False
+        self.regex = None
+
+    def accepts(self, pattern: str) -> bool:
+        """
+        Whether `pattern` can be matched together with the entries of the block.
+        It must not overlap their patterns, else it would take matches away from
+        an earlier entry, nor their replacements or the text joined around a
+        deletion, which it would only match when applied after them.
+        """
+        if self._deletes and len(pattern) > 1:
+            return False
+        return not self._patterns.overlaps(pattern) and not self._replacements.overlaps(pattern)
+
+    def add(self, pattern: str, replacement: str):
+        self.replacements[pattern] = replacement
+        self._patterns.add(pattern)
+        if replacement:
+            self._replacements.add(replacement)
+        else:
+            self._deletes = True
+
+    def compile(self):
+        self.regex = re.compile(_trie_regex(list(self.replacements)))
+        # The overlap sets are only needed while building
+        self._patterns = self._replacements = None
+
+    def sub(self, text: str) -> str:
+        return self.regex.sub(lambda m: self.replacements[m.group(0)], text)
+
+
+class Dictionary:
+    """
+    Compiled dictionary entries. Applying it gives the same result as applying
+    every entry in order with `re.sub`.
+    """
+
+    def __init__(self, entries: List[Tuple[str, str]]):
+        self.entries = entries
+        self.steps: List[Union[_LiteralBlock, Tuple[re.Pattern, str]]] = []
+        block = None
+        for pattern, replacement in entries:
+            if is_literal(pattern, replacement):
+                if block is None or not block.accepts(pattern):
+                    block = _LiteralBlock()
+                    self.steps.append(block)
+                block.add(pattern, replacement)
+            else:
+                block = None
+                self.steps.append((re.compile(pattern), replacement))
+        for step in self.steps:
+            if isinstance(step, _LiteralBlock):
+                step.compile()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def apply(self, text: str) -> str:
+        for step in self.steps:
+            if isinstance(step, _LiteralBlock):
+                text = step.sub(text)
+            else:
+                pattern, replacement = step
+                text = pattern.sub(replacement, text)
+        return text
+
+
+EMPTY_DICTIONARY = Dictionary([])
+
+_cache: Dict[str, Tuple[Tuple[int, int], Dictionary]] = {}
+
+
+def load_dictionary(file_path: Optional[str]) -> Dictionary:
+    """
+    Returns the compiled dictionary of `file_path`, which is only parsed again
+    once the file has been modified.
+    """
+    if not file_path or not os.path.exists(file_path):
+        return EMPTY_DICTIONARY
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    dictionary = Dictionary(parse_dictionary(path))
+    literals = sum(len(step.replacements) for step in dictionary.steps if isinstance(step, _LiteralBlock))
+    logger.info(f'Loaded dictionary "{file_path}": {len(dictionary)} entries, '
+                f'{literals} literals in {len(dictionary.steps)} passes')
+    _cache[path] = (version, dictionary)
+    return dictionary
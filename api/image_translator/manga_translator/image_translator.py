@@ -11,6 +11,7 @@ from .extract_images import extract_images_as_png
 from .replace_images import replace_images_in_epub
 from .save import OUTPUT_FORMATS
 from .translators import VALID_LANGUAGES, TRANSLATORS
+from .translators.http_client import close_http_client
 
 def url_decode(s):
     s = unquote(s)
@@ -57,6 +58,10 @@ def parse_args():
     parser.add_argument('-f', '--format', default=None, choices=OUTPUT_FORMATS, help='Output format of the translation.')
     parser.add_argument('--overwrite', action='store_true', help='Overwrite already translated images in batch mode.')
 
+    parser.add_argument('--skip-textless', action='store_true', help='Leave images that a fast low resolution detection pass finds textless untouched')
+    parser.add_argument('--textless-threshold', default=0.3, type=float, help='Images with a text confidence below this value (0 to 1) are skipped with --skip-textless')
+    parser.add_argument('--dedup', action='store_true', help='Translate only one of the duplicate or near-duplicate images and reuse its translation for the others')
+    parser.add_argument('--dedup-threshold', default=6, type=int, help='Largest Hamming distance of the perceptual hashes (256 bits) of images considered duplicates')
     parser.add_argument('--unclip-ratio', default=2.3, type=float, help='How much to extend text skeleton to form bounding box')
     parser.add_argument('--box-threshold', default=0.8, type=float, help='Threshold for bbox generation')
     parser.add_argument('--text-threshold', default=0.85, type=float, help='Threshold for text detection')
@@ -73,6 +78,20 @@ def parse_args():
 
     return parser, DEFAULT_ARGS
 
+def apply_dictionaries(translator: MangaTranslator, pre_dict, post_dict):
+    # Proceed with dictionary application even if textlines are not available
+    if hasattr(translator, 'textlines') and translator.textlines:
+        # Apply pre-translation dictionaries to textlines
+        for textline in translator.textlines:
+            textline.text = translator.apply_dictionary(textline.text, pre_dict)
+            logger.info(f'Pre-translation dictionary applied: {textline.text}')
+
+        # Apply post-translation dictionaries to textlines
+        for textline in translator.textlines:
+            textline.translation = translator.apply_dictionary(textline.translation, post_dict)
+            logger.info(f'Post-translation dictionary applied: {textline.translation}')
+    # No warning if textlines is empty or missing, just skip dictionary application.
+
 # Function to execute the translation pipeline
 async def dispatch(args: Namespace):
     # Directly access the args properties
@@ -93,29 +112,32 @@ async def dispatch(args: Namespace):
         # Ignore any warnings related to the images directory processing
         warnings.filterwarnings("ignore", category=UserWarning)
 
+        if args.dedup:
+            # Duplicates are found across the whole folder, so it is translated at once.
+            # A failing page mustn't abort the rest of the volume, as in the loop below.
+            ignore_errors = translator.ignore_errors
+            translator.ignore_errors = True
+            try:
+                await translator.translate_path(args.input_images, dest, vars(args))
+            finally:
+                translator.ignore_errors = ignore_errors
+            apply_dictionaries(translator, pre_dict, post_dict)
+            return
+
         for path in natural_sort(args.input_images):
             try:
                 image_path = os.path.join(args.input_images, path)
                 # Apply translation
                 await translator.translate_path(image_path, dest, vars(args))
-
-                # Proceed with dictionary application even if textlines are not available
-                if hasattr(translator, 'textlines') and translator.textlines:
-                    # Apply pre-translation dictionaries to textlines
-                    for textline in translator.textlines:
-                        textline.text = translator.apply_dictionary(textline.text, pre_dict)
-                        logger.info(f'Pre-translation dictionary applied: {textline.text}')
-
-                    # Apply post-translation dictionaries to textlines
-                    for textline in translator.textlines:
-                        textline.translation = translator.apply_dictionary(textline.translation, post_dict)
-                        logger.info(f'Post-translation dictionary applied: {textline.translation}')
-                # No warning if textlines is empty or missing, just skip dictionary application.
+                apply_dictionaries(translator, pre_dict, post_dict)
 
             except Exception as e:
                 # Catch any exception that occurs, but do not stop the process
                 logger.debug(f'Error processing {path}: {e}', exc_info=True)  # Log as debug, not error
 
+        if args.skip_textless:
+            translator.log_triage_report()
+
     else:
         logger.error(f"Mode '{args.mode}' is not supported in this script.")
         raise ValueError(f"Mode '{args.mode}' is not supported.")
@@ -140,6 +162,8 @@ async def execute_pipeline(args):
 
     except Exception as e:
         logger.error(f"An error occurred: {e}", exc_info=True)
+    finally:
+        await close_http_client()
 
 # Main function to run the pipeline
 def main():
@@ -1,20 +1,18 @@
 import numpy as np
+from typing import List, Tuple
 
 from .common import CommonInpainter, OfflineInpainter
-from .inpainting_aot import AotInpainter
-from .inpainting_lama_mpe import LamaMPEInpainter, LamaLargeInpainter
-from .inpainting_sd import StableDiffusionInpainter
-from .none import NoneInpainter
-from .original import OriginalInpainter
+from ..detection.panel_finder import pad_panel
+from ..utils import LazyRegistry
 
-INPAINTERS = {
-    'default': AotInpainter,
-    'lama_large': LamaLargeInpainter,
-    'lama_mpe': LamaMPEInpainter,
-    'sd': StableDiffusionInpainter,
-    'none': NoneInpainter,
-    'original': OriginalInpainter,
-}
+INPAINTERS = LazyRegistry(__name__, {
+    'default': '.inpainting_aot:AotInpainter',
+    'lama_large': '.inpainting_lama_mpe:LamaLargeInpainter',
+    'lama_mpe': '.inpainting_lama_mpe:LamaMPEInpainter',
+    'sd': '.inpainting_sd:StableDiffusionInpainter',
+    'none': '.none:NoneInpainter',
+    'original': '.original:OriginalInpainter',
+})
 inpainter_cache = {}
 
 def get_inpainter(key: str, *args, **kwargs) -> CommonInpainter:
@@ -36,3 +34,29 @@ async def dispatch(inpainter_key: str, image: np.ndarray, mask: np.ndarray, inpa
     if isinstance(inpainter, OfflineInpainter):
         await inpainter.load(device)
     return await inpainter.inpaint(image, mask, inpainting_size, verbose)
+
+async def dispatch_panels(inpainter_key: str, image: np.ndarray, mask: np.ndarray, panels: List[Tuple[int, int, int, int]], inpainting_size: int = 1024,
+                          device: str = 'cpu', verbose: bool = False, padding: int = 16) -> np.ndarray:
+    '''
+    Inpaints every panel with text on its own instead of the whole page. Masked
+    pixels outside of all panels are inpainted on the page afterwards.
+    '''
+    height, width = image.shape[:2]
+    result = image.copy()
+    remaining = mask.copy()
+    for panel in panels:
+        x1, y1, x2, y2 = pad_panel(panel, padding, width, height)
+        panel_mask = mask[y1:y2, x1:x2]
+        remaining[y1:y2, x1:x2] = 0
+        if not panel_mask.any():
+            continue
+        panel_size = max(64, round(inpainting_size * max(x2 - x1, y2 - y1) / max(width, height)))
+        inpainted = await dispatch(inpainter_key, np.ascontiguousarray(image[y1:y2, x1:x2]), np.ascontiguousarray(panel_mask),
+                                   panel_size, device, verbose)
+        masked = panel_mask > 0
+        result[y1:y2, x1:x2][masked] = inpainted[masked]
+    if remaining.any():
+        inpainted = await dispatch(inpainter_key, result, remaining, inpainting_size, device, verbose)
+        masked = remaining > 0
+        result[masked] = inpainted[masked]
+    return result
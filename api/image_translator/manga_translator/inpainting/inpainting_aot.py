@@ -7,6 +7,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from .inpainting_lama_mpe import LamaMPEInpainter
+from ..utils import load_weights, load_state_dict
 
 class AotInpainter(LamaMPEInpainter):
     _MODEL_MAPPING = {
@@ -25,8 +26,8 @@ class AotInpainter(LamaMPEInpainter):
 
     async def _load(self, device: str):
         self.model = AOTGenerator()
-        sd = torch.load(self._get_file_path('inpainting.ckpt'), map_location='cpu')
-        self.model.load_state_dict(sd['model'] if 'model' in sd else sd)
+        sd = load_weights(self._get_file_path('inpainting.ckpt'))
+        load_state_dict(self.model, sd['model'] if 'model' in sd else sd)
         self.model.eval()
         self.device = device
         if device.startswith('cuda') or device == 'mps':
@@ -12,6 +12,7 @@ import random
 from kornia.geometry.transform import rotate
 
 from .inpainting_lama_mpe import LamaMPEInpainter
+from ..utils import load_weights, load_state_dict
 
 # Currently not used
 class LamaInpainter(LamaMPEInpainter):
@@ -25,8 +26,8 @@ class LamaInpainter(LamaMPEInpainter):
 
     async def _load(self, device: str):
         model = get_generator()
-        sd = torch.load(self._get_file_path('inpainting_lama.ckpt'), map_location='cpu')
-        model.load_state_dict(sd['model'] if 'model' in sd else sd)
+        sd = load_weights(self._get_file_path('inpainting_lama.ckpt'))
+        load_state_dict(model, sd['model'] if 'model' in sd else sd)
         self.model.eval()
         self.device = device
         if device.startswith('cuda') or device == 'mps':
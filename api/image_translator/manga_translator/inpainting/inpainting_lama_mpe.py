@@ -12,7 +12,7 @@ import shutil
 from torch import Tensor
 
 from .common import OfflineInpainter
-from ..utils import resize_keep_aspect
+from ..utils import resize_keep_aspect, load_weights, load_state_dict
 
 
 TORCH_DTYPE_MAP = {
@@ -813,9 +813,9 @@ class LamaFourier:
 
 def load_lama_mpe(model_path, device, use_mpe: bool = True, large_arch: bool = False) -> LamaFourier:
     model = LamaFourier(build_discriminator=False, use_mpe=use_mpe, large_arch=large_arch)
-    sd = torch.load(model_path, map_location = 'cpu')
-    model.generator.load_state_dict(sd['gen_state_dict'])
+    sd = load_weights(model_path)
+    load_state_dict(model.generator, sd['gen_state_dict'])
     if use_mpe:
-        model.mpe.load_state_dict(sd['str_state_dict'])
+        load_state_dict(model.mpe, sd['str_state_dict'])
     model.eval().to(device)
     return model
\ No newline at end of file
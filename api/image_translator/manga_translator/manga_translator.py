@@ -6,7 +6,6 @@ import cv2
 from aiohttp.web_middlewares import middleware
 from omegaconf import OmegaConf
 import langcodes
-import langdetect
 import requests
 import os
 import re
@@ -26,6 +25,7 @@ from .utils import (
     BASE_PATH,
     LANGUAGE_ORIENTATION_PRESETS,
     ModelWrapper,
+    model_residency,
     Context,
     PriorityLock,
     load_image,
@@ -40,26 +40,31 @@ from .utils import (
     get_color_name,
     natural_sort,
     sort_regions,
+    detect_languages,
 )
 
-from .detection import DETECTORS, dispatch as dispatch_detection, prepare as prepare_detection
-from .upscaling import dispatch as dispatch_upscaling, prepare as prepare_upscaling, UPSCALERS
-from .ocr import OCRS, dispatch as dispatch_ocr, prepare as prepare_ocr
+from .detection import DETECTORS, dispatch as dispatch_detection, dispatch_panels as dispatch_panel_detection, dispatch_text_presence, find_panels
+from .upscaling import dispatch as dispatch_upscaling, UPSCALERS
+from .ocr import OCRS, dispatch as dispatch_ocr
 from .textline_merge import dispatch as dispatch_textline_merge
 from .mask_refinement import dispatch as dispatch_mask_refinement
-from .inpainting import INPAINTERS, dispatch as dispatch_inpainting, prepare as prepare_inpainting
+from .inpainting import INPAINTERS, dispatch as dispatch_inpainting, dispatch_panels as dispatch_panel_inpainting
 from .translators import (
     TRANSLATORS,
     VALID_LANGUAGES,
-    LANGDETECT_MAP,
+    ISO_639_1_TO_VALID_LANGUAGES,
     LanguageUnsupportedException,
     TranslatorChain,
     dispatch as dispatch_translation,
-    prepare as prepare_translation,
 )
-from .colorization import dispatch as dispatch_colorization, prepare as prepare_colorization
+from .translators.http_client import close_http_client
+from .colorization import dispatch as dispatch_colorization
+from .colorization.prefetch import ColorizationPrefetcher
+from .model_manager import ModelManager
 from .rendering import dispatch as dispatch_rendering, dispatch_eng_render
 from .save import save_result
+from .dedup import PageDeduplicator
+from .dictionary import Dictionary, load_dictionary
 
 # Will be overwritten by __main__.py if module is being run directly (with python -m)
 logger = logging.getLogger('manga_translator')
@@ -87,6 +92,9 @@ class MangaTranslator:
         params = params or {}
         self.parse_init_params(params)
         self.result_sub_folder = ''
+        self.models = ModelManager()
+        self.triage_stats = {'pages': 0, 'skipped': 0}
+        self._colorization_prefetcher = None
 
         # The flag below controls whether to allow TF32 on matmul. This flag defaults to False
         # in PyTorch 1.12 and later.
@@ -110,6 +118,10 @@ class MangaTranslator:
                 'Is the correct pytorch version installed? (See https://pytorch.org/)')
         if params.get('model_dir'):
             ModelWrapper._MODEL_DIR = params.get('model_dir')
+        if params.get('model_mirror'):
+            ModelWrapper._MODEL_MIRROR = params.get('model_mirror')
+        if params.get('model_memory_budget'):
+            model_residency.budget = int(params.get('model_memory_budget') * 1024**3)
         self.kernel_size=int(params.get('kernel_size'))
         os.environ['INPAINTING_PRECISION'] = params.get('inpainting_precision', 'fp32')
 
@@ -161,7 +173,7 @@ class MangaTranslator:
             if os.path.exists(_dest) and not os.path.isdir(_dest):
                 raise FileExistsError(_dest)
 
-            translated_count = 0
+            pages = []
             for root, subdirs, files in os.walk(path):
                 files = natural_sort(files)
                 dest_root = replace_prefix(root, path, _dest)
@@ -173,14 +185,72 @@ class MangaTranslator:
                     file_path = os.path.join(root, f)
                     output_dest = replace_prefix(file_path, path, _dest)
                     p, ext = os.path.splitext(output_dest)
-                    output_dest = f'{p}.{file_ext or ext[1:]}'
+                    pages.append((file_path, f'{p}.{file_ext or ext[1:]}'))
+
+            dedup = None
+            if params.get('dedup'):
+                dedup = PageDeduplicator([file_path for file_path, _ in pages if not file_path.endswith('.txt')],
+                                         params.get('dedup_threshold', 6))
+                # Representatives are translated before the first page of their group
+                positions = {file_path: i for i, (file_path, _) in enumerate(pages)}
+                for cluster in dedup.clusters:
+                    positions[cluster[0]] = min(positions[p] for p in cluster) - 0.5
+                pages.sort(key=lambda page: positions[page[0]])
+            dests = dict(pages)
+
+            if params.get('colorizer') and params.get('colorize_ahead'):
+                # Pages that are already translated are skipped and not colorized
+                paths = [file_path for file_path, output_dest in pages
+                         if not file_path.endswith('.txt') and (params.get('overwrite') or not os.path.exists(output_dest))
+                         and not (dedup and dedup.representative_of(file_path))]
+                self._colorization_prefetcher = ColorizationPrefetcher(
+                    params['colorizer'], paths, self.device, params.get('colorization_batch_size', 4),
+                    colorization_size=params.get('colorization_size', 576), denoise_sigma=params.get('denoise_sigma', 30),
+                    colorization_batch_size=params.get('colorization_batch_size', 4))
+                self._colorization_prefetcher.start()
 
-                    if await self.translate_file(file_path, output_dest, params):
+            translated_count = 0
+            try:
+                for file_path, output_dest in pages:
+                    representative = dedup.representative_of(file_path) if dedup else None
+                    if representative and await self._reuse_duplicate(dedup, file_path, output_dest, dests[representative], params):
                         translated_count += 1
+                    elif await self.translate_file(file_path, output_dest, params):
+                        translated_count += 1
+            finally:
+                if self._colorization_prefetcher:
+                    await self._colorization_prefetcher.close()
+                    self._colorization_prefetcher = None
             if translated_count == 0:
                 logger.info('No further untranslated files found. Use --overwrite to write over existing translations.')
             else:
                 logger.info(f'Done. Translated {translated_count} image{"" if translated_count == 1 else "s"}')
+            if params.get('skip_textless'):
+                self.log_triage_report()
+            if dedup:
+                dedup.log_report()
+
+    async def _reuse_duplicate(self, dedup: PageDeduplicator, path: str, dest: str, representative_dest: str, params: dict) -> bool:
+        """
+        Saves the translation of the page's representative reprojected onto the page.
+        Returns False if the page has to be translated itself.
+        """
+        if not params.get('overwrite') and os.path.exists(dest):
+            logger.info(
+                f'Skipping as already translated: "{dest}". Use --overwrite to overwrite existing translations.')
+            await self._report_progress('saved', True)
+            return True
+        if not os.path.exists(representative_dest):
+            return False
+        result = dedup.reproject(path, representative_dest)
+        if result is None:
+            return False
+        # Only the save options are needed
+        ctx = Context(**{**DEFAULT_ARGS, **params})
+        logger.info(f'Saving "{dest}" from the translation of a duplicate page')
+        save_result(result, dest, ctx)
+        await self._report_progress('saved', True)
+        return True
 
     async def translate_file(self, path: str, dest: str, params: dict):
         if not params.get('overwrite') and os.path.exists(dest):
@@ -237,6 +307,8 @@ class MangaTranslator:
         # TODO: Add .gif handler
 
         else:  # Treat as image
+            if self._colorization_prefetcher:
+                ctx.img_colorized = await self._colorization_prefetcher.get(path)
             try:
                 img = Image.open(path)
                 img.verify()
@@ -292,46 +364,15 @@ class MangaTranslator:
         ctx.result = None
 
         # preload and download models (not strictly necessary, remove to lazy load)
-        logger.info('Loading models')
-        if ctx.upscale_ratio:
-            await prepare_upscaling(ctx.upscaler)
-        await prepare_detection(ctx.detector)
-        await prepare_ocr(ctx.ocr, self.device)
-        await prepare_inpainting(ctx.inpainter, self.device)
-        await prepare_translation(ctx.translator)
-        if ctx.colorizer:
-            await prepare_colorization(ctx.colorizer)
+        await self.models.ensure(ctx, self.device, 'cpu' if self._gpu_limited_memory else self.device)
         # translate
         return await self._translate(ctx)
 
-    def load_dictionary(self, file_path):
-        dictionary = []
-        if file_path and os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as file:
-                for line_number, line in enumerate(file, start=1):
-                    # Ignore empty lines and lines starting with '#' or '//'
-                    if not line.strip() or line.strip().startswith('#') or line.strip().startswith('//'):
-                        continue
-                    # Remove comment parts
-                    line = line.split('#')[0].strip()
-                    line = line.split('//')[0].strip()
-                    parts = line.split()
-                    if len(parts) == 1:
-                        # If there is only the left part, the right part defaults to an empty string, meaning delete the left part
-                        pattern = re.compile(parts[0])
-                        dictionary.append((pattern, ''))
-                    elif len(parts) == 2:
-                        # If both left and right parts are present, perform the replacement
-                        pattern = re.compile(parts[0])
-                        dictionary.append((pattern, parts[1]))
-                    else:
-                        logger.error(f'Invalid dictionary entry at line {line_number}: {line.strip()}')
-        return dictionary
+    def load_dictionary(self, file_path) -> Dictionary:
+        return load_dictionary(file_path)
 
-    def apply_dictionary(self, text, dictionary):
-        for pattern, value in dictionary:
-            text = pattern.sub(value, text)
-        return text
+    def apply_dictionary(self, text, dictionary: Dictionary):
+        return dictionary.apply(text)
 
     def _preprocess_params(self, ctx: Context):
         # params auto completion
@@ -383,10 +424,20 @@ class MangaTranslator:
 
     async def _translate(self, ctx: Context) -> Context:
 
+        # -- Textless page triage
+        textless = False
+        if ctx.skip_textless:
+            self.triage_stats['pages'] += 1
+            textless = await self._run_triage(ctx)
+            if textless:
+                self.triage_stats['skipped'] += 1
+
         # -- Colorization
         if ctx.colorizer:
             await self._report_progress('colorizing')
-            ctx.img_colorized = await self._run_colorizer(ctx)
+            # The page may have been colorized ahead
+            if ctx.img_colorized is None:
+                ctx.img_colorized = await self._run_colorizer(ctx)
         else:
             ctx.img_colorized = ctx.input
 
@@ -399,8 +450,20 @@ class MangaTranslator:
         else:
             ctx.upscaled = ctx.img_colorized
 
+        if textless:
+            await self._report_progress('skip-textless', True)
+            # Nothing to translate, but the page is colorized and scaled like the rest of the volume
+            ctx.result = ctx.upscaled
+            return await self._revert_upscale(ctx)
+
         ctx.img_rgb, ctx.img_alpha = load_image(ctx.upscaled)
 
+        # -- Panel detection
+        ctx.panels = []
+        if ctx.panel_split:
+            await self._report_progress('panel-detection')
+            ctx.panels = await self._run_panel_detection(ctx)
+
         # -- Detection
         await self._report_progress('detection')
         ctx.textlines, ctx.mask_raw, ctx.mask = await self._run_detection(ctx)
@@ -426,11 +489,10 @@ class MangaTranslator:
         if ctx.skip_lang is not None :
             filtered_textlines = []
             skip_langs = ctx.skip_lang.split(',')
-            for txtln in ctx.textlines :
-                try :
-                    source_language = LANGDETECT_MAP.get(langdetect.detect(txtln.text), 'UNKNOWN')
-                except Exception :
-                    source_language = 'UNKNOWN'
+            # Lines whose language can't be told with confidence are kept
+            langs = detect_languages([txtln.text for txtln in ctx.textlines])
+            for txtln, lang in zip(ctx.textlines, langs) :
+                source_language = ISO_639_1_TO_VALID_LANGUAGES.get(lang, 'UNKNOWN')
                 if source_language not in skip_langs :
                     filtered_textlines.append(txtln)
             ctx.textlines = filtered_textlines
@@ -519,13 +581,35 @@ class MangaTranslator:
 
         return ctx
 
+    async def _run_triage(self, ctx: Context) -> bool:
+        """Returns True if a low resolution detection pass is confident that the page has no text."""
+        img_rgb, _ = load_image(ctx.input)
+        score = await dispatch_text_presence(ctx.detector, img_rgb, min(ctx.triage_size, ctx.detection_size), ctx.text_threshold,
+                                             ctx.box_threshold, ctx.unclip_ratio, self.device, self.verbose)
+        logger.debug(f'Text confidence of triage pass: {score:.3f}')
+        return score < ctx.textless_threshold
+
+    def log_triage_report(self):
+        pages, skipped = self.triage_stats['pages'], self.triage_stats['skipped']
+        if pages:
+            logger.info(f'Skipped {skipped} of {pages} page{"" if pages == 1 else "s"} as textless ({skipped / pages:.0%})')
+
     async def _run_colorizer(self, ctx: Context):
         return await dispatch_colorization(ctx.colorizer, device=self.device, image=ctx.input, **ctx)
 
     async def _run_upscaling(self, ctx: Context):
         return (await dispatch_upscaling(ctx.upscaler, [ctx.img_colorized], ctx.upscale_ratio, self.device))[0]
 
+    async def _run_panel_detection(self, ctx: Context):
+        panels = find_panels(ctx.img_rgb)
+        logger.info(f'Found {len(panels)} panels' if panels else 'No panels found, using the whole page')
+        return panels
+
     async def _run_detection(self, ctx: Context):
+        if ctx.panels:
+            return await dispatch_panel_detection(ctx.detector, ctx.img_rgb, ctx.panels, ctx.detection_size, ctx.text_threshold,
+                                                  ctx.box_threshold, ctx.unclip_ratio, ctx.det_invert, ctx.det_gamma_correct,
+                                                  ctx.det_rotate, ctx.det_auto_rotate, self.device, self.verbose)
         return await dispatch_detection(ctx.detector, ctx.img_rgb, ctx.detection_size, ctx.text_threshold,
                                         ctx.box_threshold,
                                         ctx.unclip_ratio, ctx.det_invert, ctx.det_gamma_correct, ctx.det_rotate,
@@ -547,7 +631,7 @@ class MangaTranslator:
 
     async def _run_textline_merge(self, ctx: Context):
         text_regions = await dispatch_textline_merge(ctx.textlines, ctx.img_rgb.shape[1], ctx.img_rgb.shape[0],
-                                                     verbose=self.verbose)
+                                                     verbose=self.verbose, panels=ctx.panels)
         new_text_regions = []
         for region in text_regions:
             if len(region.text) >= ctx.min_text_length \
@@ -571,7 +655,7 @@ class MangaTranslator:
 
         # Sort ctd (comic text detector) regions left to right. Otherwise right to left.
         # Sorting will improve text translation quality.
-        text_regions = sort_regions(text_regions, right_to_left=True if ctx.detector != 'ctd' else False)
+        text_regions = sort_regions(text_regions, right_to_left=True if ctx.detector != 'ctd' else False, panels=ctx.panels)
         return text_regions
 
     async def _run_text_translation(self, ctx: Context):
@@ -737,6 +821,9 @@ class MangaTranslator:
                                               ctx.mask_dilation_offset, ctx.ignore_bubble, self.verbose,self.kernel_size)
 
     async def _run_inpainting(self, ctx: Context):
+        if ctx.panels:
+            return await dispatch_panel_inpainting(ctx.inpainter, ctx.img_rgb, ctx.mask, ctx.panels, ctx.inpainting_size,
+                                                   self.device, self.verbose)
         return await dispatch_inpainting(ctx.inpainter, ctx.img_rgb, ctx.mask, ctx.inpainting_size, self.device,
                                          self.verbose)
 
@@ -771,6 +858,7 @@ class MangaTranslator:
         # TODO: Pass ctx to logger hook
         LOG_MESSAGES = {
             'upscaling': 'Running upscaling',
+            'panel-detection': 'Running panel detection',
             'detection': 'Running text detection',
             'ocr': 'Running ocr',
             'mask-generation': 'Running mask refinement',
@@ -781,6 +869,7 @@ class MangaTranslator:
         }
         LOG_MESSAGES_SKIP = {
             'skip-no-regions': 'No text regions! - Skipping',
+            'skip-textless': 'Page looks textless! - Skipping',
             'skip-no-text': 'No text regions with text! - Skipping',
             'error-translating': 'Text translator returned empty queries',
             'cancelled': 'Image translation cancelled',
@@ -840,6 +929,9 @@ class MangaTranslatorWeb(MangaTranslator):
     Translator client that executes tasks on behalf of the webserver in web_main.py.
     """
 
+    # Seconds the webserver may hold a long-poll request open before answering without a result
+    LONG_POLL_TIMEOUT = 30
+
     def __init__(self, params: dict = None):
         super().__init__(params)
         self.host = params.get('host', '127.0.0.1')
@@ -847,6 +939,8 @@ class MangaTranslatorWeb(MangaTranslator):
             self.host = '127.0.0.1'
         self.port = params.get('port', 5003)
         self.nonce = params.get('nonce', '')
+        # Clients started by hand get an id of their own so the webserver can tell them apart
+        self.worker_id = params.get('worker_id') or f'external-{os.urandom(4).hex()}'
         self.ignore_errors = params.get('ignore_errors', True)
         self._task_id = None
         self._params = None
@@ -863,6 +957,7 @@ class MangaTranslatorWeb(MangaTranslator):
 
         data = {
             'nonce': self.nonce,
+            'worker_id': self.worker_id,
             'capabilities': {
                 'translators': available_translators,
             },
@@ -877,6 +972,7 @@ class MangaTranslatorWeb(MangaTranslator):
                 data = {
                     'task_id': self._task_id,
                     'nonce': self.nonce,
+                    'worker_id': self.worker_id,
                     'state': state,
                     'finished': finished,
                 }
@@ -891,8 +987,10 @@ class MangaTranslatorWeb(MangaTranslator):
 
     def _get_task(self):
         try:
-            rjson = requests.get(f'http://{self.host}:{self.port}/task-internal?nonce={self.nonce}',
-                                 timeout=3600).json()
+            rjson = requests.get(f'http://{self.host}:{self.port}/task-internal',
+                                 params={'nonce': self.nonce, 'worker_id': self.worker_id,
+                                         'wait': self.LONG_POLL_TIMEOUT},
+                                 timeout=self.LONG_POLL_TIMEOUT + 20).json()
             return rjson.get('task_id'), rjson.get('data')
         except Exception:
             return None, None
@@ -906,36 +1004,40 @@ class MangaTranslatorWeb(MangaTranslator):
         await self._init_connection()
         self.add_progress_hook(self._send_state)
 
-        while True:
-            self._task_id, self._params = self._get_task()
-            if self._params and 'exit' in self._params:
-                break
-            if not (self._task_id and self._params):
-                await asyncio.sleep(0.1)
-                continue
+        try:
+            while True:
+                self._task_id, self._params = self._get_task()
+                if self._params and 'exit' in self._params:
+                    break
+                if not (self._task_id and self._params):
+                    # Requests are long-polled, so this only throttles retries after errors
+                    await asyncio.sleep(0.1)
+                    continue
 
-            self.result_sub_folder = self._task_id
-            logger.info(f'Processing task {self._task_id}')
-            if translation_params is not None:
-                # Combine default params with params chosen by webserver
-                for p, default_value in translation_params.items():
-                    current_value = self._params.get(p)
-                    self._params[p] = current_value if current_value is not None else default_value
-            if self.verbose:
-                # Write log file
-                log_file = self._result_path('log.txt')
-                add_file_logger(log_file)
+                self.result_sub_folder = self._task_id
+                logger.info(f'Processing task {self._task_id}')
+                if translation_params is not None:
+                    # Combine default params with params chosen by webserver
+                    for p, default_value in translation_params.items():
+                        current_value = self._params.get(p)
+                        self._params[p] = current_value if current_value is not None else default_value
+                if self.verbose:
+                    # Write log file
+                    log_file = self._result_path('log.txt')
+                    add_file_logger(log_file)
 
-            # final.png will be renamed if format param is set
-            await self.translate_path(self._result_path('input.png'), self._result_path('final.png'),
-                                      params=self._params)
-            print()
+                # final.png will be renamed if format param is set
+                await self.translate_path(self._result_path('input.png'), self._result_path('final.png'),
+                                          params=self._params)
+                print()
 
-            if self.verbose:
-                remove_file_logger(log_file)
-            self._task_id = None
-            self._params = None
-            self.result_sub_folder = ''
+                if self.verbose:
+                    remove_file_logger(log_file)
+                self._task_id = None
+                self._params = None
+                self.result_sub_folder = ''
+        finally:
+            await close_http_client()
 
     async def _run_text_translation(self, ctx: Context):
         # Run machine translation as reference for manual translation (if `--translator=none` is not set)
@@ -956,7 +1058,7 @@ class MangaTranslatorWeb(MangaTranslator):
                 ret = requests.post(f'http://{self.host}:{self.port}/get-manual-result-internal', json={
                     'task_id': self._task_id,
                     'nonce': self.nonce
-                }, timeout=20).json()
+                }, params={'wait': self.LONG_POLL_TIMEOUT}, timeout=self.LONG_POLL_TIMEOUT + 20).json()
                 if 'result' in ret:
                     manual_translations = ret['result']
                     if isinstance(manual_translations, str):
@@ -1189,7 +1291,10 @@ class MangaTranslatorWS(MangaTranslator):
         ).start()
 
         # create a future that is never done
-        await future
+        try:
+            await future
+        finally:
+            await close_http_client()
 
     async def _run_text_translation(self, ctx: Context):
         coroutine = super()._run_text_translation(ctx)
@@ -1353,6 +1458,7 @@ class MangaTranslatorAPI(MangaTranslator):
         #     return await self.err_handling(self.file_exec, req, None)
 
         app.add_routes(routes)
+        app.on_cleanup.append(lambda app: close_http_client())
         web.run_app(app, host=self.host, port=self.port)
 
     async def run_translate(self, translation_params, img):
@@ -1467,6 +1573,7 @@ class MangaTranslatorAPI(MangaTranslator):
         target_lang = fields.Str(required=False, validate=lambda a: a.upper() in VALID_LANGUAGES)
         detector = fields.Str(required=False, validate=lambda a: a.lower() in DETECTORS)
         ocr = fields.Str(required=False, validate=lambda a: a.lower() in OCRS)
+        ocr_decoding = fields.Str(required=False, validate=lambda a: a.lower() in {'beam', 'greedy'})
         inpainter = fields.Str(required=False, validate=lambda a: a.lower() in INPAINTERS)
         upscaler = fields.Str(required=False, validate=lambda a: a.lower() in UPSCALERS)
         translator = fields.Str(required=False, validate=lambda a: a.lower() in TRANSLATORS)
@@ -1485,9 +1592,13 @@ class MangaTranslatorAPI(MangaTranslator):
         det_auto_rotate = fields.Bool(required=False)
         det_invert = fields.Bool(required=False)
         det_gamma_correct = fields.Bool(required=False)
+        panel_split = fields.Bool(required=False)
+        skip_textless = fields.Bool(required=False)
+        textless_threshold = fields.Float(required=False)
         min_text_length = fields.Integer(required=False)
         colorization_size = fields.Integer(required=False)
         denoise_sigma = fields.Integer(required=False)
+        colorization_batch_size = fields.Integer(required=False)
         mask_dilation_offset = fields.Integer(required=False)
         ignore_bubble = fields.Integer(required=False)
         gpt_config = fields.String(required=False)
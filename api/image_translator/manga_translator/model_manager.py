@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from .utils import Context, get_logger, model_residency
+from .detection import prepare as prepare_detection
+from .upscaling import prepare as prepare_upscaling
+from .ocr import prepare as prepare_ocr
+from .inpainting import prepare as prepare_inpainting
+from .translators import prepare as prepare_translation
+from .colorization import prepare as prepare_colorization
+
+
+class ModelManager:
+    """
+    Makes sure the models configured for a translation are downloaded and loaded,
+    but only does so once per process. A stage is only prepared again if its
+    model key or device changed since the last call, so translating many pages
+    with the same settings doesn't repeat the download checks and model loading.
+
+    ```py
+    manager = ModelManager()
+    await manager.ensure(ctx, device)
+    manager.readiness()  # {'detection': {'key': 'default', 'device': 'cuda', 'state': 'ready'}, ...}
+    ```
+    """
+
+    PREPARING = 'preparing'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    def __init__(self):
+        self.logger = get_logger(self.__class__.__name__)
+        # stage -> (key, device) that was prepared last
+        self._prepared: Dict[str, Tuple] = {}
+        # stage -> (state, (key, device)) of the last preparation attempt
+        self._states: Dict[str, Tuple[str, Tuple]] = {}
+        self._lock = asyncio.Lock()
+        self.stats = {
+            'calls': 0,
+            'prepare_calls': {},
+            'prepare_time': {},
+            'overhead': 0.,
+            'last_overhead': 0.,
+        }
+
+    def _required_stages(self, ctx: Context, device: str, translation_device: str) -> Dict[str, Tuple[Tuple, Callable[[], Awaitable]]]:
+        stages = {}
+        if ctx.colorizer:
+            stages['colorization'] = ((ctx.colorizer, device), lambda: prepare_colorization(ctx.colorizer))
+        if ctx.upscale_ratio:
+            stages['upscaling'] = ((ctx.upscaler, device), lambda: prepare_upscaling(ctx.upscaler))
+        stages['detection'] = ((ctx.detector, device), lambda: prepare_detection(ctx.detector))
+        stages['ocr'] = ((ctx.ocr, device), lambda: prepare_ocr(ctx.ocr, device))
+        stages['inpainting'] = ((ctx.inpainter, device), lambda: prepare_inpainting(ctx.inpainter, device))
+        chain = tuple(ctx.translator.chain)
+        stages['translation'] = ((chain, translation_device), lambda: prepare_translation(ctx.translator))
+        return stages
+
+    async def ensure(self, ctx: Context, device: str, translation_device: str = None):
+        """
+        Prepares every stage required by `ctx` whose model key or device
+        differs from what was prepared before.
+        """
+        start = time.perf_counter()
+        async with self._lock:
+            stages = self._required_stages(ctx, device, translation_device or device)
+            pending = {stage: v for stage, v in stages.items() if self._prepared.get(stage) != v[0]}
+            if pending:
+                self.logger.info('Loading models')
+            for stage, (signature, prepare) in pending.items():
+                self._states[stage] = (self.PREPARING, signature)
+                self._prepared.pop(stage, None)
+                stage_start = time.perf_counter()
+                try:
+                    await prepare()
+                except Exception:
+                    self._states[stage] = (self.FAILED, signature)
+                    raise
+                self._prepared[stage] = signature
+                self._states[stage] = (self.READY, signature)
+                self.stats['prepare_calls'][stage] = self.stats['prepare_calls'].get(stage, 0) + 1
+                self.stats['prepare_time'][stage] = self.stats['prepare_time'].get(stage, 0.) + time.perf_counter() - stage_start
+        overhead = time.perf_counter() - start
+        self.stats['calls'] += 1
+        self.stats['overhead'] += overhead
+        self.stats['last_overhead'] = overhead
+        self.logger.debug(f'Model preparation took {overhead * 1000:.2f}ms')
+
+    def invalidate(self, stage: str = None):
+        """Forces the given stage (or all stages) to be prepared again on the next call."""
+        if stage is None:
+            self._prepared.clear()
+            self._states.clear()
+        else:
+            self._prepared.pop(stage, None)
+            self._states.pop(stage, None)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._states) and all(state == self.READY for state, _ in self._states.values())
+
+    def readiness(self) -> Dict[str, dict]:
+        result = {}
+        for stage, (state, (key, device)) in self._states.items():
+            if isinstance(key, tuple):
+                key = ';'.join(f'{trans}:{lang}' for trans, lang in key)
+            result[stage] = {'key': key, 'device': device, 'state': state}
+        return result
+
+    def residency(self) -> List[dict]:
+        """Lists the models that are currently loaded in this process, see `ModelResidency`."""
+        return model_residency.report()
@@ -2,18 +2,15 @@ import numpy as np
 from typing import List
 
 from .common import CommonOCR, OfflineOCR
-from .model_32px import Model32pxOCR
-from .model_48px import Model48pxOCR
-from .model_48px_ctc import Model48pxCTCOCR
-from .model_manga_ocr import ModelMangaOCR
-from ..utils import Quadrilateral
+from .result_cache import OCRResultCache, ocr_result_cache, recognize_cached
+from ..utils import LazyRegistry, Quadrilateral
 
-OCRS = {
-    '32px': Model32pxOCR,
-    '48px': Model48pxOCR,
-    '48px_ctc': Model48pxCTCOCR,
-    'mocr': ModelMangaOCR,
-}
+OCRS = LazyRegistry(__name__, {
+    '32px': '.model_32px:Model32pxOCR',
+    '48px': '.model_48px:Model48pxOCR',
+    '48px_ctc': '.model_48px_ctc:Model48pxCTCOCR',
+    'mocr': '.model_manga_ocr:ModelMangaOCR',
+})
 ocr_cache = {}
 
 def get_ocr(key: str, *args, **kwargs) -> CommonOCR:
@@ -35,4 +32,5 @@ async def dispatch(ocr_key: str, image: np.ndarray, regions: List[Quadrilateral]
     if isinstance(ocr, OfflineOCR):
         await ocr.load(device)
     args = args or {}
-    return await ocr.recognize(image, regions, args, verbose)
+    ocr_result_cache.configure(args.get('ocr_cache_size'), args.get('ocr_cache', ocr_result_cache.path))
+    return await recognize_cached(ocr, ocr_key, image, regions, args, verbose)
@@ -1,15 +1,45 @@
+import cv2
 import numpy as np
 from abc import abstractmethod
-from typing import List, Union
+from typing import Dict, List, Tuple, Union
 from collections import Counter
 import networkx as nx
 import itertools
 
 from ..utils import InfererModule, TextBlock, ModelWrapper, Quadrilateral
 
+def estimate_text_colors(region: np.ndarray) -> Tuple[List[int], List[int]]:
+    """
+    Estimates the text and background color of a textline crop without a model.
+    The pixels are split by otsu thresholding, text being the smaller part.
+    """
+    gray = cv2.cvtColor(region, cv2.COLOR_RGB2GRAY)
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = mask > 0
+    if mask.sum() * 2 > mask.size:
+        mask = ~mask
+    pixels = region.reshape(-1, 3)
+    mask = mask.reshape(-1)
+    fg, bg = pixels[mask], pixels[~mask]
+    fg_color = fg.mean(axis=0) if len(fg) > 0 else np.zeros(3)
+    bg_color = bg.mean(axis=0) if len(bg) > 0 else np.full(3, 255)
+    return np.round(fg_color).astype(int).tolist(), np.round(bg_color).astype(int).tolist()
+
 class CommonOCR(InfererModule):
-    def _generate_text_direction(self, bboxes: List[Union[Quadrilateral, TextBlock]]):
-        if len(bboxes) > 0:
+    # Args that change the recognized text, part of the result cache key
+    _RESULT_CACHE_ARGS = ('ignore_bubble', 'ocr_decoding', 'use_mocr_48px_colors')
+
+    def _generate_text_direction(self, bboxes: List[Union[Quadrilateral, TextBlock]], directions: Dict[int, str] = None):
+        '''
+        Yields the textlines with the majority direction of their group in reading order.
+        `directions` maps the ids of textlines to precomputed directions, e.g.
+        of the whole page when only some of its textlines are recognized.
+        '''
+        if directions:
+            order = {key: i for i, key in enumerate(directions)}
+            for box in sorted(bboxes, key=lambda box: order[id(box)]):
+                yield box, directions[id(box)]
+        elif len(bboxes) > 0:
             if isinstance(bboxes[0], TextBlock):
                 for blk in bboxes:
                     for line_idx in range(len(blk.lines)):
@@ -37,6 +67,13 @@ class CommonOCR(InfererModule):
                     for node in nodes:
                         yield bboxes[node], majority_dir
 
+    def supports_result_cache(self, args: dict) -> bool:
+        '''
+        Whether the results can be cached per textline, i.e. `recognize` returns
+        (a subset of) the given textlines instead of new regions.
+        '''
+        return True
+
     async def recognize(self, image: np.ndarray, textlines: List[Quadrilateral], args: dict, verbose: bool = False) -> List[Quadrilateral]:
         '''
         Performs the optical character recognition, using the `textlines` as areas of interests.
@@ -12,7 +12,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from .common import OfflineOCR
-from ..utils import TextBlock, Quadrilateral, chunks
+from ..utils import TextBlock, Quadrilateral, chunks, load_weights, load_state_dict
 from ..utils.bubble import is_ignore
 
 class Model32pxOCR(OfflineOCR):
@@ -40,8 +40,8 @@ class Model32pxOCR(OfflineOCR):
             dictionary = [s[:-1] for s in fp.readlines()]
 
         self.model = OCR(dictionary, 768)
-        sd = torch.load(self._get_file_path('ocr.ckpt'), map_location = 'cpu')
-        self.model.load_state_dict(sd['model'] if 'model' in sd else sd)
+        sd = load_weights(self._get_file_path('ocr.ckpt'))
+        load_state_dict(self.model, sd['model'] if 'model' in sd else sd)
         self.model.eval()
         self.device = device
         if (device == 'cuda' or device == 'mps'):
@@ -60,7 +60,7 @@ class Model32pxOCR(OfflineOCR):
         max_chunk_size = 16
         ignore_bubble = args.get('ignore_bubble', 0)
 
-        quadrilaterals = list(self._generate_text_direction(textlines))
+        quadrilaterals = list(self._generate_text_direction(textlines, args.get('text_directions')))
         region_imgs = [q.get_transformed_region(image, d, text_height) for q, d in quadrilaterals]
         out_regions = []
 
@@ -17,12 +17,19 @@ from .xpos_relative_position import XPOS
 # Roformer with Xpos and Local Attention ViT
 
 from .common import OfflineOCR
-from ..utils import TextBlock, Quadrilateral, chunks
-from ..utils.generic import AvgMeter
+from ..utils import TextBlock, Quadrilateral, load_weights, load_state_dict
 from ..utils.bubble import is_ignore
 
 # Roformer with Xpos
 
+# Narrowest character width in pixels at a text height of 48, which bounds how many
+# characters a region can contain
+MIN_CHAR_WIDTH = 8
+
+def get_max_seq_length(width: int, limit: int) -> int:
+    # One more for the end token
+    return min(math.ceil(width / MIN_CHAR_WIDTH) + 1, limit)
+
 class Model48pxOCR(OfflineOCR):
     _MODEL_MAPPING = {
         'model': {
@@ -34,6 +41,9 @@ class Model48pxOCR(OfflineOCR):
             'hash': 'f5722368146aa0fbcc9f4726866e4efc3203318ebb66c811d8cbbe915576538a',
         },
     }
+    _MAX_SEQ_LENGTH = 255
+    _MAX_BATCH_SIZE = 64
+    _MAX_BATCH_WIDTH = 16 * 512
 
     def __init__(self, *args, **kwargs):
         os.makedirs(self.model_dir, exist_ok=True)
@@ -48,8 +58,11 @@ class Model48pxOCR(OfflineOCR):
             dictionary = [s[:-1] for s in fp.readlines()]
 
         self.model = OCR(dictionary, 768)
-        sd = torch.load(self._get_file_path('ocr_ar_48px.ckpt'))
-        self.model.load_state_dict(sd)
+        self._chars = np.array([' ' if ch == '<SP>' else ch for ch in dictionary], dtype = object)
+        self._start_ids = [i for i, ch in enumerate(dictionary) if ch == '<S>']
+        self._end_ids = [i for i, ch in enumerate(dictionary) if ch == '</S>']
+        sd = load_weights(self._get_file_path('ocr_ar_48px.ckpt'))
+        load_state_dict(self.model, sd)
         self.model.eval()
         self.device = device
         if (device == 'cuda' or device == 'mps'):
@@ -65,9 +78,9 @@ class Model48pxOCR(OfflineOCR):
     
     async def _infer(self, image: np.ndarray, textlines: List[Quadrilateral], args: dict, verbose: bool = False, ignore_bubble: int = 0) -> List[TextBlock]:
         text_height = 48
-        max_chunk_size = 16
+        decoding = args.get('ocr_decoding') or 'beam'
 
-        quadrilaterals = list(self._generate_text_direction(textlines))
+        quadrilaterals = list(self._generate_text_direction(textlines, args.get('text_directions')))
         region_imgs = [q.get_transformed_region(image, d, text_height) for q, d in quadrilaterals]
         out_regions = []
 
@@ -78,7 +91,7 @@ class Model48pxOCR(OfflineOCR):
             is_quadrilaterals = True
 
         ix = 0
-        for indices in chunks(perm, max_chunk_size):
+        for indices in self._batch_regions(perm, [img.shape[1] for img in region_imgs]):
             N = len(indices)
             widths = [region_imgs[i].shape[1] for i in indices]
             max_width = 4 * (max(widths) + 7) // 4
@@ -98,48 +111,16 @@ class Model48pxOCR(OfflineOCR):
             image_tensor = einops.rearrange(image_tensor, 'N H W C -> N C H W')
             if self.use_gpu:
                 image_tensor = image_tensor.to(self.device)
+            max_seq_lengths = [get_max_seq_length(w, self._MAX_SEQ_LENGTH) for w in widths]
             with torch.no_grad():
-                ret = self.model.infer_beam_batch_tensor(image_tensor, widths, beams_k = 5, max_seq_length = 255)
+                if decoding == 'greedy':
+                    ret = self.model.infer_greedy_batch_tensor(image_tensor, widths, max_seq_length = max_seq_lengths)
+                else:
+                    ret = self.model.infer_beam_batch_tensor(image_tensor, widths, beams_k = 5, max_seq_length = max(max_seq_lengths))
             for i, (pred_chars_index, prob, fg_pred, bg_pred, fg_ind_pred, bg_ind_pred) in enumerate(ret):
                 if prob < 0.2:
                     continue
-                has_fg = (fg_ind_pred[:, 1] > fg_ind_pred[:, 0])
-                has_bg = (bg_ind_pred[:, 1] > bg_ind_pred[:, 0])
-                seq = []
-                fr = AvgMeter()
-                fg = AvgMeter()
-                fb = AvgMeter()
-                br = AvgMeter()
-                bg = AvgMeter()
-                bb = AvgMeter()
-                for chid, c_fg, c_bg, h_fg, h_bg in zip(pred_chars_index, fg_pred, bg_pred, has_fg, has_bg) :
-                    ch = self.model.dictionary[chid]
-                    if ch == '<S>':
-                        continue
-                    if ch == '</S>':
-                        break
-                    if ch == '<SP>':
-                        ch = ' '
-                    seq.append(ch)
-                    if h_fg.item() :
-                        fr(int(c_fg[0] * 255))
-                        fg(int(c_fg[1] * 255))
-                        fb(int(c_fg[2] * 255))
-                    if h_bg.item() :
-                        br(int(c_bg[0] * 255))
-                        bg(int(c_bg[1] * 255))
-                        bb(int(c_bg[2] * 255))
-                    else :
-                        br(int(c_fg[0] * 255))
-                        bg(int(c_fg[1] * 255))
-                        bb(int(c_fg[2] * 255))
-                txt = ''.join(seq)
-                fr = min(max(int(fr()), 0), 255)
-                fg = min(max(int(fg()), 0), 255)
-                fb = min(max(int(fb()), 0), 255)
-                br = min(max(int(br()), 0), 255)
-                bg = min(max(int(bg()), 0), 255)
-                bb = min(max(int(bb()), 0), 255)
+                txt, (fr, fg, fb), (br, bg, bb) = self._decode_prediction(pred_chars_index, fg_pred, bg_pred, fg_ind_pred, bg_ind_pred)
                 self.logger.info(f'prob: {prob} {txt} fg: ({fr}, {fg}, {fb}) bg: ({br}, {bg}, {bb})')
                 cur_region = quadrilaterals[indices[i]][0]
                 if isinstance(cur_region, Quadrilateral):
@@ -161,6 +142,55 @@ class Model48pxOCR(OfflineOCR):
             return out_regions
         return textlines
 
+    def _batch_regions(self, indices: List[int], widths: List[int]):
+        """
+        Groups the regions into batches whose padded pixel width (batch size
+        times widest region) stays within _MAX_BATCH_WIDTH, so that batches of
+        short regions are larger than batches of long ones.
+        """
+        batch = []
+        batch_width = 0
+        for idx in indices:
+            width = max(batch_width, widths[idx])
+            if batch and (len(batch) >= self._MAX_BATCH_SIZE or width * (len(batch) + 1) > self._MAX_BATCH_WIDTH):
+                yield batch
+                batch = []
+                width = widths[idx]
+            batch.append(idx)
+            batch_width = width
+        if batch:
+            yield batch
+
+    def _decode_prediction(self, pred_chars_index: torch.Tensor, fg_pred: torch.Tensor, bg_pred: torch.Tensor,
+                           fg_ind_pred: torch.Tensor, bg_ind_pred: torch.Tensor) -> Tuple[str, List[int], List[int]]:
+        """
+        Returns the text and the average foreground and background colors of its characters.
+        """
+        chars = pred_chars_index.cpu().numpy()
+        n = min(len(chars), len(fg_pred))
+        chars = chars[:n]
+        end = np.flatnonzero(np.isin(chars, self._end_ids))
+        if len(end) > 0:
+            n = end[0]
+            chars = chars[:n]
+        keep = ~np.isin(chars, self._start_ids)
+        chars = chars[keep]
+
+        fg = (fg_pred[:n].float().cpu().numpy()[keep] * 255).astype(int)
+        bg = (bg_pred[:n].float().cpu().numpy()[keep] * 255).astype(int)
+        fg_ind = fg_ind_pred[:n].float().cpu().numpy()[keep]
+        bg_ind = bg_ind_pred[:n].float().cpu().numpy()[keep]
+        has_fg = fg_ind[:, 1] > fg_ind[:, 0]
+        has_bg = bg_ind[:, 1] > bg_ind[:, 0]
+        # Characters without a background use their foreground color instead
+        bg = np.where(has_bg[:, None], bg, fg)
+
+        fg_color = fg[has_fg].mean(axis = 0) if has_fg.any() else np.zeros(3)
+        bg_color = bg.mean(axis = 0) if len(bg) > 0 else np.zeros(3)
+        fg_color = np.clip(fg_color.astype(int), 0, 255).tolist()
+        bg_color = np.clip(bg_color.astype(int), 0, 255).tolist()
+        return ''.join(self._chars[chars]), fg_color, bg_color
+
 class ConvNeXtBlock(nn.Module):
     r""" ConvNeXt Block. There are two equivalent implementations:
     (1) DwConv -> LayerNorm (channels_first) -> 1x1 Conv -> GELU -> 1x1 Conv; all in (N, C, H, W)
@@ -657,7 +687,7 @@ class OCR(nn.Module):
             result.append((cur_hypo.out_idx[1:], cur_hypo.prob(), fg_pred[0], bg_pred[0], fg_ind_pred[0], bg_ind_pred[0]))
         return result
 
-    def infer_beam_batch_tensor(self, img: torch.FloatTensor, img_widths: List[int], beams_k: int = 5, start_tok = 1, end_tok = 2, pad_tok = 0, max_finished_hypos: int = 2, max_seq_length = 384):
+    def encode(self, img: torch.FloatTensor, img_widths: List[int]) -> Tuple[torch.Tensor, torch.BoolTensor]:
         N, C, H, W = img.shape
         assert H == 48 and C == 3
 
@@ -669,6 +699,63 @@ class OCR(nn.Module):
         for i, l in enumerate(valid_feats_length):
             input_mask[i, l:] = True
         memory = self.encoders(memory, input_mask) # N, W, Dim
+        return memory, input_mask
+
+    def infer_greedy_batch_tensor(self, img: torch.FloatTensor, img_widths: List[int], start_tok = 1, end_tok = 2, max_seq_length: Union[int, List[int]] = 384):
+        """
+        Greedy decoding that keeps only the most likely character at every step.
+        `max_seq_length` can be given per image, images are removed from the
+        batch as soon as they are finished.
+        """
+        N = img.shape[0]
+        memory, input_mask = self.encode(img, img_widths)
+        if isinstance(max_seq_length, int):
+            max_seq_length = [max_seq_length] * N
+        max_lengths = torch.tensor(max_seq_length, device=img.device)
+        S = max(max_seq_length)
+
+        out_idx = torch.full((N, S + 1), end_tok, dtype=torch.long, device=img.device)
+        out_idx[:, 0] = start_tok
+        log_probs = torch.zeros(N, device=img.device)
+        # Output of the last decoder layer, used for the color predictions
+        activations = torch.zeros(N, S, self.embd.embedding_dim, device=img.device)
+        cached_activations = torch.zeros(N, len(self.decoders) + 1, S, self.embd.embedding_dim, device=img.device)  # [N, L, S, E]
+        # Index of the image every remaining row belongs to
+        batch_index = torch.arange(N, device=img.device)
+        last_toks = out_idx[:, :1]
+
+        for step in range(S):
+            decoded, cached_activations = self.decoders(self.embd(last_toks), cached_activations, memory, input_mask, step)
+            pred_char_logprob = self.pred(self.pred1(decoded)).log_softmax(-1)
+            values, toks = pred_char_logprob.max(dim=-1)
+            out_idx[batch_index, step + 1] = toks
+            log_probs[batch_index] += values
+
+            finished = (toks == end_tok) | (max_lengths[batch_index] <= step + 1)
+            if finished.any():
+                activations[batch_index[finished]] = cached_activations[finished, -1]
+                remaining = ~finished
+                if not remaining.any():
+                    break
+                batch_index = batch_index[remaining]
+                cached_activations = cached_activations[remaining]
+                memory = memory[remaining]
+                input_mask = input_mask[remaining]
+                toks = toks[remaining]
+            last_toks = toks.unsqueeze(1)
+
+        color_feats = self.color_pred1(activations)
+        fg_pred, bg_pred, fg_ind_pred, bg_ind_pred = \
+            self.color_pred_fg(color_feats), \
+            self.color_pred_bg(color_feats), \
+            self.color_pred_fg_ind(color_feats), \
+            self.color_pred_bg_ind(color_feats)
+        probs = log_probs.exp().tolist()
+        return [(out_idx[i, 1:], probs[i], fg_pred[i], bg_pred[i], fg_ind_pred[i], bg_ind_pred[i]) for i in range(N)]
+
+    def infer_beam_batch_tensor(self, img: torch.FloatTensor, img_widths: List[int], beams_k: int = 5, start_tok = 1, end_tok = 2, pad_tok = 0, max_finished_hypos: int = 2, max_seq_length = 384):
+        N = img.shape[0]
+        memory, input_mask = self.encode(img, img_widths)
 
         out_idx = torch.full((N, 1), start_tok, dtype=torch.long, device=img.device)  # Shape [N, 1]
         cached_activations = torch.zeros(N, len(self.decoders)+1, max_seq_length, 320, device=img.device)  # [N, L, S, E]
@@ -753,6 +840,19 @@ class OCR(nn.Module):
             input_mask = input_mask.index_select(0, torch.tensor(remaining_indexs, device=img.device))
             batch_index = batch_index.index_select(0, torch.tensor(remaining_indexs, device=img.device))
 
+        # Samples that reached max_seq_length without finishing keep their best hypothesis
+        if len(finished_hypos) < N:
+            for i in range(N_remaining):
+                sample_idx = batch_index[beams_k * i].item()
+                if sample_idx in finished_hypos:
+                    continue
+                sample_log_probs = log_probs[i * beams_k: (i + 1) * beams_k, 0]
+                best_beam_idx = sample_log_probs.argmax()
+                finished_hypos[sample_idx] = \
+                    out_idx[i * beams_k + best_beam_idx], \
+                    torch.exp(sample_log_probs[best_beam_idx]).item(), \
+                    cached_activations[i * beams_k + best_beam_idx]
+
         # Ensure we have the correct number of finished hypotheses for each sample
         assert len(finished_hypos) == N
 
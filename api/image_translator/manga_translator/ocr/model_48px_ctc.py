@@ -11,7 +11,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from .common import OfflineOCR
-from ..utils import TextBlock, Quadrilateral, AvgMeter, chunks
+from ..utils import TextBlock, Quadrilateral, AvgMeter, chunks, load_weights, load_state_dict
 from ..utils.bubble import is_ignore
 
 class Model48pxCTCOCR(OfflineOCR):
@@ -39,12 +39,12 @@ class Model48pxCTCOCR(OfflineOCR):
             dictionary = [s[:-1] for s in fp.readlines()]
 
         self.model: OCR = OCR(dictionary, 768)
-        sd = torch.load(self._get_file_path('ocr-ctc.ckpt'), map_location = 'cpu')
+        sd = load_weights(self._get_file_path('ocr-ctc.ckpt'))
         sd = sd['model'] if 'model' in sd else sd
         del sd['encoders.layers.0.pe.pe']
         del sd['encoders.layers.1.pe.pe']
         del sd['encoders.layers.2.pe.pe']
-        self.model.load_state_dict(sd, strict = False)
+        load_state_dict(self.model, sd, strict = False)
         self.model.eval()
         self.device = device
         if (device == 'cuda' or device == 'mps'):
@@ -63,7 +63,7 @@ class Model48pxCTCOCR(OfflineOCR):
         max_chunk_size = 16
         ignore_bubble = args.get('ignore_bubble', 0)
 
-        quadrilaterals = list(self._generate_text_direction(textlines))
+        quadrilaterals = list(self._generate_text_direction(textlines, args.get('text_directions')))
         region_imgs = [q.get_transformed_region(image, d, text_height) for q, d in quadrilaterals]
         out_regions = []
 
@@ -16,13 +16,14 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from manga_ocr import MangaOcr
+from manga_ocr.ocr import post_process
 
 from .xpos_relative_position import XPOS
 
-from .common import OfflineOCR
+from .common import OfflineOCR, estimate_text_colors
 from .model_48px import OCR
 from ..textline_merge import split_text_region
-from ..utils import TextBlock, Quadrilateral, quadrilateral_can_merge_region, chunks
+from ..utils import TextBlock, Quadrilateral, quadrilateral_can_merge_region, chunks, load_weights, load_state_dict
 from ..utils.generic import AvgMeter
 from ..utils.bubble import is_ignore
 
@@ -111,47 +112,73 @@ class ModelMangaOCR(OfflineOCR):
             shutil.move('alphabet-all-v7.txt', self._get_file_path('alphabet-all-v7.txt'))
         super().__init__(*args, **kwargs)
 
-    async def _load(self, device: str):
-        with open(self._get_file_path('alphabet-all-v7.txt'), 'r', encoding = 'utf-8') as fp:
-            dictionary = [s[:-1] for s in fp.readlines()]
+    _BATCH_SIZE = 16
+    _MAX_LENGTH = 300
 
-        self.model = OCR(dictionary, 768)
+    async def _load(self, device: str):
         self.mocr = MangaOcr()
-        sd = torch.load(self._get_file_path('ocr_ar_48px.ckpt'))
-        self.model.load_state_dict(sd)
-        self.model.eval()
         self.device = device
         if (device == 'cuda' or device == 'mps'):
             self.use_gpu = True
         else:
             self.use_gpu = False
-        if self.use_gpu:
-            self.model = self.model.to(device)
+        # The 48px model is only loaded once its colors are requested
+        self.model = None
 
+    def _load_color_model(self):
+        with open(self._get_file_path('alphabet-all-v7.txt'), 'r', encoding = 'utf-8') as fp:
+            dictionary = [s[:-1] for s in fp.readlines()]
+
+        self.model = OCR(dictionary, 768)
+        sd = load_weights(self._get_file_path('ocr_ar_48px.ckpt'))
+        load_state_dict(self.model, sd)
+        self.model.eval()
+        if self.use_gpu:
+            self.model = self.model.to(self.device)
 
     async def _unload(self):
         del self.model
         del self.mocr
-    
-    async def _infer(self, image: np.ndarray, textlines: List[Quadrilateral], args: dict, verbose: bool = False, ignore_bubble: int = 0) -> List[TextBlock]:
-        text_height = 48
-        max_chunk_size = 16
 
-        quadrilaterals = list(self._generate_text_direction(textlines))
-        region_imgs = [q.get_transformed_region(image, d, text_height) for q, d in quadrilaterals]
+    def supports_result_cache(self, args: dict) -> bool:
+        # Merged textlines are returned as new regions
+        return not args.get('use_mocr_merge', False)
+
+    def _recognize_batch(self, imgs: List[np.ndarray]) -> Tuple[List[str], List[float]]:
+        """
+        Runs manga-ocr over padded batches of crops. Returns the texts and their
+        confidence, the geometric mean of the token probabilities.
+        """
+        texts = []
+        probs = []
+        model = self.mocr.model
+        pad_token_id = model.config.pad_token_id
+        for batch in chunks(imgs, self._BATCH_SIZE):
+            images = [Image.fromarray(img).convert('L').convert('RGB') for img in batch]
+            pixel_values = self.mocr.processor(images, return_tensors = 'pt').pixel_values.to(model.device)
+            with torch.no_grad():
+                out = model.generate(pixel_values, max_length = self._MAX_LENGTH, output_scores = True, return_dict_in_generate = True)
+            sequences = out.sequences
+            # N, T
+            token_logprobs = torch.stack([
+                scores.log_softmax(-1).gather(1, sequences[:, t + 1: t + 2]).squeeze(1) for t, scores in enumerate(out.scores)
+            ], dim = 1)
+            valid = sequences[:, 1:] != pad_token_id
+            mean_logprobs = (token_logprobs * valid).sum(1) / valid.sum(1).clamp(min = 1)
+            probs.extend(mean_logprobs.exp().tolist())
+            for seq in sequences.cpu():
+                texts.append(post_process(self.mocr.tokenizer.decode(seq, skip_special_tokens = True)))
+        return texts, probs
+
+    async def _infer(self, image: np.ndarray, textlines: List[Quadrilateral], args: dict, verbose: bool = False, ignore_bubble: int = 0) -> List[TextBlock]:
+        quadrilaterals = list(self._generate_text_direction(textlines, args.get('text_directions')))
+        is_quadrilaterals = len(quadrilaterals) > 0 and isinstance(quadrilaterals[0][0], Quadrilateral)
 
-        perm = range(len(region_imgs))
-        is_quadrilaterals = False
-        if len(quadrilaterals) > 0 and isinstance(quadrilaterals[0][0], Quadrilateral):
-            perm = sorted(range(len(region_imgs)), key = lambda x: region_imgs[x].shape[1])
-            is_quadrilaterals = True
-        
-        texts = {}
         if args.get('use_mocr_merge', False):
             merged_textlines, merged_idx = await merge_bboxes(textlines, image.shape[1], image.shape[0])
             merged_quadrilaterals = list(self._generate_text_direction(merged_textlines))
         else:
-            merged_idx = [[i] for i in range(len(region_imgs))]
+            merged_idx = [[i] for i in range(len(quadrilaterals))]
             merged_quadrilaterals = quadrilaterals
         merged_region_imgs = []
         for q, d in merged_quadrilaterals:
@@ -162,9 +189,94 @@ class ModelMangaOCR(OfflineOCR):
                 merged_text_height = q.aabb.h
                 merged_d = 'h'
             merged_region_imgs.append(q.get_transformed_region(image, merged_d, merged_text_height))
-        for idx in range(len(merged_region_imgs)):
-            texts[idx] = self.mocr(Image.fromarray(merged_region_imgs[idx]))
-            
+        if verbose:
+            os.makedirs('result/ocrs/', exist_ok=True)
+            for ix, img in enumerate(merged_region_imgs):
+                cv2.imwrite(f'result/ocrs/mocr_{ix}.png', cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+        texts, mocr_probs = self._recognize_batch(merged_region_imgs)
+
+        out_regions = None
+        if args.get('use_mocr_48px_colors', False):
+            out_regions = self._infer_48px_colors(image, quadrilaterals, verbose)
+
+        output_regions = []
+        for i, nodes in enumerate(merged_idx):
+            if out_regions is None:
+                prob = mocr_probs[i]
+                (fr, fg, fb), (br, bg, bb) = estimate_text_colors(merged_region_imgs[i])
+            else:
+                prob, (fr, fg, fb), (br, bg, bb) = self._merge_48px_colors(out_regions, nodes)
+
+            txt = texts[i]
+            self.logger.info(f'prob: {prob} {txt} fg: ({fr}, {fg}, {fb}) bg: ({br}, {bg}, {bb})')
+            cur_region = merged_quadrilaterals[i][0]
+            if isinstance(cur_region, Quadrilateral):
+                cur_region.text = txt
+                cur_region.prob = prob
+                cur_region.fg_r = fr
+                cur_region.fg_g = fg
+                cur_region.fg_b = fb
+                cur_region.bg_r = br
+                cur_region.bg_g = bg
+                cur_region.bg_b = bb
+            else: # TextBlock
+                cur_region.text.append(txt)
+                cur_region.update_font_colors(np.array([fr, fg, fb]), np.array([br, bg, bb]))
+            output_regions.append(cur_region)
+
+        if is_quadrilaterals:
+            return output_regions
+        return textlines
+
+    def _merge_48px_colors(self, out_regions: dict, nodes: List[int]):
+        total_logprobs = 0
+        total_area = 0
+        fg_r = []
+        fg_g = []
+        fg_b = []
+        bg_r = []
+        bg_g = []
+        bg_b = []
+
+        for idx in nodes:
+            if idx not in out_regions:
+                continue
+
+            total_logprobs += np.log(out_regions[idx].prob) * out_regions[idx].area
+            total_area += out_regions[idx].area
+            fg_r.append(out_regions[idx].fg_r)
+            fg_g.append(out_regions[idx].fg_g)
+            fg_b.append(out_regions[idx].fg_b)
+            bg_r.append(out_regions[idx].bg_r)
+            bg_g.append(out_regions[idx].bg_g)
+            bg_b.append(out_regions[idx].bg_b)
+
+        total_logprobs /= total_area
+        prob = np.exp(total_logprobs)
+        fr = round(np.mean(fg_r))
+        fg = round(np.mean(fg_g))
+        fb = round(np.mean(fg_b))
+        br = round(np.mean(bg_r))
+        bg = round(np.mean(bg_g))
+        bb = round(np.mean(bg_b))
+        return prob, (fr, fg, fb), (br, bg, bb)
+
+    def _infer_48px_colors(self, image: np.ndarray, quadrilaterals: list, verbose: bool = False) -> dict:
+        """
+        Predicts the text colors with the 48px model, which is more accurate
+        than estimating them but needs a second model pass.
+        """
+        if self.model is None:
+            self._load_color_model()
+
+        text_height = 48
+        max_chunk_size = 16
+
+        region_imgs = [q.get_transformed_region(image, d, text_height) for q, d in quadrilaterals]
+        perm = range(len(region_imgs))
+        if len(quadrilaterals) > 0 and isinstance(quadrilaterals[0][0], Quadrilateral):
+            perm = sorted(range(len(region_imgs)), key = lambda x: region_imgs[x].shape[1])
+
         ix = 0
         out_regions = {}
         for indices in chunks(perm, max_chunk_size):
@@ -239,57 +351,5 @@ class ModelMangaOCR(OfflineOCR):
                     cur_region.update_font_colors(np.array([fr, fg, fb]), np.array([br, bg, bb]))
 
                 out_regions[idx_keys[i]] = cur_region
-                
-        output_regions = []
-        for i, nodes in enumerate(merged_idx):
-            total_logprobs = 0
-            total_area = 0
-            fg_r = []
-            fg_g = []
-            fg_b = []
-            bg_r = []
-            bg_g = []
-            bg_b = []
-            
-            for idx in nodes:
-                if idx not in out_regions:
-                    continue
-                    
-                total_logprobs += np.log(out_regions[idx].prob) * out_regions[idx].area
-                total_area += out_regions[idx].area
-                fg_r.append(out_regions[idx].fg_r)
-                fg_g.append(out_regions[idx].fg_g)
-                fg_b.append(out_regions[idx].fg_b)
-                bg_r.append(out_regions[idx].bg_r)
-                bg_g.append(out_regions[idx].bg_g)
-                bg_b.append(out_regions[idx].bg_b)
-                
-            total_logprobs /= total_area
-            prob = np.exp(total_logprobs)
-            fr = round(np.mean(fg_r))
-            fg = round(np.mean(fg_g))
-            fb = round(np.mean(fg_b))
-            br = round(np.mean(bg_r))
-            bg = round(np.mean(bg_g))
-            bb = round(np.mean(bg_b))
-            
-            txt = texts[i]
-            self.logger.info(f'prob: {prob} {txt} fg: ({fr}, {fg}, {fb}) bg: ({br}, {bg}, {bb})')
-            cur_region = merged_quadrilaterals[i][0]
-            if isinstance(cur_region, Quadrilateral):
-                cur_region.text = txt
-                cur_region.prob = prob
-                cur_region.fg_r = fr
-                cur_region.fg_g = fg
-                cur_region.fg_b = fb
-                cur_region.bg_r = br
-                cur_region.bg_g = bg
-                cur_region.bg_b = bb
-            else: # TextBlock
-                cur_region.text.append(txt)
-                cur_region.update_font_colors(np.array([fr, fg, fb]), np.array([br, bg, bb]))
-            output_regions.append(cur_region)
 
-        if is_quadrilaterals:
-            return output_regions
-        return textlines
+        return out_regions
@@ -0,0 +1,201 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .common import CommonOCR
+from ..utils import Context, Quadrilateral, get_logger
+
+OCR_CACHE_SIZE = int(os.getenv('MT_OCR_CACHE_SIZE', 4096))
+OCR_CACHE_PATH = os.getenv('MT_OCR_CACHE') or None
+
+# Height the textlines are rectified to before hashing
+KEY_TEXT_HEIGHT = 48
+
+# text, prob, fg_r, fg_g, fg_b, bg_r, bg_g, bg_b or None if the OCR dropped the textline
+CachedResult = Optional[Tuple[str, float, int, int, int, int, int, int]]
+
+
+class OCRResultCache:
+    """
+    Caches OCR results by the content of the rectified textline crop, so that
+    textlines repeating across pages (sound effects, speaker tags, credits)
+    are only recognized once. Recently used results are kept in memory, a
+    sqlite file can be given to keep them across runs.
+    """
+
+    def __init__(self, max_size: int = OCR_CACHE_SIZE, path: str = None):
+        self.logger = get_logger(self.__class__.__name__)
+        self.max_size = max_size
+        self.path = None
+        self._entries: 'OrderedDict[str, CachedResult]' = OrderedDict()
+        self._db: sqlite3.Connection = None
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'persistent_hits': 0, 'misses': 0}
+        self.open(path)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 or self._db is not None
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0
+
+    def configure(self, max_size: int = None, path: str = None):
+        if max_size is not None:
+            self.max_size = max_size
+            self._evict()
+        if path != self.path:
+            self.open(path)
+
+    def open(self, path: Optional[str]):
+        """Uses the sqlite file at `path` as persistent tier, None only keeps results in memory."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+            self.path = path
+            if path:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute('CREATE TABLE IF NOT EXISTS ocr_results (key TEXT PRIMARY KEY, result TEXT)')
+                self._db.commit()
+
+    @staticmethod
+    def get_key(model_key: str, direction: str, crop: np.ndarray, options: str = '') -> str:
+        """`options` are the serialized args the result depends on besides the crop."""
+        # Drop the lowest bits so that compression noise doesn't change the key
+        normalized = np.ascontiguousarray(crop >> 3)
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f'{model_key}:{direction}:{crop.shape}:{options}'.encode())
+        h.update(normalized.tobytes())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Tuple[bool, CachedResult]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return True, self._entries[key]
+            if self._db is not None:
+                row = self._db.execute('SELECT result FROM ocr_results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    result = json.loads(row[0])
+                    result = tuple(result) if result is not None else None
+                    self._remember(key, result)
+                    self.stats['hits'] += 1
+                    self.stats['persistent_hits'] += 1
+                    return True, result
+            self.stats['misses'] += 1
+            return False, None
+
+    def count_hit(self):
+        """Counts a result that was reused without a lookup, e.g. a repeated textline of the same page."""
+        with self._lock:
+            self.stats['hits'] += 1
+
+    def put(self, key: str, result: CachedResult):
+        with self._lock:
+            self._remember(key, result)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO ocr_results VALUES (?, ?)', (key, json.dumps(result)))
+                self._db.commit()
+
+    def _remember(self, key: str, result: CachedResult):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > max(self.max_size, 0):
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM ocr_results')
+                self._db.commit()
+
+    def report(self) -> dict:
+        return {**self.stats, 'hit_rate': self.hit_rate, 'entries': len(self._entries), 'path': self.path}
+
+
+ocr_result_cache = OCRResultCache()
+
+
+def _get_result(textline: Quadrilateral) -> CachedResult:
+    return (textline.text, float(textline.prob), int(textline.fg_r), int(textline.fg_g), int(textline.fg_b),
+            int(textline.bg_r), int(textline.bg_g), int(textline.bg_b))
+
+def _set_result(textline: Quadrilateral, result: CachedResult):
+    textline.text, textline.prob, textline.fg_r, textline.fg_g, textline.fg_b, textline.bg_r, textline.bg_g, textline.bg_b = result
+
+
+async def recognize_cached(ocr: CommonOCR, ocr_key: str, image: np.ndarray, textlines: List[Quadrilateral], args: dict,
+                           verbose: bool = False, cache: OCRResultCache = ocr_result_cache) -> List[Quadrilateral]:
+    """
+    Runs `ocr` only on the textlines whose crops haven't been recognized before
+    and fills in the others from `cache`.
+    """
+    if not cache.enabled or not textlines or not isinstance(textlines[0], Quadrilateral) or not ocr.supports_result_cache(args):
+        return await ocr.recognize(image, textlines, args, verbose)
+
+    # The directions depend on the neighbouring textlines, so they are decided
+    # on the whole page and passed on for recognizing the misses
+    directions = {id(q): d for q, d in ocr._generate_text_direction(textlines)}
+    options = json.dumps({name: args.get(name) for name in ocr._RESULT_CACHE_ARGS}, sort_keys=True, default=str)
+    keys = {}
+    hits = {}
+    # Textlines of this page that repeat a missed one, by key
+    duplicates = {}
+    misses = []
+    for textline in textlines:
+        direction = directions[id(textline)]
+        key = cache.get_key(ocr_key, direction, textline.get_transformed_region(image, direction, KEY_TEXT_HEIGHT), options)
+        if key in duplicates:
+            duplicates[key].append(textline)
+            cache.count_hit()
+            continue
+        found, result = cache.get(key)
+        if found:
+            hits[id(textline)] = result
+        else:
+            keys[id(textline)] = key
+            duplicates[key] = []
+            misses.append(textline)
+
+    if misses:
+        recognized = await ocr.recognize(image, misses, Context(**{**args, 'text_directions': directions}), verbose)
+    else:
+        recognized = []
+    recognized_ids = {id(q) for q in recognized}
+
+    for textline in misses:
+        key = keys[id(textline)]
+        result = _get_result(textline) if id(textline) in recognized_ids else None
+        for duplicate in duplicates[key]:
+            hits[id(duplicate)] = result
+        cache.put(key, result)
+
+    for textline in textlines:
+        result = hits.get(id(textline))
+        if result is not None:
+            _set_result(textline, result)
+            textline.assigned_direction = directions[id(textline)]
+    kept = recognized_ids | {i for i, result in hits.items() if result is not None}
+    # In the reading order an uncached run returns them in
+    order = {key: i for i, key in enumerate(directions)}
+    output = sorted((q for q in textlines if id(q) in kept), key=lambda q: order[id(q)])
+
+    cache.logger.info(f'Reused {len(hits)}/{len(textlines)} textlines (hit rate: {cache.hit_rate:.1%})')
+    return output
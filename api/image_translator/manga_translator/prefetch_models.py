@@ -0,0 +1,97 @@
+"""
+Downloads the models of a configuration ahead of time, e.g. while building an
+image, so that the first translation doesn't have to.
+
+    python -m image_translator.manga_translator.prefetch_models --detector default --ocr 48px --translator sugoi
+    python -m image_translator.manga_translator.prefetch_models --install-bundle models.tar.gz --verify
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+
+from .args import DEFAULT_ARGS, dir_path
+from .utils import ModelWrapper
+from .detection import DETECTORS, get_detector
+from .ocr import OCRS, get_ocr
+from .inpainting import INPAINTERS, get_inpainter
+from .upscaling import UPSCALERS, get_upscaler
+from .colorization import COLORIZERS, get_colorizer
+from .translators import TRANSLATORS, get_translator
+
+
+def install_bundle(bundle: str, model_dir: str):
+    """Extracts an offline bundle (an archive of a models directory) into `model_dir`."""
+    print(f'Installing models from {bundle} into {model_dir}')
+    shutil.unpack_archive(bundle, model_dir)
+
+
+def export_bundle(bundle: str, model_dir: str):
+    """Packs `model_dir` into an archive that can be installed with `--install-bundle`."""
+    for fmt, ext in (('gztar', '.tar.gz'), ('bztar', '.tar.bz2'), ('xztar', '.tar.xz'), ('tar', '.tar'), ('zip', '.zip')):
+        if bundle.endswith(ext):
+            base_name = bundle[:-len(ext)]
+            break
+    else:
+        fmt, base_name = 'zip', bundle
+    print(f'Exporting {model_dir} to {bundle}')
+    shutil.make_archive(base_name, fmt, model_dir)
+
+
+def get_models(args: argparse.Namespace):
+    models = [get_detector(args.detector), get_ocr(args.ocr), get_inpainter(args.inpainter)]
+    if args.upscaler:
+        models.append(get_upscaler(args.upscaler))
+    if args.colorizer:
+        models.append(get_colorizer(args.colorizer))
+    for key in args.translator or []:
+        models.append(get_translator(key))
+    return [model for model in models if isinstance(model, ModelWrapper)]
+
+
+async def prefetch(args: argparse.Namespace) -> bool:
+    models = get_models(args)
+    await asyncio.gather(*(model.download() for model in models))
+    if not args.verify:
+        return True
+    results = await asyncio.gather(*(model.verify() for model in models))
+    for model, ok in zip(models, results):
+        print(f'{model._key}: {"OK" if ok else "FAILED"}')
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='prefetch-models', description='Download the models used by a translation configuration')
+    parser.add_argument('--detector', default=DEFAULT_ARGS['detector'], choices=DETECTORS)
+    parser.add_argument('--ocr', default=DEFAULT_ARGS['ocr'], choices=OCRS)
+    parser.add_argument('--inpainter', default=DEFAULT_ARGS['inpainter'], choices=INPAINTERS)
+    parser.add_argument('--upscaler', default=None, choices=UPSCALERS)
+    parser.add_argument('--colorizer', default=None, choices=COLORIZERS)
+    parser.add_argument('--translator', default=None, nargs='+', choices=TRANSLATORS, help='Translators to fetch, only offline translators have models')
+    parser.add_argument('--model-dir', default=None, type=dir_path, help='Model directory (by default ./models in project root)')
+    parser.add_argument('--model-mirror', default=None, type=dir_path, help='Local directory that is searched for model files before downloading them')
+    parser.add_argument('--install-bundle', default=None, type=str, help='Offline bundle archive to extract into the model directory first')
+    parser.add_argument('--export-bundle', default=None, type=str, help='Write the model directory to this archive afterwards')
+    parser.add_argument('--concurrency', default=ModelWrapper._MAX_CONCURRENT_DOWNLOADS, type=int, help='Files downloaded at the same time per model')
+    parser.add_argument('--verify', action='store_true', help='Check the hashes of the model files')
+    args = parser.parse_args()
+
+    if args.model_dir:
+        ModelWrapper._MODEL_DIR = args.model_dir
+    if args.model_mirror:
+        ModelWrapper._MODEL_MIRROR = args.model_mirror
+    ModelWrapper._MAX_CONCURRENT_DOWNLOADS = max(args.concurrency, 1)
+    os.makedirs(ModelWrapper._MODEL_DIR, exist_ok=True)
+
+    if args.install_bundle:
+        install_bundle(args.install_bundle, ModelWrapper._MODEL_DIR)
+    ok = asyncio.run(prefetch(args))
+    if args.export_bundle:
+        export_bundle(args.export_bundle, ModelWrapper._MODEL_DIR)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
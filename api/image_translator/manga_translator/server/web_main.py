@@ -6,9 +6,9 @@ import shutil
 import mimetypes
 import time
 import asyncio
+import signal
 import subprocess
 import secrets
-from io import BytesIO
 from PIL import Image
 from aiohttp import web
 from collections import deque
@@ -67,9 +67,26 @@ VALID_TRANSLATORS = [
     'original',
 ]
 
+# Set to the number of translator workers started on startup, every worker processes one task at a time.
+# Translator clients started by hand with `--mode web_client` add to it while they are connected.
 MAX_ONGOING_TASKS = 1
 MAX_IMAGE_SIZE_PX = 8000**2
 
+# Rough amount of RAM one translator worker needs with the default models loaded
+WORKER_MEMORY_ESTIMATE = 4 * 1024**3
+
+# A busy worker that has not reported back for this long is considered stuck and restarted
+WORKER_STALL_TIMEOUT = 900
+
+# Delay before restarting a crashed worker, doubled for every consecutive crash
+WORKER_RESTART_BACKOFF = 1
+WORKER_RESTART_MAX_BACKOFF = 120
+# Workers that ran for at least this long before crashing get their backoff reset
+WORKER_STABLE_UPTIME = 300
+
+# Time to wait for ongoing tasks to finish when shutting down
+SHUTDOWN_DRAIN_TIMEOUT = 120
+
 # Time to wait for web client to send a request to /task-state request
 # before that web clients task gets removed from the queue
 WEB_CLIENT_TIMEOUT = -1
@@ -77,11 +94,15 @@ WEB_CLIENT_TIMEOUT = -1
 # Time before finished tasks get removed from memory
 FINISHED_TASK_REMOVE_TIMEOUT = 1800
 
+# Chunk size used when streaming result images
+RESULT_CHUNK_SIZE = 256 * 1024
+
 # Auto deletes old task folders upon reaching this disk space limit
 DISK_SPACE_LIMIT = 5e7 # 50mb
 
-# TODO: Turn into dict with translator client id as key for support of multiple translator clients
 ONGOING_TASKS = []
+WORKERS = {}
+DRAINING = False
 FINISHED_TASKS = []
 NONCE = ''
 QUEUE = deque()
@@ -91,6 +112,14 @@ DEFAULT_TRANSLATION_PARAMS = {}
 AVAILABLE_TRANSLATORS = []
 FORMAT = ''
 
+# Waiters on a task (web clients, manual translation requests, the translator
+# client) are woken up through these instead of polling the dicts above
+TASK_CONDITIONS = {}
+QUEUE_CONDITION = asyncio.Condition()
+
+# Longest time a long-poll request from the translator client is held open
+MAX_LONG_POLL_TIMEOUT = 60
+
 app = web.Application(client_max_size = 1024 * 1024 * 50)
 routes = web.RouteTableDef()
 
@@ -110,6 +139,121 @@ def constant_compare(a, b):
         result |= x ^ y
     return result == 0
 
+def get_task_condition(task_id: str) -> asyncio.Condition:
+    if task_id not in TASK_CONDITIONS:
+        TASK_CONDITIONS[task_id] = asyncio.Condition()
+    return TASK_CONDITIONS[task_id]
+
+async def notify_task(task_id: str):
+    """Wakes up everyone waiting on a change of the given task."""
+    cond = TASK_CONDITIONS.get(task_id)
+    if cond is not None:
+        async with cond:
+            cond.notify_all()
+
+async def wait_for_task(task_id: str, predicate, timeout: float = None) -> bool:
+    """
+    Waits until `predicate` returns True, reevaluating it whenever the task is notified.
+    Returns the last result of `predicate` if the timeout runs out first.
+    """
+    if predicate():
+        return True
+    cond = get_task_condition(task_id)
+    async with cond:
+        try:
+            return await asyncio.wait_for(cond.wait_for(predicate), timeout)
+        except asyncio.TimeoutError:
+            return predicate()
+
+async def notify_queue():
+    async with QUEUE_CONDITION:
+        QUEUE_CONDITION.notify_all()
+
+async def enqueue_task(task_id: str):
+    QUEUE.append(task_id)
+    await notify_queue()
+
+async def remove_task(task_id: str):
+    TASK_STATES.pop(task_id, None)
+    TASK_DATA.pop(task_id, None)
+    # Let remaining waiters see that the task is gone before dropping the condition
+    await notify_task(task_id)
+    TASK_CONDITIONS.pop(task_id, None)
+
+class TranslatorWorker:
+    """
+    Bookkeeping for one translator client. Only the `managed` workers are
+    processes started by `dispatch`, which supervises and restarts them.
+    """
+
+    def __init__(self, worker_id: str, managed: bool = False):
+        self.worker_id = worker_id
+        self.managed = managed
+        self.proc: subprocess.Popen = None
+        self.task_id: str = None
+        self.started_at = 0
+        self.last_seen = 0
+        self.restarts = 0
+        self.restart_at = 0
+
+    @property
+    def alive(self) -> bool:
+        if not self.managed:
+            # Idle clients long-poll for tasks, so they check in at least once per MAX_LONG_POLL_TIMEOUT
+            return time.time() - self.last_seen < WORKER_STALL_TIMEOUT
+        return self.proc is not None and self.proc.poll() is None
+
+    @property
+    def idle(self) -> bool:
+        return self.task_id is None
+
+def get_worker(worker_id) -> TranslatorWorker:
+    """
+    Returns the worker a request came from. Ids that weren't handed out by
+    `dispatch` belong to translator clients started by hand, clients that
+    don't send an id at all are counted as a single one of those.
+    """
+    worker_id = str(worker_id or 'external')
+    if worker_id not in WORKERS:
+        WORKERS[worker_id] = TranslatorWorker(worker_id)
+    worker = WORKERS[worker_id]
+    worker.last_seen = time.time()
+    return worker
+
+def touch_task_worker(task_id: str):
+    """Marks the worker of `task_id` as responsive, for requests that don't send a worker id."""
+    for worker in WORKERS.values():
+        if worker.task_id == task_id:
+            worker.last_seen = time.time()
+
+def release_worker_task(worker: TranslatorWorker):
+    task_id = worker.task_id
+    worker.task_id = None
+    if task_id in ONGOING_TASKS:
+        ONGOING_TASKS.remove(task_id)
+        FINISHED_TASKS.append(task_id)
+
+def task_capacity() -> int:
+    """Number of tasks that can run at once, the started workers plus the connected external ones."""
+    return MAX_ONGOING_TASKS + sum(1 for w in WORKERS.values() if not w.managed and w.alive)
+
+def free_capacity() -> int:
+    """Number of queued tasks that will be picked up right away."""
+    if DRAINING:
+        return 0
+    idle = sum(1 for w in WORKERS.values() if w.idle and w.alive)
+    return max(0, min(idle, task_capacity() - len(ONGOING_TASKS)))
+
+def can_assign_task(worker: TranslatorWorker) -> bool:
+    return not DRAINING and worker.idle and len(QUEUE) > 0 and len(ONGOING_TASKS) < task_capacity()
+
+def parse_wait(request) -> float:
+    try:
+        wait = float(request.rel_url.query.get('wait', 0))
+    except ValueError:
+        return 0
+    return max(0, min(wait, MAX_LONG_POLL_TIMEOUT))
+
 @routes.get("/")
 async def index_async(request):
     global AVAILABLE_TRANSLATORS
@@ -125,17 +269,83 @@ async def index_async(request):
     with open(os.path.join(SERVER_DIR_PATH, 'manual.html'), 'r', encoding='utf8') as fp:
         return web.Response(text=fp.read(), content_type='text/html')
 
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+async def send_file_streamed(request, filepath: str, etag: str, content_type: str):
+    """
+    Streams a file from disk in chunks without loading it into memory or blocking
+    the event loop. Supports conditional requests through `etag` and single byte ranges.
+    """
+    loop = asyncio.get_running_loop()
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'public, max-age=%d' % FINISHED_TASK_REMOVE_TIMEOUT,
+    }
+    if etag_matches(etag, request.headers.get('If-None-Match')):
+        return web.Response(status=304, headers=headers)
+
+    try:
+        size = (await loop.run_in_executor(None, os.stat, filepath)).st_size
+    except FileNotFoundError:
+        return web.Response(status=404, text='Not Found')
+
+    start, end = 0, size
+    status = 200
+    if 'Range' in request.headers:
+        try:
+            start, end, step = request.http_range.indices(size)
+        except ValueError:
+            start, end, step = 0, 0, 1
+        if step != 1 or start >= end:
+            headers['Content-Range'] = f'bytes */{size}'
+            return web.Response(status=416, headers=headers)
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+
+    response = web.StreamResponse(status=status, headers=headers)
+    response.content_type = content_type
+    response.content_length = end - start
+    await response.prepare(request)
+    if request.method == 'HEAD':
+        return response
+
+    f = await loop.run_in_executor(None, open, filepath, 'rb')
+    try:
+        await loop.run_in_executor(None, f.seek, start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = await loop.run_in_executor(None, f.read, min(RESULT_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await response.write(chunk)
+    finally:
+        await loop.run_in_executor(None, f.close)
+    await response.write_eof()
+    return response
+
 @routes.get("/result/{taskid}")
 async def result_async(request):
     global FORMAT
-    filepath = os.path.join('result', request.match_info.get('taskid'), f'final.{FORMAT}')
+    task_id = request.match_info.get('taskid')
+    filepath = os.path.join('result', task_id, f'final.{FORMAT}')
     if not os.path.exists(filepath):
         return web.Response(status=404, text='Not Found')
-    stream = BytesIO()
-    with open(filepath, 'rb') as f:
-        stream.write(f.read())
     mime = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
-    return web.Response(body=stream.getvalue(), content_type=mime)
+    # Task ids are derived from the input image and translation params, so they identify the result
+    return await send_file_streamed(request, filepath, f'"{task_id}.{FORMAT}"', mime)
 
 @routes.get("/result-type")
 async def file_type_async(request):
@@ -144,7 +354,12 @@ async def file_type_async(request):
 
 @routes.get("/queue-size")
 async def queue_size_async(request):
-    return web.json_response({'size' : len(QUEUE)})
+    busy = sum(1 for w in WORKERS.values() if not w.idle)
+    return web.json_response({
+        'size': len(QUEUE),
+        'ongoing': busy,
+        'capacity': task_capacity(),
+    })
 
 async def handle_post(request):
     data = await request.post()
@@ -201,14 +416,31 @@ async def handle_post(request):
             return web.json_response({'status': 'error-too-large'})
     except Exception:
         return web.json_response({'status': 'error-img-corrupt'})
-    return img, detection_size, selected_translator, target_language, detector, direction
+    return img, detection_size, selected_translator, target_language, detector, direction, content
+
+async def save_task_input(task_id: str, img: Image.Image, content: bytes):
+    """
+    Stores the uploaded image as the task's input.png. PNG uploads are written
+    as-is instead of being re-encoded.
+    """
+    path = f'result/{task_id}/input.png'
+
+    def _save():
+        os.makedirs(f'result/{task_id}/', exist_ok=True)
+        if img.format == 'PNG':
+            with open(path, 'wb') as f:
+                f.write(content)
+        else:
+            img.save(path)
+
+    await asyncio.get_running_loop().run_in_executor(None, _save)
 
 @routes.post("/run")
 async def run_async(request):
     global FORMAT
     x = await handle_post(request)
     if isinstance(x, tuple):
-        img, size, selected_translator, target_language, detector, direction = x
+        img, size, selected_translator, target_language, detector, direction, content = x
     else:
         return x
     task_id = f'{phash(img, hash_size = 16)}-{size}-{selected_translator}-{target_language}-{detector}-{direction}'
@@ -223,9 +455,7 @@ async def run_async(request):
     #         # error occurred
     #         return web.json_response({'state': 'error'})
     else:
-        os.makedirs(f'result/{task_id}/', exist_ok=True)
-        img.save(f'result/{task_id}/input.png')
-        QUEUE.append(task_id)
+        await save_task_input(task_id, img, content)
         now = time.time()
         TASK_DATA[task_id] = {
             'detection_size': size,
@@ -240,22 +470,20 @@ async def run_async(request):
             'info': 'pending',
             'finished': False,
         }
-    while True:
-        await asyncio.sleep(0.1)
-        if task_id not in TASK_STATES:
-            break
-        state = TASK_STATES[task_id]
-        if state['finished']:
-            break
+        await enqueue_task(task_id)
+    state = TASK_STATES.get(task_id, {'info': 'error', 'finished': False})
+    await wait_for_task(task_id, lambda: task_id not in TASK_STATES or TASK_STATES[task_id]['finished'])
+    state = TASK_STATES.get(task_id, state)
     return web.json_response({'task_id': task_id, 'status': 'successful' if state['finished'] else state['info']})
 
 
 @routes.post("/connect-internal")
 async def index_async(request):
     global NONCE, VALID_TRANSLATORS, AVAILABLE_TRANSLATORS
-    # Can be extended to allow support for multiple translators
     rqjson = await request.json()
     if constant_compare(rqjson.get('nonce'), NONCE):
+        worker = get_worker(rqjson.get('worker_id'))
+        print(f'Translator worker {worker.worker_id} connected')
         capabilities = rqjson.get('capabilities')
         if capabilities:
             translators = capabilities.get('translators')
@@ -269,10 +497,27 @@ async def index_async(request):
 async def get_task_async(request):
     """
     Called by the translator to get a translation task.
+
+    If the `wait` query parameter is set the request is held open for up to
+    that many seconds until a task becomes available (long polling).
     """
     global NONCE, ONGOING_TASKS, DEFAULT_TRANSLATION_PARAMS
     if constant_compare(request.rel_url.query.get('nonce'), NONCE):
-        if len(QUEUE) > 0 and len(ONGOING_TASKS) < MAX_ONGOING_TASKS:
+        worker = get_worker(request.rel_url.query.get('worker_id'))
+        # A worker asking for a new task is done with its previous one
+        release_worker_task(worker)
+        wait = parse_wait(request)
+        if wait > 0:
+            async with QUEUE_CONDITION:
+                try:
+                    await asyncio.wait_for(
+                        QUEUE_CONDITION.wait_for(lambda: DRAINING or can_assign_task(worker)), wait)
+                except asyncio.TimeoutError:
+                    pass
+            worker.last_seen = time.time()
+        if DRAINING:
+            return web.json_response({'data': {'exit': True}})
+        if can_assign_task(worker):
             task_id = QUEUE.popleft()
             if task_id in TASK_DATA:
                 data = TASK_DATA[task_id]
@@ -281,6 +526,7 @@ async def get_task_async(request):
                     data[p] = current_value if current_value is not None else default_value
                 if not TASK_DATA[task_id].get('manual', False):
                     ONGOING_TASKS.append(task_id)
+                worker.task_id = task_id
                 return web.json_response({'task_id': task_id, 'data': data})
             else:
                 return web.json_response({})
@@ -296,6 +542,11 @@ async def manual_trans_task(task_id, texts, translations):
     else:
         TASK_DATA[task_id]['trans_result'] = []
         print('Manual translation complete')
+    await notify_task(task_id)
+
+def task_done_or_failed(task_id: str) -> bool:
+    state = TASK_STATES[task_id]
+    return state['finished'] or state['info'].startswith('error')
 
 @routes.post("/cancel-manual-request")
 async def cancel_manual_translation(request):
@@ -304,16 +555,13 @@ async def cancel_manual_translation(request):
         task_id = rqjson['task_id']
         if task_id in TASK_DATA:
             TASK_DATA[task_id]['cancel'] = ' '
-            while True:
-                await asyncio.sleep(0.1)
-                if TASK_STATES[task_id]['info'].startswith('error'):
-                    ret = web.json_response({'task_id': task_id, 'status': 'error'})
-                    break
-                if TASK_STATES[task_id]['finished']:
-                    ret = web.json_response({'task_id': task_id, 'status': 'cancelled'})
-                    break
-            del TASK_STATES[task_id]
-            del TASK_DATA[task_id]
+            await notify_task(task_id)
+            await wait_for_task(task_id, lambda: task_id not in TASK_STATES or task_done_or_failed(task_id))
+            if task_id not in TASK_STATES or TASK_STATES[task_id]['info'].startswith('error'):
+                ret = web.json_response({'task_id': task_id, 'status': 'error'})
+            else:
+                ret = web.json_response({'task_id': task_id, 'status': 'cancelled'})
+            await remove_task(task_id)
             return ret
     return web.json_response({})
 
@@ -325,17 +573,14 @@ async def post_translation_result(request):
         if task_id in TASK_DATA:
             trans_result = [r['t'] for r in rqjson['trans_result']]
             TASK_DATA[task_id]['trans_result'] = trans_result
-            while True:
-                await asyncio.sleep(0.1)
-                if TASK_STATES[task_id]['info'].startswith('error'):
-                    ret = web.json_response({'task_id': task_id, 'status': 'error'})
-                    break
-                if TASK_STATES[task_id]['finished']:
-                    ret = web.json_response({'task_id': task_id, 'status': 'successful'})
-                    break
+            await notify_task(task_id)
+            await wait_for_task(task_id, lambda: task_id not in TASK_STATES or task_done_or_failed(task_id))
+            if task_id not in TASK_STATES or TASK_STATES[task_id]['info'].startswith('error'):
+                ret = web.json_response({'task_id': task_id, 'status': 'error'})
+            else:
+                ret = web.json_response({'task_id': task_id, 'status': 'successful'})
             # remove old tasks
-            del TASK_STATES[task_id]
-            del TASK_DATA[task_id]
+            await remove_task(task_id)
             return ret
     return web.json_response({})
 
@@ -353,10 +598,21 @@ async def request_translation_internal(request):
 
 @routes.post("/get-manual-result-internal")
 async def get_translation_internal(request):
+    """
+    Called by the translator to fetch the user's manual translation. Like /task-internal
+    the request is held open for up to `wait` seconds until a result or cancellation arrives.
+    """
     global NONCE
     rqjson = (await request.json())
     if constant_compare(rqjson.get('nonce'), NONCE):
         task_id = rqjson['task_id']
+        # The worker keeps polling for up to an hour while the user translates, which isn't a stall
+        touch_task_worker(task_id)
+        wait = parse_wait(request)
+        if wait > 0 and task_id in TASK_DATA:
+            await wait_for_task(task_id, lambda: task_id not in TASK_DATA
+                                or 'trans_result' in TASK_DATA[task_id] or 'cancel' in TASK_DATA[task_id], wait)
+            touch_task_worker(task_id)
         if task_id in TASK_DATA:
             if 'trans_result' in TASK_DATA[task_id]:
                 return web.json_response({'result': TASK_DATA[task_id]['trans_result']})
@@ -382,8 +638,9 @@ async def get_task_state_async(request):
         }
         data['requested_at'] = time.time()
         try:
-            res_dict['waiting'] = QUEUE.index(task_id) + 1
-        except Exception:
+            # Tasks that an idle worker is about to pick up aren't waiting
+            res_dict['waiting'] = max(0, QUEUE.index(task_id) + 1 - free_capacity())
+        except ValueError:
             res_dict['waiting'] = 0
         res = web.json_response(res_dict)
 
@@ -398,19 +655,18 @@ async def post_task_update_async(request):
     global NONCE, ONGOING_TASKS, FINISHED_TASKS
     rqjson = (await request.json())
     if constant_compare(rqjson.get('nonce'), NONCE):
+        worker = get_worker(rqjson.get('worker_id'))
         task_id = rqjson['task_id']
         if task_id in TASK_STATES and task_id in TASK_DATA:
             TASK_STATES[task_id] = {
                 'info': rqjson['state'],
                 'finished': rqjson['finished'],
             }
-            if rqjson['finished'] and not TASK_DATA[task_id].get('manual', False):
-                try:
-                    i = ONGOING_TASKS.index(task_id)
-                    FINISHED_TASKS.append(ONGOING_TASKS.pop(i))
-                except ValueError:
-                    pass
+            if rqjson['finished'] and worker.task_id == task_id:
+                release_worker_task(worker)
+                await notify_queue()
             print(f'Task state {task_id} to {TASK_STATES[task_id]}')
+            await notify_task(task_id)
     return web.json_response({})
 
 @routes.post("/submit")
@@ -419,7 +675,7 @@ async def submit_async(request):
     global FORMAT
     x = await handle_post(request)
     if isinstance(x, tuple):
-        img, size, selected_translator, target_language, detector, direction = x
+        img, size, selected_translator, target_language, detector, direction, content = x
     else:
         return x
     task_id = f'{phash(img, hash_size = 16)}-{size}-{selected_translator}-{target_language}-{detector}-{direction}'
@@ -440,9 +696,7 @@ async def submit_async(request):
             'requested_at': now,
         }
     elif task_id not in TASK_DATA or task_id not in TASK_STATES:
-        os.makedirs(f'result/{task_id}/', exist_ok=True)
-        img.save(f'result/{task_id}/input.png')
-        QUEUE.append(task_id)
+        await save_task_input(task_id, img, content)
         TASK_STATES[task_id] = {
             'info': 'pending',
             'finished': False,
@@ -456,21 +710,20 @@ async def submit_async(request):
             'created_at': now,
             'requested_at': now,
         }
+        await enqueue_task(task_id)
     return web.json_response({'task_id': task_id, 'status': 'successful'})
 
 @routes.post("/manual-translate")
 async def manual_translate_async(request):
     x = await handle_post(request)
     if isinstance(x, tuple):
-        img, size, selected_translator, target_language, detector, direction = x
+        img, size, selected_translator, target_language, detector, direction, content = x
     else:
         return x
     task_id = secrets.token_hex(16)
     print(f'New `manual-translate` task {task_id}')
-    os.makedirs(f'result/{task_id}/', exist_ok=True)
-    img.save(f'result/{task_id}/input.png')
+    await save_task_input(task_id, img, content)
     now = time.time()
-    QUEUE.append(task_id)
     # TODO: Add form fields to manual translate website
     TASK_DATA[task_id] = {
         # 'detection_size': size,
@@ -485,12 +738,12 @@ async def manual_translate_async(request):
         'info': 'pending',
         'finished': False,
     }
-    while True:
-        await asyncio.sleep(1)
+    await enqueue_task(task_id)
+    await wait_for_task(task_id, lambda: task_id not in TASK_STATES
+                        or 'trans_request' in TASK_DATA[task_id] or task_done_or_failed(task_id))
+    if task_id in TASK_DATA:
         if 'trans_request' in TASK_DATA[task_id]:
             return web.json_response({'task_id' : task_id, 'status': 'pending', 'trans_result': TASK_DATA[task_id]['trans_request']})
-        if TASK_STATES[task_id]['info'].startswith('error'):
-            break
         if TASK_STATES[task_id]['finished']:
             # no texts detected
             return web.json_response({'task_id' : task_id, 'status': 'successful'})
@@ -502,7 +755,22 @@ app.add_routes(routes)
 def generate_nonce():
     return secrets.token_hex(16)
 
-def start_translator_client_proc(host: str, port: int, nonce: str, params: dict):
+def default_worker_count(params: dict) -> int:
+    """
+    Picks how many translator workers to start if not set through `--workers`.
+    Every worker holds its own copy of the models, so the count is bound by memory
+    as well as by the CPU cores that the workers split between themselves.
+    """
+    if params.get('use_gpu', False) or params.get('use_gpu_limited', False):
+        return 1
+    cpus = os.cpu_count() or 1
+    try:
+        total_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        total_memory = WORKER_MEMORY_ESTIMATE
+    return max(1, min(cpus // 4, total_memory // WORKER_MEMORY_ESTIMATE))
+
+def start_translator_client_proc(host: str, port: int, nonce: str, params: dict, worker_id: str = '0', num_workers: int = 1):
     os.environ['MT_WEB_NONCE'] = nonce
     cmds = [
         sys.executable,
@@ -510,6 +778,7 @@ def start_translator_client_proc(host: str, port: int, nonce: str, params: dict)
         '--mode', 'web_client',
         '--host', host,
         '--port', str(port),
+        '--worker-id', worker_id,
     ]
     if params.get('use_gpu', False):
         cmds.append('--use-gpu')
@@ -520,9 +789,84 @@ def start_translator_client_proc(host: str, port: int, nonce: str, params: dict)
     if params.get('verbose', False):
         cmds.append('--verbose')
 
-    proc = subprocess.Popen(cmds, cwd=BASE_PATH)
+    env = dict(os.environ)
+    if num_workers > 1 and 'OMP_NUM_THREADS' not in env:
+        # Keep the workers from oversubscribing the cores with their thread pools
+        env['OMP_NUM_THREADS'] = str(max(1, (os.cpu_count() or 1) // num_workers))
+    proc = subprocess.Popen(cmds, cwd=BASE_PATH, env=env)
     return proc
 
+def start_worker(worker: TranslatorWorker, host: str, port: int, nonce: str, params: dict):
+    num_workers = sum(1 for w in WORKERS.values() if w.managed)
+    worker.proc = start_translator_client_proc(host, port, nonce, params, worker.worker_id, num_workers)
+    worker.started_at = worker.last_seen = time.time()
+    worker.restart_at = 0
+
+def stop_worker(worker: TranslatorWorker):
+    if worker.managed and worker.alive:
+        worker.proc.kill()
+
+async def fail_worker_task(worker: TranslatorWorker):
+    """Marks the task of a crashed or stuck worker as failed."""
+    tid = worker.task_id
+    release_worker_task(worker)
+    if tid in TASK_STATES:
+        state = TASK_STATES[tid]
+        state['info'] = 'error'
+        state['finished'] = True
+        await notify_task(tid)
+    await notify_queue()
+
+async def supervise_workers(host: str, port: int, nonce: str, params: dict):
+    """
+    Restarts workers that exited (OOM or similar errors) or stopped responding,
+    with an exponential backoff for workers that keep crashing. External workers
+    that went silent are forgotten and their task is marked as failed.
+    """
+    now = time.time()
+    # Requests add workers while this awaits
+    for worker in list(WORKERS.values()):
+        if not worker.managed:
+            if not worker.alive:
+                print(f'External translator worker {worker.worker_id} stopped responding')
+                if WORKERS.get(worker.worker_id) is worker:
+                    del WORKERS[worker.worker_id]
+                if not worker.idle:
+                    await fail_worker_task(worker)
+            continue
+
+        if worker.alive and not worker.idle and now - worker.last_seen > WORKER_STALL_TIMEOUT:
+            print(f'Translator worker {worker.worker_id} stopped responding')
+            stop_worker(worker)
+            await asyncio.to_thread(worker.proc.wait)
+
+        if worker.alive:
+            continue
+        if not worker.restart_at:
+            if now - worker.started_at >= WORKER_STABLE_UPTIME:
+                worker.restarts = 0
+            delay = min(WORKER_RESTART_BACKOFF * 2 ** worker.restarts, WORKER_RESTART_MAX_BACKOFF)
+            worker.restarts += 1
+            worker.restart_at = now + delay
+            print(f'Restarting translator worker {worker.worker_id} in {delay}s')
+            await fail_worker_task(worker)
+        if now >= worker.restart_at:
+            start_worker(worker, host, port, nonce, params)
+
+async def drain_workers(timeout: float = SHUTDOWN_DRAIN_TIMEOUT):
+    """
+    Stops handing out tasks, lets the workers finish their ongoing tasks and
+    tells them to exit through /task-internal.
+    """
+    global DRAINING
+    DRAINING = True
+    await notify_queue()
+    deadline = time.time() + timeout
+    while time.time() < deadline and any(w.alive for w in WORKERS.values() if w.managed):
+        await asyncio.sleep(0.5)
+    for worker in list(WORKERS.values()):
+        stop_worker(worker)
+
 async def start_async_app(host: str, port: int, nonce: str, translation_params: dict = None):
     global NONCE, DEFAULT_TRANSLATION_PARAMS, FORMAT
     # Secret to secure communication between webserver and translator clients
@@ -541,17 +885,30 @@ async def start_async_app(host: str, port: int, nonce: str, translation_params:
     return runner, site
 
 async def dispatch(host: str, port: int, nonce: str = None, translation_params: dict = None):
-    global ONGOING_TASKS, FINISHED_TASKS
+    global ONGOING_TASKS, FINISHED_TASKS, MAX_ONGOING_TASKS
 
     if nonce is None:
         nonce = os.getenv('MT_WEB_NONCE', generate_nonce())
+    translation_params = translation_params or {}
 
     # Start web service
     runner, site = await start_async_app(host, port, nonce, translation_params)
 
-    # Create client process that will execute translation tasks
+    # Create client processes that will execute translation tasks
     print()
-    client_process = start_translator_client_proc(host, port, nonce, translation_params)
+    num_workers = translation_params.get('workers') or default_worker_count(translation_params)
+    MAX_ONGOING_TASKS = num_workers
+    for i in range(num_workers):
+        WORKERS[str(i)] = TranslatorWorker(str(i), managed=True)
+    print(f'Starting {num_workers} translator worker{"" if num_workers == 1 else "s"}')
+    for worker in list(WORKERS.values()):
+        start_worker(worker, host, port, nonce, translation_params)
+
+    shutdown = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, shutdown.set)
+    except (NotImplementedError, RuntimeError):
+        pass
 
     # Get all prior finished tasks
     os.makedirs('result/', exist_ok=True)
@@ -561,20 +918,13 @@ async def dispatch(host: str, port: int, nonce: str = None, translation_params:
     FINISHED_TASKS = list(sorted(FINISHED_TASKS, key=lambda task_id: os.path.getmtime(f'result/{task_id}')))
 
     try:
-        while True:
-            await asyncio.sleep(1)
-
-            # Restart client if OOM or similar errors occurred
-            if client_process.poll() is not None:
-                # if client_process.poll() == 0:
-                #     break
-                print('Restarting translator process')
-                if len(ONGOING_TASKS) > 0:
-                    tid = ONGOING_TASKS.pop(0)
-                    state = TASK_STATES[tid]
-                    state['info'] = 'error'
-                    state['finished'] = True
-                client_process = start_translator_client_proc(host, port, nonce, translation_params)
+        while not shutdown.is_set():
+            try:
+                await asyncio.wait_for(shutdown.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+            await supervise_workers(host, port, nonce, translation_params)
 
             # Filter queued and finished tasks
             now = time.time()
@@ -596,8 +946,7 @@ async def dispatch(host: str, port: int, nonce: str = None, translation_params:
                             pass
 
             for tid in to_del_task_ids:
-                del TASK_STATES[tid]
-                del TASK_DATA[tid]
+                await remove_task(tid)
 
             # Delete oldest folder if disk space is becoming sparse
             if DISK_SPACE_LIMIT >= 0 and len(FINISHED_TASKS) > 0 and shutil.disk_usage('result/')[2] < DISK_SPACE_LIMIT:
@@ -609,12 +958,15 @@ async def dispatch(host: str, port: int, nonce: str = None, translation_params:
                 except FileNotFoundError:
                     pass
     except:
-        if client_process.poll() is None:
-            # client_process.terminate()
-            client_process.kill()
+        for worker in list(WORKERS.values()):
+            stop_worker(worker)
         await runner.cleanup()
         raise
 
+    print('Shutting down, waiting for ongoing tasks to finish')
+    await drain_workers()
+    await runner.cleanup()
+
 if __name__ == '__main__':
     from ..args import parser
 
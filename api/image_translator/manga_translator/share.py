@@ -1,24 +1,41 @@
 import asyncio
-import pickle
 from threading import Lock
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, Path, Request, Response
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Path, Request
 import inspect
 
 from starlette.responses import StreamingResponse
 
 from manga_translator import MangaTranslator
-
-class MethodCall(BaseModel):
-    method_name: str
-    attributes: bytes
+from manga_translator.translators.http_client import close_http_client
+from manga_translator.share_protocol import (
+    FRAME_CALL,
+    FRAME_ERROR,
+    FRAME_PROGRESS,
+    FRAME_RESULT,
+    MEDIA_TYPE,
+    ShareEncoder,
+    ShareProtocolError,
+    decode,
+    encode_frame,
+    encode_frame_header,
+    iter_frame,
+    read_frames,
+)
 
 
 async def load_data(request: Request, method):
-    attributes_bytes = await request.body()
-    attributes = pickle.loads(attributes_bytes)
+    try:
+        frames = read_frames(await request.body())
+        if len(frames) != 1 or frames[0][0]['kind'] != FRAME_CALL:
+            raise ShareProtocolError('Expected a single call frame')
+        attributes = decode(frames[0][1])
+    except Exception as e:
+        # Anything the payload can make decoding raise, e.g. a bad pattern in re.compile
+        raise HTTPException(status_code=400, detail=f'Malformed request: {e}')
+    if not isinstance(attributes, dict):
+        raise HTTPException(status_code=400, detail="Arguments have to be sent as a map")
     sig = inspect.signature(method)
     expected_args = set(sig.parameters.keys())
     provided_args = set(attributes.keys())
@@ -34,28 +51,28 @@ class MangaShare:
         self.host = params.get('host', '127.0.0.1')
         self.port = int(params.get('port', '5003'))
         self.nonce = params.get('nonce', None)
+        self.encoder = ShareEncoder(params.get('share_image_format', 'raw'))
 
-        # each chunk has a structure like this status_code(int/1byte),len(int/4bytes),bytechunk
-        # status codes are 0 for result, 1 for progress report, 2 for error
+        # responses are streams of share_protocol frames, either progress reports
+        # followed by the result or an error
         self.progress_queue = asyncio.Queue()
         self.lock = Lock()
 
         async def hook(state: str, finished: bool):
-            state_data = state.encode("utf-8")
-            progress_data = b'\x01' + len(state_data).to_bytes(4, 'big') + state_data
-            await self.progress_queue.put(progress_data)
+            await self.progress_queue.put((False, [encode_frame_header(FRAME_PROGRESS, state=state, finished=finished)]))
             await asyncio.sleep(0)
 
         self.manga.add_progress_hook(hook)
 
     async def progress_stream(self):
         """
-        loops until the status is != 1 which is eiter an error or the result
+        loops until a final frame was sent which is either an error or the result
         """
         while True:
-            progress = await self.progress_queue.get()
-            yield progress
-            if progress[0] != 1:
+            final, chunks = await self.progress_queue.get()
+            for chunk in chunks:
+                yield chunk
+            if final:
                 break
 
     async def run_method(self, method, **attributes):
@@ -64,13 +81,10 @@ class MangaShare:
                 result = await method(**attributes)
             else:
                 result = method(**attributes)
-            result_bytes = pickle.dumps(result)
-            encoded_result = b'\x00' + len(result_bytes).to_bytes(4, 'big') + result_bytes
-            await self.progress_queue.put(encoded_result)
+            result_bytes = await asyncio.get_running_loop().run_in_executor(None, self.encoder.encode, result)
+            await self.progress_queue.put((True, iter_frame(FRAME_RESULT, result_bytes)))
         except Exception as e:
-            err_bytes = str(e).encode("utf-8")
-            encoded_result = b'\x02' + len(err_bytes).to_bytes(4, 'big') + err_bytes
-            await self.progress_queue.put(encoded_result)
+            await self.progress_queue.put((True, [encode_frame(FRAME_ERROR, message=str(e))]))
         finally:
             self.lock.release()
 
@@ -106,16 +120,20 @@ class MangaShare:
         async def execute_method(request: Request, method_name: str = Path(...)):
             self.check_nonce(request)
             self.check_lock()
-            method = self.get_fn(method_name)
-            attr = await load_data(request, method)
+            try:
+                method = self.get_fn(method_name)
+                attr = await load_data(request, method)
+            except Exception:
+                self.lock.release()
+                raise
             try:
                 if asyncio.iscoroutinefunction(method):
                     result = await method(**attr)
                 else:
                     result = method(**attr)
+                result_bytes = await asyncio.get_running_loop().run_in_executor(None, self.encoder.encode, result)
                 self.lock.release()
-                result_bytes = pickle.dumps(result)
-                return Response(content=result_bytes, media_type="application/octet-stream")
+                return StreamingResponse(iter_frame(FRAME_RESULT, result_bytes), media_type=MEDIA_TYPE)
             except Exception as e:
                 self.lock.release()
                 raise HTTPException(status_code=500, detail=str(e))
@@ -124,14 +142,21 @@ class MangaShare:
         async def execute_method(request: Request, method_name: str = Path(...)):
             self.check_nonce(request)
             self.check_lock()
-            method = self.get_fn(method_name)
-            attr = await load_data(request, method)
+            try:
+                method = self.get_fn(method_name)
+                attr = await load_data(request, method)
+            except Exception:
+                self.lock.release()
+                raise
 
             # streaming response
-            streaming_response = StreamingResponse(self.progress_stream(), media_type="application/octet-stream")
+            streaming_response = StreamingResponse(self.progress_stream(), media_type=MEDIA_TYPE)
             asyncio.create_task(self.run_method(method, **attr))
             return streaming_response
 
         config = uvicorn.Config(app, host=self.host, port=self.port)
         server = uvicorn.Server(config)
-        await server.serve()
+        try:
+            await server.serve()
+        finally:
+            await close_http_client()
@@ -0,0 +1,345 @@
+"""
+Binary protocol used by `MangaShare` (share.py) and `MangaShareClient`.
+
+Every message is made up of frames:
+
+    header length (uint32, big endian) | msgpack header | payload
+
+The header always contains the protocol version `v`, the frame `kind` and the
+payload `size`. Payloads are msgpack encoded values. Instead of pickle only a
+fixed set of types can be transferred: msgpack natives, numpy arrays/scalars,
+PIL images and the pipeline objects listed in `_OBJECT_SCHEMAS`, whose fields
+are serialized explicitly.
+"""
+
+import asyncio
+import io
+import re
+import struct
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import msgpack
+import numpy as np
+from PIL import Image
+
+from .utils import Context, Quadrilateral, TextBlock
+
+PROTOCOL_VERSION = 1
+MEDIA_TYPE = 'application/x-manga-share'
+
+# Payloads larger than this are sent in multiple pieces
+CHUNK_SIZE = 1024 * 1024
+
+FRAME_CALL = 'call'
+FRAME_PROGRESS = 'progress'
+FRAME_RESULT = 'result'
+FRAME_ERROR = 'error'
+
+IMAGE_FORMATS = ('raw', 'png', 'webp')
+
+_HEADER_LENGTH = struct.Struct('>I')
+# Upper bound for a frame header, anything bigger is a corrupt stream
+_MAX_HEADER_SIZE = 64 * 1024
+
+_EXT_NDARRAY = 1
+_EXT_NUMPY_SCALAR = 2
+_EXT_IMAGE = 3
+_EXT_TUPLE = 4
+_EXT_CONTEXT = 5
+_EXT_QUADRILATERAL = 6
+_EXT_TEXTBLOCK = 7
+_EXT_TRANSLATOR_CHAIN = 8
+_EXT_PATTERN = 9
+_EXT_DICTCONFIG = 10
+
+# Attributes of the pipeline objects that are transferred. Attributes that are
+# not listed (e.g. cached properties) are recomputed on the receiving side.
+_OBJECT_SCHEMAS = {
+    _EXT_QUADRILATERAL: (Quadrilateral, (
+        'pts', 'direction', 'text', 'prob',
+        'fg_r', 'fg_g', 'fg_b', 'bg_r', 'bg_g', 'bg_b',
+        'assigned_direction', 'textlines', 'translation',
+    )),
+    _EXT_TEXTBLOCK: (TextBlock, (
+        'lines', 'language', 'font_size', 'angle', '_direction', 'texts', 'text', 'prob',
+        'translation', 'fg_colors', 'bg_colors', 'font_family', 'bold', 'underline', 'italic',
+        'rich_text', 'line_spacing', 'letter_spacing', '_alignment', '_source_lang', 'target_lang',
+        '_bounding_rect', 'default_stroke_width', 'font_weight', 'adjust_bg_color', 'opacity',
+        'shadow_radius', 'shadow_strength', 'shadow_color', 'shadow_offset',
+        'enlarge_ratio', 'enlarged_xyxy',
+    )),
+}
+
+
+class ShareProtocolError(Exception):
+    pass
+
+
+class RemoteExecutionError(Exception):
+    """Raised by `MangaShareClient` if the remote method raised an exception."""
+    pass
+
+
+class ShareEncoder:
+    """
+    Encodes values into msgpack payloads.
+
+    `image_format` selects how PIL images are transferred: 'raw' sends the
+    uncompressed pixel buffer, 'png' and 'webp' (lossless) trade encoding time
+    for a smaller payload. Numpy arrays are always sent raw.
+    """
+
+    def __init__(self, image_format: str = 'raw'):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f'Invalid image format: "{image_format}". Choose from the following: %s' % ','.join(IMAGE_FORMATS))
+        self.image_format = image_format
+
+    def encode(self, value: Any) -> bytes:
+        # strict_types makes tuples and dict subclasses like Context go through _default
+        return msgpack.packb(value, default=self._default, use_bin_type=True, strict_types=True)
+
+    def _default(self, obj: Any):
+        if isinstance(obj, np.ndarray):
+            return msgpack.ExtType(_EXT_NDARRAY, self._encode_array(obj))
+        if isinstance(obj, np.generic):
+            return msgpack.ExtType(_EXT_NUMPY_SCALAR, self._encode_array(np.asarray(obj)))
+        if isinstance(obj, Image.Image):
+            return msgpack.ExtType(_EXT_IMAGE, self._encode_image(obj))
+        if isinstance(obj, tuple):
+            return msgpack.ExtType(_EXT_TUPLE, self.encode(list(obj)))
+        if isinstance(obj, Context):
+            return msgpack.ExtType(_EXT_CONTEXT, self.encode(dict(obj)))
+        if isinstance(obj, re.Pattern):
+            return msgpack.ExtType(_EXT_PATTERN, self.encode([obj.pattern, obj.flags]))
+        for code, (cls, fields) in _OBJECT_SCHEMAS.items():
+            if type(obj) is cls:
+                state = {name: getattr(obj, name) for name in fields if name in obj.__dict__}
+                return msgpack.ExtType(code, self.encode(state))
+
+        from .translators import TranslatorChain
+        if isinstance(obj, TranslatorChain):
+            chain = ';'.join(f'{trans}:{lang}' for trans, lang in obj.chain)
+            return msgpack.ExtType(_EXT_TRANSLATOR_CHAIN, self.encode([chain, obj.target_lang]))
+        if type(obj).__name__ == 'DictConfig':
+            from omegaconf import OmegaConf
+            return msgpack.ExtType(_EXT_DICTCONFIG, self.encode(OmegaConf.to_container(obj)))
+
+        raise TypeError(f'Type {type(obj).__name__} can not be transferred through the share protocol')
+
+    def _encode_array(self, arr: np.ndarray) -> bytes:
+        if arr.dtype.hasobject:
+            raise TypeError('Numpy arrays of python objects can not be transferred through the share protocol')
+        return msgpack.packb([arr.dtype.str, list(arr.shape), arr.tobytes()], use_bin_type=True)
+
+    def _encode_image(self, img: Image.Image) -> bytes:
+        fmt = self.image_format
+        # Palettes are not part of the raw buffer and webp only handles RGB(A)
+        if img.mode == 'P' or (fmt == 'webp' and img.mode not in ('RGB', 'RGBA')):
+            fmt = 'png'
+        if fmt == 'raw':
+            data = img.tobytes()
+        else:
+            buf = io.BytesIO()
+            if fmt == 'webp':
+                img.save(buf, format='WEBP', lossless=True, quality=0)
+            else:
+                img.save(buf, format='PNG', compress_level=1)
+            data = buf.getvalue()
+        return msgpack.packb([img.mode, list(img.size), fmt, data], use_bin_type=True)
+
+
+def decode(data: bytes) -> Any:
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False)
+
+
+def _decode_array(data: bytes) -> np.ndarray:
+    dtype, shape, buf = msgpack.unpackb(data, raw=False)
+    dtype = np.dtype(dtype)
+    if dtype.hasobject:
+        raise ShareProtocolError('Received numpy array of python objects')
+    # Copy so the array is writable like the one that was sent
+    return np.frombuffer(buf, dtype=dtype).reshape(shape).copy()
+
+
+def _decode_image(data: bytes) -> Image.Image:
+    mode, size, fmt, buf = msgpack.unpackb(data, raw=False)
+    if fmt == 'raw':
+        return Image.frombytes(mode, tuple(size), buf)
+    if fmt not in IMAGE_FORMATS:
+        raise ShareProtocolError(f'Unknown image format: "{fmt}"')
+    img = Image.open(io.BytesIO(buf))
+    img.load()
+    # WebP drops an opaque alpha channel, and a plain image is returned rather than a PngImageFile
+    return img.convert(mode) if img.mode != mode else img.copy()
+
+
+def _ext_hook(code: int, data: bytes):
+    if code == _EXT_NDARRAY:
+        return _decode_array(data)
+    if code == _EXT_NUMPY_SCALAR:
+        return _decode_array(data)[()]
+    if code == _EXT_IMAGE:
+        return _decode_image(data)
+    if code == _EXT_TUPLE:
+        return tuple(decode(data))
+    if code == _EXT_CONTEXT:
+        return Context(**decode(data))
+    if code == _EXT_PATTERN:
+        pattern, flags = decode(data)
+        return re.compile(pattern, flags)
+    if code in _OBJECT_SCHEMAS:
+        cls, fields = _OBJECT_SCHEMAS[code]
+        state = decode(data)
+        if not isinstance(state, dict) or not set(state).issubset(fields):
+            raise ShareProtocolError(f'Invalid fields for {cls.__name__}')
+        # Bypass __init__ as the constructors derive fields from their arguments
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        return obj
+    if code == _EXT_TRANSLATOR_CHAIN:
+        from .translators import TranslatorChain
+        chain, target_lang = decode(data)
+        obj = TranslatorChain(chain)
+        obj.target_lang = target_lang
+        return obj
+    if code == _EXT_DICTCONFIG:
+        from omegaconf import OmegaConf
+        return OmegaConf.create(decode(data))
+    raise ShareProtocolError(f'Unknown extension type: {code}')
+
+
+def encode_frame_header(kind: str, size: int = 0, **fields) -> bytes:
+    header = msgpack.packb({'v': PROTOCOL_VERSION, 'kind': kind, 'size': size, **fields}, use_bin_type=True)
+    return _HEADER_LENGTH.pack(len(header)) + header
+
+
+def iter_frame(kind: str, payload: bytes = b'', **fields) -> Iterator[bytes]:
+    """Yields a frame in pieces of at most `CHUNK_SIZE` bytes."""
+    yield encode_frame_header(kind, len(payload), **fields)
+    view = memoryview(payload)
+    for i in range(0, len(payload), CHUNK_SIZE):
+        yield bytes(view[i:i + CHUNK_SIZE])
+
+
+def encode_frame(kind: str, payload: bytes = b'', **fields) -> bytes:
+    return b''.join(iter_frame(kind, payload, **fields))
+
+
+class FrameReader:
+    """
+    Incrementally splits a byte stream into `(header, payload)` frames.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._header: Optional[dict] = None
+
+    def feed(self, data: bytes) -> List[Tuple[dict, bytes]]:
+        self._buffer += data
+        frames = []
+        while True:
+            if self._header is None:
+                if len(self._buffer) < _HEADER_LENGTH.size:
+                    break
+                header_size, = _HEADER_LENGTH.unpack_from(self._buffer)
+                if header_size > _MAX_HEADER_SIZE:
+                    raise ShareProtocolError('Frame header too large')
+                if len(self._buffer) < _HEADER_LENGTH.size + header_size:
+                    break
+                header = msgpack.unpackb(bytes(self._buffer[_HEADER_LENGTH.size:_HEADER_LENGTH.size + header_size]), raw=False)
+                if not isinstance(header, dict) or header.get('v') != PROTOCOL_VERSION:
+                    raise ShareProtocolError(f'Unsupported protocol version: {header.get("v") if isinstance(header, dict) else None}')
+                if not isinstance(header.get('kind'), str) or not isinstance(header.get('size', 0), int):
+                    raise ShareProtocolError('Malformed frame header')
+                del self._buffer[:_HEADER_LENGTH.size + header_size]
+                self._header = header
+            size = self._header.get('size', 0)
+            if len(self._buffer) < size:
+                break
+            payload = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            frames.append((self._header, payload))
+            self._header = None
+        return frames
+
+    @property
+    def pending(self) -> bool:
+        return self._header is not None or len(self._buffer) > 0
+
+
+def read_frames(data: bytes) -> List[Tuple[dict, bytes]]:
+    reader = FrameReader()
+    frames = reader.feed(data)
+    if reader.pending:
+        raise ShareProtocolError('Incomplete frame')
+    return frames
+
+
+class MangaShareClient:
+    """
+    Client for a `MangaShare` server.
+
+    ```py
+    client = MangaShareClient('127.0.0.1', 5003)
+    ctx = await client.execute('translate', image=img, params={'translator': 'none'})
+    ```
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 5003, nonce: str = None, image_format: str = 'raw'):
+        self.url = f'http://{host}:{port}'
+        self.nonce = nonce
+        self.encoder = ShareEncoder(image_format)
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {'Content-Type': MEDIA_TYPE}
+        if self.nonce:
+            headers['X-Nonce'] = self.nonce
+        return headers
+
+    async def is_locked(self) -> bool:
+        from aiohttp import ClientSession
+        async with ClientSession() as session:
+            async with session.get(f'{self.url}/is_locked') as resp:
+                return (await resp.json())['locked']
+
+    async def simple_execute(self, method_name: str, **attributes):
+        """Calls a method of the remote `MangaTranslator` and returns its result."""
+        async for kind, value in self._stream(f'{self.url}/simple_execute/{method_name}', attributes):
+            if kind == FRAME_RESULT:
+                return value
+        raise ShareProtocolError('Response ended without result')
+
+    async def execute(self, method_name: str, progress_hook: Callable[[str, bool], Awaitable] = None, **attributes):
+        """
+        Like `simple_execute`, but progress reports of the remote translator are
+        forwarded to `progress_hook` while the method is running.
+        """
+        async for kind, value in self._stream(f'{self.url}/execute/{method_name}', attributes):
+            if kind == FRAME_PROGRESS:
+                if progress_hook is not None:
+                    await progress_hook(*value)
+            elif kind == FRAME_RESULT:
+                return value
+        raise ShareProtocolError('Response ended without result')
+
+    async def _stream(self, url: str, attributes: dict) -> AsyncIterator[Tuple[str, Any]]:
+        from aiohttp import ClientSession, ClientTimeout
+        body = encode_frame(FRAME_CALL, self.encoder.encode(attributes))
+        reader = FrameReader()
+        async with ClientSession(timeout=ClientTimeout(total=None)) as session:
+            async with session.post(url, data=body, headers=self._headers()) as resp:
+                if resp.status != 200:
+                    raise RemoteExecutionError(f'{resp.status}: {await resp.text()}')
+                async for data in resp.content.iter_chunked(CHUNK_SIZE):
+                    for header, payload in reader.feed(data):
+                        kind = header['kind']
+                        if kind == FRAME_PROGRESS:
+                            yield kind, (header['state'], header['finished'])
+                        elif kind == FRAME_RESULT:
+                            # Decoding large results can take a while
+                            value = await asyncio.get_running_loop().run_in_executor(None, decode, payload)
+                            yield kind, value
+                        elif kind == FRAME_ERROR:
+                            raise RemoteExecutionError(header.get('message', ''))
+        if reader.pending:
+            raise ShareProtocolError('Incomplete frame')
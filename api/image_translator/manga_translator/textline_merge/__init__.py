@@ -1,11 +1,11 @@
 import itertools
 import numpy as np
-from typing import List, Set
+from typing import List, Set, Tuple
 from collections import Counter
 import networkx as nx
 from shapely.geometry import Polygon
 
-from ..utils import TextBlock, Quadrilateral, quadrilateral_can_merge_region
+from ..utils import TextBlock, Quadrilateral, quadrilateral_can_merge_region, get_panel_indices
 
 def split_text_region(
         bboxes: List[Quadrilateral],
@@ -181,7 +181,19 @@ def merge_bboxes_text_region(bboxes: List[Quadrilateral], width, height):
         # yield overall bbox and sorted indices
         yield txtlns, (fg_r, fg_g, fg_b), (bg_r, bg_g, bg_b)
 
-async def dispatch(textlines: List[Quadrilateral], width: int, height: int, verbose: bool = False) -> List[TextBlock]:
+def merge_bboxes_text_region_by_panel(bboxes: List[Quadrilateral], width, height, panels: List[Tuple[int, int, int, int]] = None):
+    # Textlines are only merged with the textlines of the same panel
+    if not panels:
+        yield from merge_bboxes_text_region(bboxes, width, height)
+        return
+    indices = get_panel_indices([box.centroid for box in bboxes], panels)
+    for panel_idx in [*range(len(panels)), -1]:
+        panel_bboxes = [box for box, i in zip(bboxes, indices) if i == panel_idx]
+        if panel_bboxes:
+            yield from merge_bboxes_text_region(panel_bboxes, width, height)
+
+async def dispatch(textlines: List[Quadrilateral], width: int, height: int, verbose: bool = False,
+                   panels: List[Tuple[int, int, int, int]] = None) -> List[TextBlock]:
     # print(width, height)
     # import re
     # for l in textlines:
@@ -190,7 +202,7 @@ async def dispatch(textlines: List[Quadrilateral], width: int, height: int, verb
     #     print(s)
 
     text_regions: List[TextBlock] = []
-    for (txtlns, fg_color, bg_color) in merge_bboxes_text_region(textlines, width, height):
+    for (txtlns, fg_color, bg_color) in merge_bboxes_text_region_by_panel(textlines, width, height, panels):
         total_logprobs = 0
         for txtln in txtlns:
             total_logprobs += np.log(txtln.prob) * txtln.area
@@ -1,55 +1,37 @@
-import py3langid as langid
-
 from .common import *
-from .baidu import BaiduTranslator
-from .deepseek import DeepseekTranslator
-# from .google import GoogleTranslator
-from .youdao import YoudaoTranslator
-from .deepl import DeeplTranslator
-from .papago import PapagoTranslator
-from .caiyun import CaiyunTranslator
-from .chatgpt import GPT3Translator, GPT4oMINITranslator
-from .nllb import NLLBTranslator, NLLBBigTranslator
-from .sugoi import JparacrawlTranslator, JparacrawlBigTranslator, SugoiTranslator
-from .m2m100 import M2M100Translator, M2M100BigTranslator
-from .mbart50 import MBart50Translator
-from .selective import SelectiveOfflineTranslator, prepare as prepare_selective_translator
-from .none import NoneTranslator
-from .original import OriginalTranslator
-from .sakura import SakuraTranslator
-from .qwen2 import Qwen2Translator, Qwen2BigTranslator
-from .groq import GroqTranslator
+from ..utils import LazyRegistry, guess_language
 
-OFFLINE_TRANSLATORS = {
-    'offline': SelectiveOfflineTranslator,
-    'nllb': NLLBTranslator,
-    'nllb_big': NLLBBigTranslator,
-    'sugoi': SugoiTranslator,
-    'jparacrawl': JparacrawlTranslator,
-    'jparacrawl_big': JparacrawlBigTranslator,
-    'm2m100': M2M100Translator,
-    'm2m100_big': M2M100BigTranslator,
-    'mbart50': MBart50Translator,
-    'qwen2': Qwen2Translator,
-    'qwen2_big': Qwen2BigTranslator,
+OFFLINE_TRANSLATOR_MODULES = {
+    'offline': '.selective:SelectiveOfflineTranslator',
+    'nllb': '.nllb:NLLBTranslator',
+    'nllb_big': '.nllb:NLLBBigTranslator',
+    'sugoi': '.sugoi:SugoiTranslator',
+    'jparacrawl': '.sugoi:JparacrawlTranslator',
+    'jparacrawl_big': '.sugoi:JparacrawlBigTranslator',
+    'm2m100': '.m2m100:M2M100Translator',
+    'm2m100_big': '.m2m100:M2M100BigTranslator',
+    'mbart50': '.mbart50:MBart50Translator',
+    'qwen2': '.qwen2:Qwen2Translator',
+    'qwen2_big': '.qwen2:Qwen2BigTranslator',
 }
+OFFLINE_TRANSLATORS = LazyRegistry(__name__, OFFLINE_TRANSLATOR_MODULES)
 
-TRANSLATORS = {
-    # 'google': GoogleTranslator,
-    'youdao': YoudaoTranslator,
-    'baidu': BaiduTranslator,
-    'deepl': DeeplTranslator,
-    'papago': PapagoTranslator,
-    'caiyun': CaiyunTranslator,
-    'gpt3': GPT3Translator,
-    'gpt4omini': GPT4oMINITranslator,
-    'none': NoneTranslator,
-    'original': OriginalTranslator,
-    'sakura': SakuraTranslator,
-    'deepseek': DeepseekTranslator,
-    'groq':GroqTranslator,
-    **OFFLINE_TRANSLATORS,
-}
+TRANSLATORS = LazyRegistry(__name__, {
+    # 'google': '.google:GoogleTranslator',
+    'youdao': '.youdao:YoudaoTranslator',
+    'baidu': '.baidu:BaiduTranslator',
+    'deepl': '.deepl:DeeplTranslator',
+    'papago': '.papago:PapagoTranslator',
+    'caiyun': '.caiyun:CaiyunTranslator',
+    'gpt3': '.chatgpt:GPT3Translator',
+    'gpt4omini': '.chatgpt:GPT4oMINITranslator',
+    'none': '.none:NoneTranslator',
+    'original': '.original:OriginalTranslator',
+    'sakura': '.sakura:SakuraTranslator',
+    'deepseek': '.deepseek:DeepseekTranslator',
+    'groq': '.groq:GroqTranslator',
+    **OFFLINE_TRANSLATOR_MODULES,
+})
 translator_cache = {}
 
 def get_translator(key: str, *args, **kwargs) -> CommonTranslator:
@@ -60,8 +42,6 @@ def get_translator(key: str, *args, **kwargs) -> CommonTranslator:
         translator_cache[key] = translator(*args, **kwargs)
     return translator_cache[key]
 
-prepare_selective_translator(get_translator)
-
 # TODO: Refactor
 class TranslatorChain():
     def __init__(self, string: str):
@@ -106,7 +86,7 @@ async def dispatch(chain: TranslatorChain, queries: List[str], use_mtpe: bool =
         return queries
 
     if chain.target_lang is not None:
-        text_lang = ISO_639_1_TO_VALID_LANGUAGES.get(langid.classify('\n'.join(queries))[0])
+        text_lang = ISO_639_1_TO_VALID_LANGUAGES.get(guess_language(queries))
         translator = None
         for key, lang in chain.chain:
             if text_lang == lang:
@@ -5,7 +5,6 @@ import hashlib
 import urllib.parse
 import random
 import re
-import aiohttp
 
 from .common import CommonTranslator, InvalidServerResponse, MissingAPIKeyException
 from .keys import BAIDU_APP_ID, BAIDU_SECRET_KEY
@@ -54,9 +53,8 @@ class BaiduTranslator(CommonTranslator):
             n_queries.extend(batch)
 
         url = self.get_url(from_lang, to_lang, '\n'.join(n_queries))
-        async with aiohttp.ClientSession() as session:
-            async with session.get('https://'+BASE_URL+url) as resp:
-                result = await resp.json()
+        # Translations are billed per request, so failures after sending it aren't retried
+        result = await self.http.get('https://'+BASE_URL+url, idempotent=False)
         result_list = []
         if "trans_result" not in result:
             raise InvalidServerResponse(f'Baidu returned invalid response: {result}\nAre the API keys set correctly?')
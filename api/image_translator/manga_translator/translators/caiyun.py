@@ -1,7 +1,5 @@
 
 # -*- coding: utf-8 -*-
-import aiohttp
-
 from .common import CommonTranslator, InvalidServerResponse, MissingAPIKeyException
 from .keys import CAIYUN_TOKEN
 
@@ -52,6 +50,4 @@ class CaiyunTranslator(CommonTranslator):
             "content-type": "application/json",
             "x-authorization": "token " + CAIYUN_TOKEN,
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self._API_URL, json=data, headers=headers) as resp:
-                return await resp.json()
+        return await self.http.post(self._API_URL, json=data, headers=headers)
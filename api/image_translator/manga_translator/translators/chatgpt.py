@@ -5,7 +5,8 @@ except ImportError:
     openai = None
 import asyncio
 import time
-from typing import List, Dict
+from collections import deque
+from typing import List, Dict, Optional, Tuple
 
 from .common import CommonTranslator, MissingAPIKeyException
 from .keys import OPENAI_API_KEY, OPENAI_HTTP_PROXY, OPENAI_API_BASE
@@ -45,6 +46,7 @@ class GPT3Translator(CommonTranslator):
     _RETRY_ATTEMPTS = 3 # Number of times to retry an errored request before giving up
     _TIMEOUT_RETRY_ATTEMPTS = 3 # Number of times to retry a timed out request before giving up
     _RATELIMIT_RETRY_ATTEMPTS = 3 # Number of times to retry a ratelimited request before giving up
+    _MAX_CONCURRENT_REQUESTS = 4 # Number of prompts that are sent at the same time
     _CONFIG_KEY = 'gpt3'
 
     _MAX_TOKENS = 4096
@@ -70,6 +72,7 @@ class GPT3Translator(CommonTranslator):
         self.token_count = 0
         self.token_count_last = 0
         self.config = None
+        self._request_timestamps = deque()
 
     def parse_args(self, args):
         self.config = args.gpt_config
@@ -91,7 +94,13 @@ class GPT3Translator(CommonTranslator):
     def top_p(self) -> float:
         return self._config_get('top_p', default=1)
 
-    def _assemble_prompts(self, from_lang: str, to_lang: str, queries: List[str]):
+    def _count_tokens(self, text: str) -> int:
+        # Rough estimate that errs on the large side: ascii text has ~4 characters
+        # per token and CJK characters (3 bytes in utf-8) are about one token each.
+        # See https://platform.openai.com/tokenizer
+        return len(text.encode('utf-8')) // 3 + 1
+
+    def _build_prompt(self, to_lang: str, queries: List[str]) -> str:
         prompt = ''
 
         if self._INCLUDE_TEMPLATE:
@@ -100,93 +109,166 @@ class GPT3Translator(CommonTranslator):
         if self._RETURN_PROMPT:
             prompt += '\nOriginal:'
 
-        i_offset = 0
         for i, query in enumerate(queries):
-            prompt += f'\n<|{i+1-i_offset}|>{query}'
-
-            # If prompt is growing too large and there's still a lot of text left
-            # split off the rest of the queries into new prompts.
-            # 1 token = ~4 characters according to https://platform.openai.com/tokenizer
-            # TODO: potentially add summarizations from special requests as context information
-            if self._MAX_TOKENS * 2 and len(''.join(queries[i+1:])) > self._MAX_TOKENS:
-                if self._RETURN_PROMPT:
-                    prompt += '\n<|1|>'
-                yield prompt.lstrip(), i+1-i_offset
-                prompt = self.prompt_template.format(to_lang=to_lang)
-                # Restart counting at 1
-                i_offset = i + 1
+            prompt += f'\n<|{i+1}|>{query}'
 
         if self._RETURN_PROMPT:
             prompt += '\n<|1|>'
 
-        yield prompt.lstrip(), len(queries)-i_offset
+        return prompt.lstrip()
+
+    def _pack_queries(self, to_lang: str, pages: List[List[str]]) -> List[List[Tuple[int, int]]]:
+        """
+        Distributes the queries of all pages over as few prompts as the token
+        budget allows. Returns the (page, query) indices belonging to each prompt.
+        """
+        # Assuming that half of the tokens are used for the query
+        budget = self._MAX_TOKENS // 2 - self._count_tokens(self._build_prompt(to_lang, []))
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for p, queries in enumerate(pages):
+            for i, query in enumerate(queries):
+                tokens = self._count_tokens(f'\n<|{len(batch)+1}|>{query}')
+                if batch and batch_tokens + tokens > budget:
+                    batches.append(batch)
+                    batch = []
+                    batch_tokens = 0
+                batch.append((p, i))
+                batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _assemble_prompts(self, from_lang: str, to_lang: str, queries: List[str]):
+        for batch in self._pack_queries(to_lang, [queries]):
+            yield self._build_prompt(to_lang, [queries[i] for _, i in batch]), len(batch)
 
     def _format_prompt_log(self, to_lang: str, prompt: str) -> str:
         return prompt
 
+    def _parse_response(self, response: str, query_size: int) -> Optional[List[str]]:
+        """
+        Maps the numbered translations of the response back to the queries.
+        Returns None if they don't line up.
+        """
+        parts = re.split(r'<\|(\d+)\|>', response)
+        translations = {}
+        for n, translation in zip(parts[1::2], parts[2::2]):
+            translations.setdefault(int(n), translation)
+        # When there is only one query chatgpt likes to exclude the <|1|>,
+        # it is also omitted if the prompt already ends with it
+        if 1 not in translations and parts[0].strip():
+            translations[1] = parts[0]
+
+        if len(translations) <= 1 and query_size > 1:
+            # Try splitting by newlines instead
+            lines = [line for line in response.split('\n') if line.strip()]
+            translations = {i + 1: line for i, line in enumerate(lines)}
+
+        if sorted(translations) != list(range(1, query_size + 1)):
+            return None
+        return [translations[i + 1].strip() for i in range(query_size)]
+
+    async def _ratelimit_sleep(self):
+        # Every request is ratelimited separately in _wait_for_request_slot
+        pass
+
+    async def _wait_for_request_slot(self):
+        """Sleeps until sending another request stays within _MAX_REQUESTS_PER_MINUTE."""
+        if self._MAX_REQUESTS_PER_MINUTE <= 0:
+            return
+        # Reserve the slot before sleeping so that concurrent requests queue up behind each other
+        now = time.time()
+        slot = now
+        if len(self._request_timestamps) >= self._MAX_REQUESTS_PER_MINUTE:
+            slot = max(now, self._request_timestamps.popleft() + 60)
+        self._request_timestamps.append(slot)
+        if slot > now:
+            self.logger.info(f'Ratelimit sleep: {(slot-now):.2f}s')
+            await asyncio.sleep(slot - now)
+
+    async def _send_request(self, to_lang: str, prompt: str) -> str:
+        self.logger.debug('-- GPT Prompt --\n' + self._format_prompt_log(to_lang, prompt))
+
+        ratelimit_attempt = 0
+        server_error_attempt = 0
+        timeout_attempt = 0
+        while True:
+            await self._wait_for_request_slot()
+            try:
+                response = await asyncio.wait_for(self._request_translation(to_lang, prompt),
+                                                  self._TIMEOUT + (timeout_attempt * self._TIMEOUT / 2))
+                break
+            except asyncio.TimeoutError: # Server takes too long to respond
+                if timeout_attempt >= self._TIMEOUT_RETRY_ATTEMPTS:
+                    raise Exception('openai servers did not respond quickly enough.')
+                timeout_attempt += 1
+                self.logger.warn(f'Restarting request due to timeout. Attempt: {timeout_attempt}')
+            except openai.RateLimitError: # Server returned ratelimit response
+                ratelimit_attempt += 1
+                if ratelimit_attempt >= self._RATELIMIT_RETRY_ATTEMPTS:
+                    raise
+                self.logger.warn(f'Restarting request due to ratelimiting by openai servers. Attempt: {ratelimit_attempt}')
+                await asyncio.sleep(2)
+            except openai.APIError: # Server returned 500 error (probably server load)
+                server_error_attempt += 1
+                if server_error_attempt >= self._RETRY_ATTEMPTS:
+                    self.logger.error('OpenAI encountered a server error, possibly due to high server load. Use a different translator or try again later.')
+                    raise
+                self.logger.warn(f'Restarting request due to a server error. Attempt: {server_error_attempt}')
+                await asyncio.sleep(1)
+
+        self.logger.debug('-- GPT Response --\n' + response)
+        return response
+
+    async def _translate_batch(self, to_lang: str, queries: List[str], semaphore: asyncio.Semaphore) -> List[str]:
+        async with semaphore:
+            response = await self._send_request(to_lang, self._build_prompt(to_lang, queries))
+
+        translations = self._parse_response(response, len(queries))
+        if translations is not None:
+            return translations
+        if len(queries) == 1:
+            return [response.strip()]
+
+        # Only retry the misaligned batch, split in halves so that they can't fail the same way again
+        self.logger.warning(f'Got a misaligned response for {len(queries)} queries, retrying them in two halves')
+        mid = len(queries) // 2
+        first, second = await asyncio.gather(
+            self._translate_batch(to_lang, queries[:mid], semaphore),
+            self._translate_batch(to_lang, queries[mid:], semaphore),
+        )
+        return first + second
+
+    async def _translate_pages(self, to_lang: str, pages: List[List[str]]) -> List[List[str]]:
+        """
+        Translates the queries of multiple pages together. The queries are packed
+        into prompts up to the token budget and independent prompts are sent concurrently.
+        """
+        batches = self._pack_queries(to_lang, pages)
+        semaphore = asyncio.Semaphore(self._MAX_CONCURRENT_REQUESTS)
+        token_count = self.token_count
+        results = await asyncio.gather(*(
+            self._translate_batch(to_lang, [pages[p][i] for p, i in batch], semaphore) for batch in batches
+        ))
+
+        translations = [[''] * len(queries) for queries in pages]
+        for batch, batch_translations in zip(batches, results):
+            for (p, i), translation in zip(batch, batch_translations):
+                translations[p][i] = translation
+
+        self.token_count_last = self.token_count - token_count
+        if self.token_count_last:
+            self.logger.info(f'Used {self.token_count_last} tokens in {len(batches)} requests for {len(pages)} pages (Total: {self.token_count})')
+        return translations
+
     async def _translate(self, from_lang: str, to_lang: str, queries: List[str]) -> List[str]:
-        translations = []
         self.logger.debug(f'Temperature: {self.temperature}, TopP: {self.top_p}')
 
-        for prompt, query_size in self._assemble_prompts(from_lang, to_lang, queries):
-            self.logger.debug('-- GPT Prompt --\n' + self._format_prompt_log(to_lang, prompt))
-
-            ratelimit_attempt = 0
-            server_error_attempt = 0
-            timeout_attempt = 0
-            while True:
-                request_task = asyncio.create_task(self._request_translation(to_lang, prompt))
-                started = time.time()
-                while not request_task.done():
-                    await asyncio.sleep(0.1)
-                    if time.time() - started > self._TIMEOUT + (timeout_attempt * self._TIMEOUT / 2):
-                        # Server takes too long to respond
-                        if timeout_attempt >= self._TIMEOUT_RETRY_ATTEMPTS:
-                            raise Exception('openai servers did not respond quickly enough.')
-                        timeout_attempt += 1
-                        self.logger.warn(f'Restarting request due to timeout. Attempt: {timeout_attempt}')
-                        request_task.cancel()
-                        request_task = asyncio.create_task(self._request_translation(to_lang, prompt))
-                        started = time.time()
-                try:
-                    response = await request_task
-                    break
-                except openai.RateLimitError: # Server returned ratelimit response
-                    ratelimit_attempt += 1
-                    if ratelimit_attempt >= self._RATELIMIT_RETRY_ATTEMPTS:
-                        raise
-                    self.logger.warn(f'Restarting request due to ratelimiting by openai servers. Attempt: {ratelimit_attempt}')
-                    await asyncio.sleep(2)
-                except openai.APIError: # Server returned 500 error (probably server load)
-                    server_error_attempt += 1
-                    if server_error_attempt >= self._RETRY_ATTEMPTS:
-                        self.logger.error('OpenAI encountered a server error, possibly due to high server load. Use a different translator or try again later.')
-                        raise
-                    self.logger.warn(f'Restarting request due to a server error. Attempt: {server_error_attempt}')
-                    await asyncio.sleep(1)
-
-            self.logger.debug('-- GPT Response --\n' + response)
-
-            new_translations = re.split(r'<\|\d+\|>', response)
-            # When there is only one query chatgpt likes to exclude the <|1|>
-            if not new_translations[0].strip():
-                new_translations = new_translations[1:]
-
-            if len(new_translations) <= 1 and query_size > 1:
-                # Try splitting by newlines instead
-                new_translations = re.split(r'\n', response)
-
-            if len(new_translations) > query_size:
-                new_translations = new_translations[: query_size]
-            elif len(new_translations) < query_size :
-                new_translations = new_translations + [''] * (query_size - len(new_translations))
-
-            translations.extend([t.strip() for t in new_translations])
+        translations = (await self._translate_pages(to_lang, [queries]))[0]
 
         self.logger.debug(translations)
-        if self.token_count_last:
-            self.logger.info(f'Used {self.token_count_last} tokens (Total: {self.token_count})')
-
         return translations
 
     async def _request_translation(self, to_lang: str, prompt: str) -> str:
@@ -5,6 +5,7 @@ from typing import List, Tuple
 from abc import abstractmethod
 
 from ..utils import InfererModule, ModelWrapper, repeating_sequence, is_valuable_text
+from .http_client import HTTPClient, get_http_client
 
 try:
     import readline
@@ -120,6 +121,11 @@ class CommonTranslator(InfererModule):
         self.mtpe_adapter = MTPEAdapter()
         self._last_request_ts = 0
 
+    @property
+    def http(self) -> HTTPClient:
+        """Shared HTTP client with connection pooling, should be used for all requests."""
+        return get_http_client()
+
     def supports_languages(self, from_lang: str, to_lang: str, fatal: bool = False) -> bool:
         supported_src_languages = ['auto'] + list(self._LANGUAGE_CODE_MAP)
         supported_tgt_languages = list(self._LANGUAGE_CODE_MAP)
@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+import aiohttp
+
+from ..utils import get_logger
+
+HTTP_TIMEOUT = float(os.getenv('MT_HTTP_TIMEOUT', 30))
+HTTP_RETRIES = int(os.getenv('MT_HTTP_RETRIES', 2))
+HTTP_LIMIT_PER_HOST = int(os.getenv('MT_HTTP_LIMIT_PER_HOST', 8))
+HTTP_DNS_CACHE_TTL = 300
+HTTP_KEEPALIVE_TIMEOUT = 60
+
+# Responses with these status codes are retried
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Methods that can be sent again without repeating their effect. Other requests,
+# like the paid translation POSTs, are only retried if the connection couldn't be
+# established, unless the caller passes `idempotent=True`.
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+class HTTPClient:
+    """
+    HTTP client shared by the online translators. Connections are pooled
+    and kept alive between requests, so translating a page doesn't repeat
+    the DNS lookup and TLS handshake. Failed idempotent requests are retried
+    with exponential backoff.
+
+    aiohttp sessions are bound to an event loop, so one session per loop is kept.
+    """
+
+    def __init__(self, timeout: float = HTTP_TIMEOUT, retries: int = HTTP_RETRIES, limit_per_host: int = HTTP_LIMIT_PER_HOST,
+                 dns_cache_ttl: int = HTTP_DNS_CACHE_TTL, keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT, retry_delay: float = 0.5):
+        self.logger = get_logger(self.__class__.__name__)
+        self.timeout = timeout
+        self.retries = retries
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.retry_delay = retry_delay
+        self._sessions: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]' = weakref.WeakKeyDictionary()
+        # key -> (expiry, value)
+        self._cache: Dict[Any, Tuple[float, Any]] = {}
+        self._cache_locks: Dict[Any, asyncio.Lock] = {}
+
+    def get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._sessions[loop] = session
+        return session
+
+    async def request(self, method: str, url: str, response_type: str = 'json', retries: int = None,
+                      idempotent: bool = None, **kwargs) -> Any:
+        """
+        Sends a request and returns the response body decoded according to
+        `response_type` ('json', 'text' or 'bytes'). Whether failures after the
+        request was sent are retried follows from `idempotent`, which defaults
+        to whether `method` is idempotent.
+        """
+        retries = self.retries if retries is None else retries
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(retries + 1):
+            try:
+                async with self.get_session().request(method, url, **kwargs) as resp:
+                    if resp.status in RETRY_STATUSES and idempotent and attempt < retries:
+                        raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status, message=resp.reason)
+                    if response_type == 'json':
+                        # Some apis don't send a json content type
+                        return await resp.json(content_type=None)
+                    if response_type == 'text':
+                        return await resp.text()
+                    return await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # The server may have acted on the request unless it was never sent
+                if attempt >= retries or not (idempotent or isinstance(e, aiohttp.ClientConnectorError)):
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                self.logger.warning(f'{method} {url} failed ({e.__class__.__name__}: {e}), retrying in {delay:.1f}s')
+                await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> Any:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> Any:
+        return await self.request('POST', url, **kwargs)
+
+    async def cached(self, key: Any, loader: Callable[[], Awaitable[Any]], ttl: float = 3600) -> Any:
+        """
+        Returns the result of `loader` for auxiliary lookups (e.g. version keys)
+        and only calls it again once `ttl` seconds passed. Concurrent callers
+        wait for the same lookup.
+        """
+        entry = self._cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        lock = self._cache_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            value = await loader()
+            self._cache[key] = (time.monotonic() + ttl, value)
+            return value
+
+    def invalidate(self, key: Any):
+        self._cache.pop(key, None)
+
+    async def close(self):
+        for session in list(self._sessions.values()):
+            if not session.closed:
+                await session.close()
+        self._sessions.clear()
+
+
+http_client = HTTPClient()
+
+def get_http_client() -> HTTPClient:
+    return http_client
+
+async def close_http_client():
+    await http_client.close()
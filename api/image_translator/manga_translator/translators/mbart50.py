@@ -1,8 +1,7 @@
 import os
-import py3langid as langid
-
 
 from .common import OfflineTranslator
+from ..utils import guess_language
 
 ISO_639_1_TO_MBart50 = {
 
@@ -78,7 +77,7 @@ class MBart50Translator(OfflineTranslator):
 
     async def _infer(self, from_lang: str, to_lang: str, queries: list[str]) -> list[str]:
         if from_lang == 'auto':
-            detected_lang = langid.classify('\n'.join(queries))[0]
+            detected_lang = guess_language(queries)
             target_lang = self._map_detected_lang_to_translator(detected_lang)
 
             if target_lang == None:
@@ -94,7 +93,7 @@ class MBart50Translator(OfflineTranslator):
             return ''
 
         if from_lang == 'auto':
-            detected_lang = langid.classify(query)[0]
+            detected_lang = guess_language(query)
             from_lang = self._map_detected_lang_to_translator(detected_lang)
 
         if from_lang == None:
@@ -1,8 +1,8 @@
 import os
 from typing import List
-import py3langid as langid
 
 from .common import OfflineTranslator
+from ..utils import guess_language
 
 # https://github.com/facebookresearch/flores/blob/main/flores200/README.md
 ISO_639_1_TO_FLORES_200 = {
@@ -76,7 +76,7 @@ class NLLBTranslator(OfflineTranslator):
 
     async def _infer(self, from_lang: str, to_lang: str, queries: List[str]) -> List[str]:
         if from_lang == 'auto':
-            detected_lang = langid.classify('\n'.join(queries))[0]
+            detected_lang = guess_language(queries)
             target_lang = self._map_detected_lang_to_translator(detected_lang)
 
             if target_lang == None:
@@ -93,7 +93,7 @@ class NLLBTranslator(OfflineTranslator):
             return ''
 
         if from_lang == 'auto':
-            detected_lang = langid.classify(query)[0]
+            detected_lang = guess_language(query)
             from_lang = self._map_detected_lang_to_translator(detected_lang)
 
         if from_lang == None:
@@ -1,11 +1,8 @@
 
 # -*- coding: utf-8 -*-
-from functools import cached_property
 import uuid
 import hmac, base64
-import aiohttp
 import time
-import requests
 import re
 
 from .common import CommonTranslator, InvalidServerResponse
@@ -35,18 +32,20 @@ class PapagoTranslator(CommonTranslator):
         data['source'] = from_lang
         data['target'] = to_lang
         data['text'] = '\n'.join(queries)
-        result = await self._do_request(data, self._version_key)
+        result = await self._do_request(data, await self._get_version_key())
         if "translatedText" not in result:
             raise InvalidServerResponse(f'Papago returned invalid response: {result}\nAre the API keys set correctly?')
         result_list = [str.strip() for str in result["translatedText"].split("\n")]
         return result_list
 
-    @cached_property
-    def _version_key(self):
-        script = requests.get('https://papago.naver.com')
-        mainJs = re.search(r'\/(main.*\.js)', script.text).group(1)
-        papagoVerData = requests.get('https://papago.naver.com/' + mainJs)
-        papagoVer = re.search(r'"PPG .*,"(v[^"]*)', papagoVerData.text).group(1)
+    async def _get_version_key(self):
+        return await self.http.cached('papago_version_key', self._fetch_version_key)
+
+    async def _fetch_version_key(self):
+        script = await self.http.get('https://papago.naver.com', response_type='text')
+        mainJs = re.search(r'\/(main.*\.js)', script).group(1)
+        papagoVerData = await self.http.get('https://papago.naver.com/' + mainJs, response_type='text')
+        papagoVer = re.search(r'"PPG .*,"(v[^"]*)', papagoVerData).group(1)
         return papagoVer
 
     async def _do_request(self, data, version_key):
@@ -60,6 +59,4 @@ class PapagoTranslator(CommonTranslator):
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
             "Timestamp": str(timestamp),
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self._API_URL, data=data, headers=headers) as resp:
-                return await resp.json()
+        return await self.http.post(self._API_URL, data=data, headers=headers)
@@ -1,16 +1,9 @@
-from typing import Callable, List
-import py3langid as langid
+from typing import List
 
 from .common import OfflineTranslator, ISO_639_1_TO_VALID_LANGUAGES
 from .m2m100 import M2M100Translator
 from .sugoi import SugoiTranslator
-
-
-get_translator: Callable[[str], OfflineTranslator] = None
-
-def prepare(translator_supplicant: Callable[[str], OfflineTranslator]):
-    global get_translator
-    get_translator = translator_supplicant
+from ..utils import guess_language
 
 class SelectiveOfflineTranslator(OfflineTranslator):
     '''
@@ -30,6 +23,8 @@ class SelectiveOfflineTranslator(OfflineTranslator):
         self._real_translator: OfflineTranslator = None
 
     def select_translator(self, from_lang: str, to_lang: str) -> OfflineTranslator:
+        # Imported here as the translators package imports this module lazily through its registry
+        from . import get_translator
         if from_lang != 'auto':
             sugoi_translator = get_translator('sugoi')
             if sugoi_translator.supports_languages(from_lang, to_lang):
@@ -38,7 +33,7 @@ class SelectiveOfflineTranslator(OfflineTranslator):
 
     async def translate(self, from_lang: str, to_lang: str, queries: List[str], use_mtpe: bool) -> List[str]:
         if from_lang == 'auto':
-            detected_lang = langid.classify(' '.join(queries))[0]
+            detected_lang = guess_language(queries)
             if detected_lang in ISO_639_1_TO_VALID_LANGUAGES:
                 from_lang = ISO_639_1_TO_VALID_LANGUAGES[detected_lang]
 
@@ -3,8 +3,6 @@
 import uuid
 import hashlib
 import time
-import aiohttp
-import time
 
 from .common import CommonTranslator, InvalidServerResponse, MissingAPIKeyException
 from .keys import YOUDAO_APP_KEY, YOUDAO_SECRET_KEY
@@ -76,6 +74,4 @@ class YoudaoTranslator(CommonTranslator):
 
     async def _do_request(self, data):
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self._API_URL, data=data, headers=headers) as resp:
-                return await resp.json()
+        return await self.http.post(self._API_URL, data=data, headers=headers)
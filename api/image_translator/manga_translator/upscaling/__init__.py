@@ -2,15 +2,15 @@ from typing import List
 from PIL import Image
 
 from .common import CommonUpscaler, OfflineUpscaler
-from .waifu2x import Waifu2xUpscaler
-from .esrgan import ESRGANUpscaler
-from .esrgan_pytorch import ESRGANUpscalerPytorch
+from ..utils import LazyRegistry
 
-UPSCALERS = {
-    'waifu2x': Waifu2xUpscaler,
-    'esrgan': ESRGANUpscaler,
-    '4xultrasharp': ESRGANUpscalerPytorch,
-}
+UPSCALERS = LazyRegistry(__name__, {
+    'waifu2x': '.waifu2x:Waifu2xUpscaler',
+    'esrgan': '.esrgan:ESRGANUpscaler',
+    '4xultrasharp': '.esrgan_pytorch:ESRGANUpscalerPytorch',
+    'waifu2x_pytorch': '.waifu2x_pytorch:Waifu2xUpscalerPytorch',
+    'esrgan_pytorch': '.realesrgan_pytorch:RealESRGANUpscalerPytorch',
+})
 upscaler_cache = {}
 
 def get_upscaler(key: str, *args, **kwargs) -> CommonUpscaler:
@@ -19,7 +19,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 
-from .common import OfflineUpscaler
+from .inprocess import InProcessUpscaler
+from ..utils import load_weights, load_state_dict
 
 ####################
 # RRDBNet Generator
@@ -509,7 +510,7 @@ def infer_params(state_dict):
 
 
 # https://github.com/xinntao/Real-ESRGAN
-class ESRGANUpscalerPytorch(OfflineUpscaler):
+class ESRGANUpscalerPytorch(InProcessUpscaler):
     _MODEL_MAPPING = {
         '4x-UltraSharp': {
             'url': 'https://github.com/zyddnys/manga-image-translator/releases/download/beta-0.3/4xESRGAN.pth',
@@ -517,36 +518,25 @@ class ESRGANUpscalerPytorch(OfflineUpscaler):
         },
     }
     _VALID_UPSCALE_RATIOS = [2, 3, 4]
+    _MODEL_SCALE = 4
+    _BYTES_PER_PIXEL = 16000
 
     async def _load(self, device: str):
-        super().__init__()
         os.makedirs(self.model_dir, exist_ok=True)
         if os.path.exists('4xESRGAN.pth'):
             shutil.move('4xESRGAN.pth', self._get_file_path('4xESRGAN.pth'))
-        sd = torch.load(self._get_file_path('4xESRGAN.pth'))
+        await super()._load(device)
+
+    def _build_model(self) -> nn.Module:
+        sd = load_weights(self._get_file_path('4xESRGAN.pth'))
         in_nc, out_nc, nf, nb, plus, mscale = infer_params(sd)
-        self.model = RRDBNet(in_nc=in_nc, out_nc=out_nc, nf=nf, nb=nb, upscale=mscale, plus=plus)
-        self.model.load_state_dict(sd)
-        self.model.eval()
-        self.model = self.model.to(device)
-        self.device = device
-
-    async def _unload(self):
-        pass
-
-    async def _infer(self, image_batch: List[Image.Image], upscale_ratio: float) -> List[Image.Image]:
-        assert upscale_ratio <= 4
-        ratio = upscale_ratio / 4
-        if image_batch :
-            batch = torch.cat([einops.rearrange(torch.from_numpy(np.array(img.convert('RGB'))[:,:,::-1].copy()).float() / 255.0, 'h w c -> 1 c h w') for img in image_batch], dim = 0).to(self.device)
-            with torch.no_grad() :
-                ret = self.model(batch)
-            ret: torch.Tensor
-            ret: List[Image.Image] = [Image.fromarray((einops.rearrange(img.clip(0, 1), 'c h w -> h w c').cpu().numpy()[:,:,::-1].copy() * 255.0).astype(np.uint8)) for img in ret]
-            ret = [img.resize(size = (int(round(img.size[0] * ratio)), int(round(img.size[1] * ratio))), resample = Image.Resampling.BILINEAR) for img in ret]
-            return ret
-        else :
-            return []
+        model = RRDBNet(in_nc=in_nc, out_nc=out_nc, nf=nf, nb=nb, upscale=mscale, plus=plus)
+        load_state_dict(model, sd)
+        return model
+
+    def _forward(self, batch: torch.Tensor) -> torch.Tensor:
+        # The model works on BGR images
+        return self.model(batch.flip(1)).flip(1)
 
 def test() :
     sd = torch.load('../../models/upscaling/esrgan-pytorch/4xESRGAN.pth')
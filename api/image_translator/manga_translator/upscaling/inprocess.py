@@ -0,0 +1,216 @@
+import os
+from abc import abstractmethod
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from .common import OfflineUpscaler
+
+# Memory the upscaling of one batch of tiles and its output may use
+UPSCALE_MEMORY_MB = int(os.getenv('MT_UPSCALE_MEMORY_MB', 2048))
+
+
+def image_to_tensor(image: np.ndarray) -> torch.Tensor:
+    """Converts an RGB uint8 image into a float tensor (3 x H x W) in [0, 1]."""
+    return torch.from_numpy(image).permute(2, 0, 1).float() / 255
+
+
+def tensor_to_image(image: torch.Tensor) -> np.ndarray:
+    return (image.clamp(0, 1) * 255).round().byte().permute(1, 2, 0).cpu().numpy()
+
+
+def plan_tiles(memory_mb: int, bytes_per_pixel: int, max_tile_size: int, min_tile_size: int,
+               row_bytes: int = 0) -> Tuple[int, int]:
+    """
+    Returns the tile size and the number of tiles per forward pass that keep the
+    estimated memory below `memory_mb`. `row_bytes` is memory per row of the
+    tile height that doesn't depend on the tile width, like the output strip.
+    """
+    memory = memory_mb * 2 ** 20
+    # Largest tile with tile ** 2 * bytes_per_pixel + tile * row_bytes <= memory
+    tile_size = (np.sqrt(row_bytes ** 2 + 4 * bytes_per_pixel * memory) - row_bytes) / (2 * bytes_per_pixel)
+    tile_size = max(min(int(tile_size) // 8 * 8, max_tile_size), min_tile_size)
+    return tile_size, max(1, (memory - tile_size * row_bytes) // (tile_size ** 2 * bytes_per_pixel))
+
+
+def tile_starts(length: int, tile_size: int, overlap: int) -> List[int]:
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, tile_size - overlap))
+    return starts + [length - tile_size]
+
+
+def blend_ramp(length: int, margin: int, blend: int, at_start: bool, at_end: bool) -> torch.Tensor:
+    """
+    Weights of a tile along one axis: the `margin` outermost pixels only serve as
+    context of the network and are discarded, the next `blend` pixels fade in
+    linearly. Sides at the border of the image are kept whole.
+    """
+    dist = torch.full((length,), float(length))
+    if not at_start:
+        dist = torch.minimum(dist, torch.arange(length).float())
+    if not at_end:
+        dist = torch.minimum(dist, torch.arange(length).flip(0).float())
+    return ((dist - margin + 0.5) / max(blend, 1)).clamp(0, 1)
+
+
+def tile_windows(length: int, tile: int, starts: List[int], margin: int, blend: int) -> Dict[int, torch.Tensor]:
+    """
+    Weights along one axis of the tiles at `starts`, normalised so that they add
+    up to one at every pixel. The product of the windows of both axes then adds
+    up to one as well and the tiles can be summed without a weight map.
+    """
+    ramps = {s: blend_ramp(tile, margin, blend, s == 0, s + tile == length) for s in starts}
+    total = torch.zeros(length)
+    for s, ramp in ramps.items():
+        total[s:s + tile] += ramp
+    return {s: ramp / total[s:s + tile] for s, ramp in ramps.items()}
+
+
+class TileCanvas:
+    """
+    Output of one page. Tiles arrive row by row and are summed in a float strip
+    as high as one tile, rows that no later tile covers are rounded into the
+    uint8 image.
+    """
+
+    def __init__(self, channels: int, height: int, width: int, tile_height: int, device: torch.device):
+        self.image = np.zeros((height, width, channels), dtype=np.uint8)
+        self.strip = torch.zeros((channels, tile_height, width), device=device)
+        self.top = 0
+
+    def add(self, tile: torch.Tensor, y: int, x: int):
+        if y > self.top:
+            self._flush(y - self.top)
+        _, h, w = tile.shape
+        self.strip[:, y - self.top:y - self.top + h, x:x + w] += tile
+
+    def finish(self) -> np.ndarray:
+        self._flush(self.image.shape[0] - self.top)
+        return self.image
+
+    def _flush(self, rows: int):
+        self.image[self.top:self.top + rows] = tensor_to_image(self.strip[:, :rows])
+        self.strip = self.strip.roll(-rows, 1)
+        self.strip[:, -rows:] = 0
+        self.top += rows
+
+
+@torch.no_grad()
+def upscale_tiled(model: Callable[[torch.Tensor], torch.Tensor], images: List[torch.Tensor], scale: int,
+                  tile_size: int, tile_pad: int, blend: int, tiles_per_batch: int, device: str = None) -> List[np.ndarray]:
+    """
+    Upscales `images` (each C x H x W) with `model` in overlapping tiles of
+    `tile_size`, so that memory doesn't grow with the page size. Each tile has
+    `tile_pad` pixels of context that are cropped and neighbouring tiles are
+    cross-faded over `blend` pixels to hide seams. Tiles of the same size are
+    batched across images, `tiles_per_batch` per forward pass on `device`.
+    Returns the upscaled images as uint8 arrays (H x W x C).
+    """
+    overlap = 2 * tile_pad + blend
+    tiles = defaultdict(list)
+    windows = []
+    remaining = []
+    for i, img in enumerate(images):
+        _, h, w = img.shape
+        th, tw = min(tile_size, h), min(tile_size, w)
+        ys, xs = tile_starts(h, th, overlap), tile_starts(w, tw, overlap)
+        tiles[(th, tw)].extend((i, y, x) for y in ys for x in xs)
+        windows.append((tile_windows(h * scale, th * scale, [y * scale for y in ys], tile_pad * scale, blend * scale),
+                        tile_windows(w * scale, tw * scale, [x * scale for x in xs], tile_pad * scale, blend * scale)))
+        remaining.append(len(ys) * len(xs))
+
+    canvases = {}
+    outputs = [None] * len(images)
+    for (th, tw), positions in tiles.items():
+        for start in range(0, len(positions), tiles_per_batch):
+            chunk = positions[start:start + tiles_per_batch]
+            batch = torch.stack([images[i][:, y:y + th, x:x + tw] for i, y, x in chunk])
+            result = model(batch.to(device) if device else batch)
+            for (i, y, x), tile in zip(chunk, result):
+                c, h, w = images[i].shape
+                if i not in canvases:
+                    canvases[i] = TileCanvas(c, h * scale, w * scale, th * scale, tile.device)
+                y, x = y * scale, x * scale
+                window_y, window_x = windows[i]
+                canvases[i].add(tile * window_y[y][:, None].to(tile.device) * window_x[x][None, :].to(tile.device), y, x)
+                remaining[i] -= 1
+                if not remaining[i]:
+                    outputs[i] = canvases.pop(i).finish()
+    return outputs
+
+
+class InProcessUpscaler(OfflineUpscaler):
+    """
+    Base of the upscalers that run their network with PyTorch instead of an
+    external executable. Images are passed as arrays and upscaled in tiles,
+    which are batched across pages. The tile size follows from the memory
+    ceiling `MT_UPSCALE_MEMORY_MB` and the activation memory of the network.
+    """
+    # Upscale ratio of the network, smaller ratios are reached by downscaling its output
+    _MODEL_SCALE = 4
+    # Estimated activation memory per input pixel of a forward pass
+    _BYTES_PER_PIXEL = 1000
+    _MAX_TILE_SIZE = 512
+    _TILE_PAD = 16
+    _TILE_BLEND = 16
+
+    @abstractmethod
+    def _build_model(self) -> nn.Module:
+        pass
+
+    async def _load(self, device: str):
+        self.model = self._build_model().eval().to(device)
+        self.device = device
+
+    async def _unload(self):
+        del self.model
+
+    def _forward(self, batch: torch.Tensor) -> torch.Tensor:
+        return self.model(batch)
+
+    async def _infer(self, image_batch: List[Image.Image], upscale_ratio: float) -> List[Image.Image]:
+        assert upscale_ratio <= self._MODEL_SCALE
+        ret = []
+        for pages in self._split_pages(image_batch):
+            images = [image_to_tensor(np.array(img.convert('RGB'))) for img in pages]
+            outputs = self._upscale_pages(images)
+            for img, out in zip(pages, outputs):
+                out = Image.fromarray(out)
+                if upscale_ratio != self._MODEL_SCALE:
+                    out = out.resize((int(round(img.size[0] * upscale_ratio)), int(round(img.size[1] * upscale_ratio))),
+                                     resample=Image.Resampling.BILINEAR)
+                ret.append(out)
+        return ret
+
+    def _split_pages(self, image_batch: List[Image.Image]) -> List[List[Image.Image]]:
+        """
+        Groups the pages that are upscaled in one call. The input tensors of a call
+        are kept until it finishes, so a group holds at most `MT_UPSCALE_MEMORY_MB`
+        of them.
+        """
+        groups, memory = [], 0
+        for img in image_batch:
+            size = img.size[0] * img.size[1] * 3 * 4
+            if not groups or memory + size > UPSCALE_MEMORY_MB * 2 ** 20:
+                groups.append([])
+                memory = 0
+            groups[-1].append(img)
+            memory += size
+        return groups
+
+    def _upscale_pages(self, images: List[torch.Tensor]) -> List[np.ndarray]:
+        scale = self._MODEL_SCALE
+        # Float output per input pixel, held by the finished tiles of a batch and
+        # by the strips of the pages a batch begins and ends in
+        output_bytes = 3 * 4 * scale ** 2
+        row_bytes = 2 * output_bytes * max(img.shape[2] for img in images)
+        min_tile_size = 2 * (2 * self._TILE_PAD + self._TILE_BLEND)
+        tile_size, tiles_per_batch = plan_tiles(UPSCALE_MEMORY_MB, self._BYTES_PER_PIXEL + output_bytes,
+                                                self._MAX_TILE_SIZE, min_tile_size, row_bytes)
+        return upscale_tiled(self._forward, images, scale, tile_size, self._TILE_PAD, self._TILE_BLEND,
+                             tiles_per_batch, self.device)
@@ -0,0 +1,26 @@
+import torch.nn as nn
+
+from .esrgan_pytorch import SRVGGNetCompact
+from .inprocess import InProcessUpscaler
+from ..utils import load_weights, load_state_dict
+
+
+class RealESRGANUpscalerPytorch(InProcessUpscaler):
+    """
+    Runs the realesr-animevideov3 model of the `esrgan` upscaler with PyTorch
+    instead of the realesrgan-ncnn-vulkan executable.
+    """
+    _MODEL_MAPPING = {
+        'model': {
+            'url': 'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-animevideov3.pth',
+            'file': 'realesr-animevideov3.pth',
+        },
+    }
+    _VALID_UPSCALE_RATIOS = [2, 3, 4]
+    _MODEL_SCALE = 4
+
+    def _build_model(self) -> nn.Module:
+        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu')
+        sd = load_weights(self._get_file_path('realesr-animevideov3.pth'))
+        load_state_dict(model, sd.get('params', sd))
+        return model
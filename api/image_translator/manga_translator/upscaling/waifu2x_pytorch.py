@@ -0,0 +1,60 @@
+import json
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .inprocess import InProcessUpscaler
+
+
+class UpConv7(nn.Module):
+    """
+    The upconv_7 network of waifu2x. The input is padded by the context the
+    unpadded convolutions consume so that the output is exactly twice its size.
+    """
+    OFFSET = 7
+
+    def __init__(self):
+        super().__init__()
+        channels = [3, 16, 32, 64, 128, 128, 256]
+        self.convs = nn.ModuleList([nn.Conv2d(cin, cout, 3) for cin, cout in zip(channels, channels[1:])])
+        self.upconv = nn.ConvTranspose2d(256, 3, 4, stride=2, padding=3)
+
+    def forward(self, x):
+        x = F.pad(x, (self.OFFSET,) * 4, mode='replicate')
+        for conv in self.convs:
+            x = F.leaky_relu(conv(x), 0.1)
+        return self.upconv(x)
+
+    def load_json(self, path: str):
+        """Loads the weights from the json model files published by waifu2x."""
+        with open(path, 'r', encoding='utf-8') as f:
+            layers = json.load(f)
+        modules = [*self.convs, self.upconv]
+        assert len(layers) == len(modules), f'Expected {len(modules)} layers, got {len(layers)}'
+        with torch.no_grad():
+            for module, layer in zip(modules, layers):
+                module.weight.copy_(torch.tensor(layer['weight']).reshape(module.weight.shape))
+                module.bias.copy_(torch.tensor(layer['bias']))
+
+
+class Waifu2xUpscalerPytorch(InProcessUpscaler):
+    """
+    Runs waifu2x with PyTorch instead of the waifu2x-ncnn-vulkan executable.
+    Uses the upconv_7 art model without denoising, which upscales by 2 and is
+    chained for larger ratios.
+    """
+    _MODEL_MAPPING = {
+        'model': {
+            'url': 'https://raw.githubusercontent.com/nagadomi/waifu2x/master/models/upconv_7/art/noise0_scale2.0x_model.json',
+            'file': 'upconv_7_art_noise0_scale2.0x_model.json',
+        },
+    }
+    _VALID_UPSCALE_RATIOS = [2]
+    _MODEL_SCALE = 2
+    _BYTES_PER_PIXEL = 3000
+
+    def _build_model(self) -> nn.Module:
+        model = UpConv7()
+        model.load_json(self._get_file_path('upconv_7_art_noise0_scale2.0x_model.json'))
+        return model
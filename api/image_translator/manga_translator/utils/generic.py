@@ -12,6 +12,12 @@ import re
 import einops
 import unicodedata
 import json
+import shutil
+import threading
+import urllib.parse
+import urllib.request
+import importlib
+from collections.abc import Mapping
 from shapely import affinity
 from shapely.geometry import Polygon, MultiPoint
 
@@ -63,6 +69,40 @@ class Context(dict):
     def _get_args(self):
         return []
 
+class LazyRegistry(Mapping):
+    """
+    Maps keys to classes which are only imported once they are looked up, so
+    that importing a stage doesn't import the dependencies of every backend.
+    Entries are given as `'module:ClassName'`, relative module paths are
+    resolved against `package`.
+
+    Membership tests and iteration only use the keys and never import anything.
+    """
+
+    def __init__(self, package: str, entries: dict):
+        self._package = package
+        self._entries = dict(entries)
+        self._resolved = {}
+
+    def __getitem__(self, key):
+        if key not in self._resolved:
+            module_path, name = self._entries[key].split(':')
+            module = importlib.import_module(module_path, self._package)
+            self._resolved[key] = getattr(module, name)
+        return self._resolved[key]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self._entries)
+
 # TODO: Add TranslationContext for type linting
 
 def atoi(text: str) -> int | str:
@@ -152,9 +192,11 @@ def chunks(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i+n]
 
+DIGEST_MANIFEST = '.hashes.json'
+
 def get_digest(file_path: str) -> str:
     h = hashlib.sha256()
-    BUF_SIZE = 65536 
+    BUF_SIZE = 1024 * 1024
 
     with open(file_path, 'rb') as file:
         while True:
@@ -165,19 +207,72 @@ def get_digest(file_path: str) -> str:
             h.update(chunk)
     return h.hexdigest()
 
+def get_cached_digest(file_path: str) -> str:
+    """
+    Like `get_digest`, but remembers the hash in a manifest next to the file.
+    The file is only hashed again if its size or modification time changed.
+    """
+    directory, name = os.path.split(os.path.abspath(file_path))
+    manifest_path = os.path.join(directory, DIGEST_MANIFEST)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    st = os.stat(file_path)
+    entry = manifest.get(name)
+    if entry and entry.get('size') == st.st_size and entry.get('mtime') == st.st_mtime_ns:
+        return entry['sha256']
+
+    digest = get_digest(file_path)
+    record_digest(file_path, digest)
+    return digest
+
+_digest_manifest_lock = threading.Lock()
+
+def record_digest(file_path: str, digest: str):
+    """Stores the hash of a file in the manifest used by `get_cached_digest`."""
+    directory, name = os.path.split(os.path.abspath(file_path))
+    manifest_path = os.path.join(directory, DIGEST_MANIFEST)
+    with _digest_manifest_lock:
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        st = os.stat(file_path)
+        manifest[name] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha256': digest.lower()}
+        try:
+            # Written to a temporary file first so other processes never read a partial manifest
+            tmp_path = f'{manifest_path}.{os.getpid()}'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_path, manifest_path)
+        except OSError:
+            pass
+
 def get_filename_from_url(url: str, default: str = '') -> str:
     m = re.search(r'/([^/?]+)[^/]*$', url)
     if m:
         return m.group(1)
     return default
 
-def download_url_with_progressbar(url: str, path: str):
+def download_url_with_progressbar(url: str, path: str, chunk_size: int = 1024 * 1024):
     if os.path.basename(path) in ('.', '') or os.path.isdir(path):
         new_filename = get_filename_from_url(url)
         if not new_filename:
             raise Exception('Could not determine filename')
         path = os.path.join(path, new_filename)
 
+    if url.startswith('file://'):
+        # Local mirrors are copied instead
+        src = urllib.request.url2pathname(urllib.parse.urlparse(url).path)
+        if not os.path.isfile(src):
+            raise Exception(f'Couldn\'t resolve url: "{url}" (File not found)')
+        shutil.copyfile(src, path)
+        return
+
     headers = {}
     downloaded_size = 0
     if os.path.isfile(path):
@@ -186,12 +281,16 @@ def download_url_with_progressbar(url: str, path: str):
         headers['Accept-Encoding'] = 'deflate'
 
     r = requests.get(url, stream=True, allow_redirects=True, headers=headers)
-    if downloaded_size and r.headers.get('Accept-Ranges') != 'bytes':
+    if downloaded_size and r.status_code == 416:
+        # The partial file is at least as large as the whole one, so its content can't be trusted
+        print('Error: Partial download is larger than the file. Restarting from the beginning.')
+        r = requests.get(url, stream=True, allow_redirects=True)
+        downloaded_size = 0
+    elif downloaded_size and r.status_code != 206:
         print('Error: Webserver does not support partial downloads. Restarting from the beginning.')
         r = requests.get(url, stream=True, allow_redirects=True)
         downloaded_size = 0
     total = int(r.headers.get('content-length', 0))
-    chunk_size = 1024
 
     if r.ok:
         with tqdm.tqdm(
@@ -200,7 +299,7 @@ def download_url_with_progressbar(url: str, path: str):
             total=total+downloaded_size,
             unit='iB',
             unit_scale=True,
-            unit_divisor=chunk_size,
+            unit_divisor=1024,
         ) as bar:
             with open(path, 'ab' if downloaded_size else 'wb') as f:
                 is_tty = sys.stdout.isatty()
@@ -211,7 +310,7 @@ def download_url_with_progressbar(url: str, path: str):
 
                     # Fallback for non TTYs so output still shown
                     downloaded_chunks += 1
-                    if not is_tty and downloaded_chunks % 1000 == 0:
+                    if not is_tty and downloaded_chunks % 100 == 0:
                         print(bar)
     else:
         raise Exception(f'Couldn\'t resolve url: "{url}" (Error: {r.status_code})')
@@ -664,6 +763,18 @@ def rect_distance(x1, y1, x1b, y1b, x2, y2, x2b, y2b):
     else:             # rectangles intersect
         return 0
 
+def get_panel_indices(points: np.ndarray, panels: List[Tuple[int, int, int, int]]) -> np.ndarray:
+    """
+    Returns the index of the panel (x, y, w, h) containing each of the points,
+    -1 for points outside of all panels. Overlapping panels go to the first one.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    indices = np.full(len(points), -1, dtype=np.int64)
+    for i, (x, y, w, h) in reversed(list(enumerate(panels))):
+        inside = (points[:, 0] >= x) & (points[:, 0] < x + w) & (points[:, 1] >= y) & (points[:, 1] < y + h)
+        indices[inside] = i
+    return indices
+
 def distance_point_point(a: np.ndarray, b: np.ndarray) -> float:
     return np.linalg.norm(a - b)
 
@@ -1,13 +1,21 @@
 import os
+import gc
+import json
+import asyncio
 import stat
 import sys
 import tempfile
+import urllib.request
 import re
+import time
 import torch
 import shutil
 import filecmp
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from functools import cached_property
+from typing import List
 
 from .generic import (
     BASE_PATH,
@@ -15,7 +23,8 @@ from .generic import (
     download_url_with_progressbar,
     prompt_yes_no,
     replace_prefix,
-    get_digest,
+    get_cached_digest,
+    record_digest,
     get_filename_from_url,
 )
 from .log import get_logger
@@ -59,6 +68,205 @@ class InvalidModelMappingException(ValueError):
         error = f'[{cls}->{map_key}] Invalid _MODEL_MAPPING - {error_msg}'
         super().__init__(error)
 
+def get_process_memory() -> int:
+    """Returns the resident memory of this process in bytes or 0 if it can't be determined."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def get_model_size(model: 'ModelWrapper') -> int:
+    """Sums up the parameters and buffers of all torch modules held by the model wrapper."""
+    size = 0
+    seen = set()
+    for value in vars(model).values():
+        if isinstance(value, torch.nn.Module):
+            for tensor in (*value.parameters(), *value.buffers()):
+                if id(tensor) not in seen:
+                    seen.add(id(tensor))
+                    size += tensor.nelement() * tensor.element_size()
+    return size
+
+
+class ModelResidency:
+    """
+    Keeps track of all loaded `ModelWrapper` instances of the process and
+    unloads the least recently used ones once their total size exceeds
+    `budget` (in bytes, 0 disables the limit). Models that are pinned, e.g.
+    while running inference, are never unloaded.
+    """
+
+    def __init__(self, budget: int = 0):
+        self.logger = get_logger(self.__class__.__name__)
+        self.budget = budget
+        # model -> size in bytes, least recently used first
+        self._models: OrderedDict['ModelWrapper', int] = OrderedDict()
+        self._last_used = {}
+        self._pins = {}
+
+    @property
+    def used(self) -> int:
+        return sum(self._models.values())
+
+    async def add(self, model: 'ModelWrapper', size: int):
+        self._models[model] = size
+        self.touch(model)
+        # The model that was just loaded is about to be used
+        async with self.pin(model):
+            await self.enforce()
+
+    def remove(self, model: 'ModelWrapper'):
+        self._models.pop(model, None)
+        self._last_used.pop(model, None)
+
+    def touch(self, model: 'ModelWrapper'):
+        if model in self._models:
+            self._models.move_to_end(model)
+            self._last_used[model] = time.time()
+
+    def is_pinned(self, model: 'ModelWrapper') -> bool:
+        return self._pins.get(model, 0) > 0
+
+    @asynccontextmanager
+    async def pin(self, model: 'ModelWrapper'):
+        self._pins[model] = self._pins.get(model, 0) + 1
+        try:
+            yield
+        finally:
+            self._pins[model] -= 1
+            if not self._pins[model]:
+                del self._pins[model]
+
+    async def enforce(self):
+        if not self.budget:
+            return
+        for model in list(self._models):
+            if self.used <= self.budget:
+                break
+            if self.is_pinned(model):
+                continue
+            self.logger.info(f'Unloading {model._key} ({self._models[model] / 1024**2:.0f}MB) to stay within the model memory budget')
+            await model.unload()
+        if self.used > self.budget:
+            self.logger.warning(f'Loaded models use {self.used / 1024**2:.0f}MB which exceeds the budget of {self.budget / 1024**2:.0f}MB')
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def report(self) -> List[dict]:
+        """Lists the loaded models, least recently used first."""
+        return [{
+            'key': model._key,
+            'device': model._device,
+            'size': size,
+            'pinned': self.is_pinned(model),
+            'last_used': self._last_used.get(model),
+        } for model, size in self._models.items()]
+
+model_residency = ModelResidency()
+
+
+WEIGHTS_CACHE_DIR = '.weights_cache'
+
+def _flatten_weights(value, tensors: dict):
+    # Replaces tensors by references into `tensors`, everything else has to be json serializable
+    if isinstance(value, torch.Tensor):
+        key = f't{len(tensors)}'
+        # safetensors refuses tensors that share memory
+        tensors[key] = value.detach().cpu().contiguous().clone()
+        return {'__tensor__': key}
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value):
+            raise TypeError('Only string keys are supported')
+        return {'__dict__': {k: _flatten_weights(v, tensors) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'__list__': [_flatten_weights(v, tensors) for v in value]}
+    json.dumps(value)
+    return {'__value__': value}
+
+def _unflatten_weights(structure, tensors: dict):
+    if '__tensor__' in structure:
+        return tensors[structure['__tensor__']]
+    if '__dict__' in structure:
+        # OrderedDict like torch.load returns for state dicts
+        return OrderedDict((k, _unflatten_weights(v, tensors)) for k, v in structure['__dict__'].items())
+    if '__list__' in structure:
+        return [_unflatten_weights(v, tensors) for v in structure['__list__']]
+    return structure['__value__']
+
+def get_weights_cache_path(path: str) -> str:
+    return os.path.join(ModelWrapper._MODEL_DIR, WEIGHTS_CACHE_DIR, get_cached_digest(path)[:32] + '.safetensors')
+
+def load_weights(path: str) -> dict:
+    """
+    Replacement for `torch.load(path, map_location='cpu')` of model checkpoints.
+    The checkpoint is converted once into a safetensors file in the weights cache
+    (keyed by the checkpoint's hash) which later loads memory-map copy-on-write,
+    so no unpickling is needed. The tensors are only shared with other processes
+    through the page cache while a model runs on the cpu with them loaded by
+    `load_state_dict` below, `module.load_state_dict(sd)` copies them into the
+    module's own parameters and moving a model to the gpu copies them too.
+    Checkpoints that can't be converted, e.g. because they contain arbitrary python
+    objects, are remembered and keep being loaded with `torch.load`, as are all
+    checkpoints with `MT_WEIGHTS_CACHE=0`.
+    """
+    if os.environ.get('MT_WEIGHTS_CACHE', '1') == '0':
+        return torch.load(path, map_location='cpu')
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+
+    cache_path = get_weights_cache_path(path)
+    failed_path = cache_path + '.failed'
+    if os.path.isfile(cache_path):
+        try:
+            tensors = {}
+            with safe_open(cache_path, framework='pt', device='cpu') as f:
+                structure = json.loads(f.metadata()['structure'])
+                for key in f.keys():
+                    tensors[key] = f.get_tensor(key)
+            return _unflatten_weights(structure, tensors)
+        except Exception as e:
+            get_logger('load_weights').warning(f'Ignoring broken weights cache "{cache_path}": {e}')
+
+    sd = torch.load(path, map_location='cpu')
+    if os.path.isfile(failed_path):
+        return sd
+    tmp_path = f'{cache_path}.{os.getpid()}.part'
+    try:
+        tensors = {}
+        structure = _flatten_weights(sd, tensors)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        save_file(tensors, tmp_path, metadata={'structure': json.dumps(structure)})
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        get_logger('load_weights').warning(f'Could not convert "{path}" for the weights cache: {e}')
+        try:
+            os.makedirs(os.path.dirname(failed_path), exist_ok=True)
+            open(failed_path, 'w').close()
+        except OSError:
+            pass
+    return sd
+
+def load_state_dict(module: torch.nn.Module, state_dict: dict, strict: bool = True):
+    """
+    `module.load_state_dict(state_dict, strict)` that makes the module use the
+    tensors of `state_dict` instead of copying them, so that the memory-mapped
+    weights of `load_weights` aren't duplicated. Falls back to copying when a
+    tensor's dtype differs from the module's, which copying converts.
+    """
+    own = module.state_dict()
+    assign = all(k not in own or own[k].dtype == v.dtype for k, v in state_dict.items() if isinstance(v, torch.Tensor))
+    return module.load_state_dict(state_dict, strict=strict, assign=assign)
+
+
 class ModelWrapper(ABC):
     r"""
     A class that provides a unified interface for downloading models and making forward passes.
@@ -90,8 +298,13 @@ class ModelWrapper(ABC):
                               the downloaded archive and their destinations, Mutually exclusive with `file`
 
         executables         - List of files that need to have the executable flag set
+
+    Files are looked up in `_MODEL_MIRROR` (a local directory, e.g. an extracted offline
+    bundle) by their filename before being downloaded from their url.
     """
     _MODEL_DIR = os.path.join(BASE_PATH, 'models')
+    _MODEL_MIRROR = os.environ.get('MT_MODEL_MIRROR') or None
+    _MAX_CONCURRENT_DOWNLOADS = 4
     _MODEL_SUB_DIR = ''
     _MODEL_MAPPING = {}
     _KEY = ''
@@ -100,6 +313,8 @@ class ModelWrapper(ABC):
         os.makedirs(self.model_dir, exist_ok=True)
         self._key = self._KEY or self.__class__.__name__
         self._loaded = False
+        self._device = None
+        self._load_args = None
         self._check_for_malformed_model_mapping()
         self._downloaded = self._check_downloaded()
 
@@ -135,13 +350,30 @@ class ModelWrapper(ABC):
             elif 'file' in mapping and 'archive' in mapping:
                 raise InvalidModelMappingException(self._key, map_key, 'Properties file and archive are mutually exclusive')
 
+    def _find_in_mirror(self, url: str):
+        if not self._MODEL_MIRROR:
+            return None
+        filename = get_filename_from_url(url)
+        for p in (os.path.join(self._MODEL_MIRROR, self._MODEL_SUB_DIR, filename), os.path.join(self._MODEL_MIRROR, filename)):
+            if filename and os.path.isfile(p):
+                return p
+        return None
+
     async def _download_file(self, url: str, path: str):
-        print(f' -- Downloading: "{url}"')
-        download_url_with_progressbar(url, path)
+        mirror_path = self._find_in_mirror(url)
+        if mirror_path:
+            print(f' -- Copying from mirror: "{mirror_path}"')
+            if os.path.isfile(path):
+                # Partial download of the original url
+                os.remove(path)
+            url = 'file://' + urllib.request.pathname2url(os.path.abspath(mirror_path))
+        else:
+            print(f' -- Downloading: "{url}"')
+        await asyncio.to_thread(download_url_with_progressbar, url, path)
 
     async def _verify_file(self, sha256_pre_calculated: str, path: str):
         print(f' -- Verifying: "{path}"')
-        sha256_calculated = get_digest(path).lower()
+        sha256_calculated = (await asyncio.to_thread(get_cached_digest, path)).lower()
         sha256_pre_calculated = sha256_pre_calculated.lower()
 
         if sha256_calculated != sha256_pre_calculated:
@@ -180,87 +412,130 @@ class ModelWrapper(ABC):
         with `_check_downloaded`) to implement unconventional download logic.
         '''
         print(f'\nDownloading models into {self.model_dir}\n')
+        pending = []
         for map_key, mapping in self._MODEL_MAPPING.items():
             if self._check_downloaded_map(map_key):
                 print(f' -- Skipping {map_key} as it\'s already downloaded')
                 continue
-
-            is_archive = 'archive' in mapping
-            if is_archive:
-                download_path = os.path.join(self._temp_working_directory, map_key, '')
-            else:
-                download_path = self._get_file_path(mapping['file'])
-            if not os.path.basename(download_path):
-                os.makedirs(download_path, exist_ok=True)
-            if os.path.basename(download_path) in ('', '.'):
-                download_path = os.path.join(download_path, get_filename_from_url(mapping['url'], map_key))
-            if not is_archive:
-                download_path += '.part'
-
-            if 'hash' in mapping:
-                downloaded = False
-                if os.path.isfile(download_path):
+            pending.append((map_key, mapping))
+
+        semaphore = asyncio.Semaphore(self._MAX_CONCURRENT_DOWNLOADS)
+        async def download_map(map_key, mapping):
+            async with semaphore:
+                await self._download_map(map_key, mapping)
+        await asyncio.gather(*(download_map(map_key, mapping) for map_key, mapping in pending))
+
+    async def _download_map(self, map_key: str, mapping: dict):
+        is_archive = 'archive' in mapping
+        if is_archive:
+            download_path = os.path.join(self._temp_working_directory, map_key, '')
+        else:
+            download_path = self._get_file_path(mapping['file'])
+        if not os.path.basename(download_path):
+            os.makedirs(download_path, exist_ok=True)
+        if os.path.basename(download_path) in ('', '.'):
+            download_path = os.path.join(download_path, get_filename_from_url(mapping['url'], map_key))
+        if not is_archive:
+            download_path += '.part'
+
+        if 'hash' in mapping:
+            downloaded = False
+            if os.path.isfile(download_path):
+                try:
+                    print(' -- Found existing file')
+                    await self._verify_file(mapping['hash'], download_path)
+                    downloaded = True
+                except ModelVerificationException:
+                    print(' -- Resuming interrupted download')
+            if not downloaded:
+                # A resumed download that fails to verify is retried from the start once, the
+                # interrupted part may be corrupt or of another version of the file
+                for resumed in (os.path.isfile(download_path), False):
+                    await self._download_file(mapping['url'], download_path)
                     try:
-                        print(' -- Found existing file')
                         await self._verify_file(mapping['hash'], download_path)
-                        downloaded = True
+                        break
                     except ModelVerificationException:
-                        print(' -- Resuming interrupted download')
-                if not downloaded:
-                    await self._download_file(mapping['url'], download_path)
-                    await self._verify_file(mapping['hash'], download_path)
-            else:
-                await self._download_file(mapping['url'], download_path)
-
-            if download_path.endswith('.part'):
-                p = download_path[:len(download_path)-5]
-                shutil.move(download_path, p)
-                download_path = p
-
-            if is_archive:
-                extracted_path = os.path.join(os.path.dirname(download_path), 'extracted')
-                print(f' -- Extracting files')
-                shutil.unpack_archive(download_path, extracted_path)
-
-                def get_real_archive_files():
-                    archive_files = []
-                    for root, dirs, files in os.walk(extracted_path):
-                        for name in files:
-                            file_path = replace_prefix(os.path.join(root, name), extracted_path, '')
-                            archive_files.append(file_path)
-                    return archive_files
-
-                # Move every specified file from archive to destination
-                for orig, dest in mapping['archive'].items():
-                    p1 = os.path.join(extracted_path, orig)
-                    if os.path.exists(p1):
-                        p2 = self._get_file_path(dest)
-                        if os.path.basename(p2) in ('', '.'):
-                            p2 = os.path.join(p2, os.path.basename(p1))
-                        if os.path.isfile(p2):
-                            if filecmp.cmp(p1, p2):
-                                continue
-                            raise InvalidModelMappingException(self._key, map_key, 'File "{orig}" already exists at "{dest}"')
-                        os.makedirs(os.path.dirname(p2), exist_ok=True)
-                        shutil.move(p1, p2)
-                    else:
-                        raise InvalidModelMappingException(self._key, map_key, f'File "{orig}" does not exist within archive' +
+                        os.remove(download_path)
+                        if not resumed:
+                            raise
+                        print(' -- Restarting download from the beginning')
+        else:
+            await self._download_file(mapping['url'], download_path)
+
+        if download_path.endswith('.part'):
+            p = download_path[:len(download_path)-5]
+            shutil.move(download_path, p)
+            download_path = p
+            if 'hash' in mapping:
+                record_digest(download_path, mapping['hash'])
+
+        if is_archive:
+            extracted_path = os.path.join(os.path.dirname(download_path), 'extracted')
+            print(f' -- Extracting files')
+            shutil.unpack_archive(download_path, extracted_path)
+
+            def get_real_archive_files():
+                archive_files = []
+                for root, dirs, files in os.walk(extracted_path):
+                    for name in files:
+                        file_path = replace_prefix(os.path.join(root, name), extracted_path, '')
+                        archive_files.append(file_path)
+                return archive_files
+
+            # Move every specified file from archive to destination
+            for orig, dest in mapping['archive'].items():
+                p1 = os.path.join(extracted_path, orig)
+                if os.path.exists(p1):
+                    p2 = self._get_file_path(dest)
+                    if os.path.basename(p2) in ('', '.'):
+                        p2 = os.path.join(p2, os.path.basename(p1))
+                    if os.path.isfile(p2):
+                        if filecmp.cmp(p1, p2):
+                            continue
+                        raise InvalidModelMappingException(self._key, map_key, 'File "{orig}" already exists at "{dest}"')
+                    os.makedirs(os.path.dirname(p2), exist_ok=True)
+                    shutil.move(p1, p2)
+                else:
+                    raise InvalidModelMappingException(self._key, map_key, f'File "{orig}" does not exist within archive' +
+                                '\nAvailable files:\n%s' % '\n'.join(get_real_archive_files()))
+            if len(mapping['archive']) == 0:
+                raise InvalidModelMappingException(self._key, map_key, 'No archive files specified' +
                                     '\nAvailable files:\n%s' % '\n'.join(get_real_archive_files()))
-                if len(mapping['archive']) == 0:
-                    raise InvalidModelMappingException(self._key, map_key, 'No archive files specified' +
-                                        '\nAvailable files:\n%s' % '\n'.join(get_real_archive_files()))
 
-                self._grant_execute_permissions(map_key)
+            self._grant_execute_permissions(map_key)
 
-                # Remove temporary files
-                try:
-                    os.remove(download_path)
-                    shutil.rmtree(extracted_path)
-                except Exception:
-                    pass
+            # Remove temporary files
+            try:
+                os.remove(download_path)
+                shutil.rmtree(extracted_path)
+            except Exception:
+                pass
 
-            print()
-            self._on_download_finished(map_key)
+        print()
+        self._on_download_finished(map_key)
+
+    async def verify(self) -> bool:
+        '''
+        Checks downloaded files against the hashes in `_MODEL_MAPPING`. Files that
+        didn't change since they were last hashed are looked up in the digest manifest.
+        '''
+        ok = True
+        for map_key, mapping in self._MODEL_MAPPING.items():
+            if 'file' not in mapping or 'hash' not in mapping:
+                continue
+            path = mapping['file']
+            if os.path.basename(path) in ('.', ''):
+                path = os.path.join(path, get_filename_from_url(mapping['url'], map_key))
+            path = self._get_file_path(path)
+            if not os.path.isfile(path):
+                ok = False
+                continue
+            try:
+                await self._verify_file(mapping['hash'], path)
+            except ModelVerificationException:
+                ok = False
+        return ok
 
     def _on_download_finished(self, map_key):
         '''
@@ -331,23 +606,42 @@ class ModelWrapper(ABC):
         '''
         if not self.is_downloaded():
             await self.download()
+        if self.is_loaded() and device != self._device:
+            # Models stay on the device they were loaded to, so move them by reloading
+            await self.unload()
         if not self.is_loaded():
+            memory_before = get_process_memory()
             await self._load(*args, **kwargs, device=device)
             self._loaded = True
+            self._device = device
+            self._load_args = (device, args, kwargs)
+            # Models that aren't torch modules (e.g. ctranslate2) are measured by the memory they added to the process
+            size = get_model_size(self) or max(get_process_memory() - memory_before, 0)
+            await model_residency.add(self, size)
+        else:
+            model_residency.touch(self)
 
     async def unload(self):
         if self.is_loaded():
             await self._unload()
             self._loaded = False
+            self._device = None
+            model_residency.remove(self)
 
     async def infer(self, *args, **kwargs):
         '''
         Makes a forward pass through the network.
         '''
-        if not self.is_loaded():
-            raise Exception(f'{self._key}: Tried to forward pass without having loaded the model.')
-        
-        return await self._infer(*args, **kwargs)
+        async with model_residency.pin(self):
+            if not self.is_loaded():
+                if self._load_args is None:
+                    raise Exception(f'{self._key}: Tried to forward pass without having loaded the model.')
+                # Was unloaded to free memory for other models
+                load_device, load_args, load_kwargs = self._load_args
+                # Subclasses may reorder the arguments of load, so the base implementation is called directly
+                await ModelWrapper.load(self, load_device, *load_args, **load_kwargs)
+            model_residency.touch(self)
+            return await self._infer(*args, **kwargs)
 
     @abstractmethod
     async def _load(self, device: str, *args, **kwargs):
@@ -0,0 +1,59 @@
+"""
+Language identification of the OCR'd text, shared by the skip-lang filter, the
+translator selection and the translators that detect their source language.
+Only the skip-lang filter applies the confidence threshold, the others go with
+the best guess since short lines are rarely classified confidently.
+Results are cached by text since a page's lines and their joined text are
+classified by several of these in a row.
+"""
+
+import os
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
+
+# Detections less confident than this count as unknown
+LANGID_MIN_CONFIDENCE = float(os.getenv('MT_LANGID_MIN_CONFIDENCE', 0.5))
+
+_identifier = None
+
+
+def _get_identifier():
+    global _identifier
+    if _identifier is None:
+        from py3langid.langid import LanguageIdentifier, MODEL_FILE
+        # A separate instance with normalized probabilities, unaffected by py3langid.set_languages
+        _identifier = LanguageIdentifier.from_pickled_model(MODEL_FILE, norm_probs=True)
+    return _identifier
+
+
+@lru_cache(maxsize=8192)
+def classify_language(text: str) -> Tuple[str, float]:
+    """Returns the ISO 639-1 code of the language of `text` and the confidence in [0, 1]."""
+    lang, confidence = _get_identifier().classify(text)
+    return lang, float(confidence)
+
+
+def detect_language(text: str, min_confidence: float = None) -> Optional[str]:
+    """Returns the language of `text` or None if it can't be told with `min_confidence`."""
+    if not text or not text.strip():
+        return None
+    lang, confidence = classify_language(text)
+    if confidence < (LANGID_MIN_CONFIDENCE if min_confidence is None else min_confidence):
+        return None
+    return lang
+
+
+def detect_languages(texts: List[str], min_confidence: float = None) -> List[Optional[str]]:
+    """Batched `detect_language`, repeated texts are only classified once."""
+    langs = {text: detect_language(text, min_confidence) for text in dict.fromkeys(texts)}
+    return [langs[text] for text in texts]
+
+
+def guess_language(texts: Union[str, List[str]]) -> str:
+    """
+    Returns the most likely language of `texts`, classified together, however
+    unsure. Meant for picking a source language, where a guess beats none.
+    """
+    if not isinstance(texts, str):
+        texts = '\n'.join(texts)
+    return classify_language(texts)[0]
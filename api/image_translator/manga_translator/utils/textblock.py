@@ -5,9 +5,9 @@ from shapely.geometry import Polygon, MultiPoint
 from functools import cached_property
 import copy
 import re
-import py3langid as langid
 
-from .generic import color_difference, is_right_to_left_char, is_valuable_char
+from .language import classify_language
+from .generic import color_difference, is_right_to_left_char, is_valuable_char, get_panel_indices
 # from ..detection.ctd_utils.utils.imgproc_utils import union_area, xywh2xyxypoly
 
 # LANG_LIST = ['eng', 'ja', 'unknown']
@@ -285,7 +285,7 @@ class TextBlock(object):
     @property
     def source_lang(self):
         if not self._source_lang:
-            self._source_lang = langid.classify(self.text)[0]
+            self._source_lang = classify_language(self.text)[0]
         return self._source_lang
 
     def get_translation_for_rendering(self):
@@ -456,7 +456,15 @@ def rotate_polygons(center, polygons, rotation, new_center=None, to_int=True):
     return rotated
 
 
-def sort_regions(regions: List[TextBlock], right_to_left=True) -> List[TextBlock]:
+def sort_regions(regions: List[TextBlock], right_to_left=True, panels: List[Tuple[int, int, int, int]] = None) -> List[TextBlock]:
+    if panels and regions:
+        # Follow the panel order and sort the regions of each panel, regions outside of all panels go last
+        indices = get_panel_indices([region.center for region in regions], panels)
+        sorted_regions = []
+        for panel_idx in [*range(len(panels)), -1]:
+            sorted_regions.extend(sort_regions([r for r, i in zip(regions, indices) if i == panel_idx], right_to_left))
+        return sorted_regions
+
     # Sort regions from right to left, top to bottom
     sorted_regions = []
     for region in sorted(regions, key=lambda region: region.center[1]):
@@ -0,0 +1,32 @@
+import asyncio
+
+import numpy as np
+from PIL import Image
+
+from image_translator.manga_translator import image_translator
+from image_translator.manga_translator.manga_translator import MangaTranslator
+
+
+def test_failing_page_does_not_abort_deduplicated_batch(tmp_path, monkeypatch):
+    pages = tmp_path / 'pages'
+    pages.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(3):
+        Image.fromarray(rng.integers(0, 255, (64, 48, 3), dtype=np.uint8)).save(pages / f'{i}.png')
+    translated = []
+
+    async def translate_file(self, path, dest, ctx):
+        if path.endswith('1.png'):
+            raise RuntimeError('OCR failed')
+        Image.open(path).save(dest)
+        translated.append(path)
+        return True
+
+    monkeypatch.setattr(MangaTranslator, '_translate_file', translate_file)
+    parser, _ = image_translator.parse_args()
+    args = parser.parse_args(['--input-images', str(pages), '--dest', str(tmp_path / 'out'), '--dedup',
+                              '--translator', 'none', '--target-lang', 'ENG'])
+    asyncio.run(image_translator.dispatch(args))
+
+    assert sorted(p.rsplit('/', 1)[-1] for p in translated) == ['0.png', '2.png']
+    assert sorted(p.name for p in (tmp_path / 'out').iterdir()) == ['0.png', '2.png']
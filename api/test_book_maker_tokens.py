@@ -0,0 +1,44 @@
+import pytest
+
+tiktoken = pytest.importorskip('tiktoken')
+
+from book_maker import utils
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    utils.get_encoding.cache_clear()
+    utils._token_counts.clear()
+    yield
+    utils.get_encoding.cache_clear()
+    utils._token_counts.clear()
+
+
+class CountingEncoding:
+    """Encoding with one token per word that counts the texts it encodes."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode_ordinary_batch(self, texts):
+        self.encoded += texts
+        return [text.split() for text in texts]
+
+
+def test_count_many_encodes_each_text_once(monkeypatch):
+    encoding = CountingEncoding()
+    monkeypatch.setattr(tiktoken, 'encoding_for_model', lambda model: encoding)
+    assert utils.count_many(['a b c', 'd', 'a b c']) == [10, 8, 10]
+    assert utils.num_tokens_from_text('d') == 8
+    assert sorted(encoding.encoded) == ['a b c', 'd', 'user']
+
+
+def test_offline_falls_back_to_estimate(monkeypatch):
+    def unavailable(model):
+        raise ConnectionError('offline')
+    monkeypatch.setattr(tiktoken, 'encoding_for_model', unavailable)
+    assert utils.estimate_tokens('abcdefgh') == 2
+    assert utils.estimate_tokens('こんにちは abc') == 5 + 1
+    assert utils.count_many(['abcdefgh', 'こんにちは abc']) == [2 + 7, 6 + 7]
+    with pytest.raises(NotImplementedError):
+        utils.count_many(['a'], model='gpt-4')
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from image_translator.manga_translator.colorization.manga_colorization_v2 import MangaColorizationV2, get_colorization_sizes
+from image_translator.manga_translator.colorization.manga_colorization_v2_utils.utils.utils import resize_pad
+
+
+class ConvColorizer(nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv = nn.Conv2d(5, 3, 3, padding=1)
+
+    def forward(self, x):
+        return torch.tanh(self.conv(x)), None
+
+
+class SmallColorizer(MangaColorizationV2):
+    """Colorizer with a small randomly initialized network that records its batch sizes."""
+    _MODEL_MAPPING = {}
+
+    async def _load(self, device):
+        self.device = device
+        self.colorizer = ConvColorizer().eval()
+        self.denoiser = None
+        self._buffer = torch.empty(0)
+        self.batch_sizes = []
+        self._buffer_lock = threading.Lock()
+
+    def _forward(self, grays):
+        self.batch_sizes.append(len(grays))
+        return super()._forward(grays)
+
+
+def test_colorization_sizes():
+    for width, height in ((800, 1200), (1000, 1000), (1400, 1000), (597, 843)):
+        output_size, inference_size = get_colorization_sizes(width, height, 576)
+        assert all(s % 32 == 0 for s in inference_size)
+        assert all(abs(i - o) <= 16 for i, o in zip(inference_size, output_size))
+        # Same output size as the previous padded sizing
+        img, pad = resize_pad(np.zeros((height, width, 3), dtype=np.uint8), min(width, height, 576) // 32 * 32)
+        assert output_size == (img.shape[1] - pad[1], img.shape[0] - pad[0])
+
+
+def test_batched_matches_single_pages():
+    colorizer = SmallColorizer()
+    asyncio.run(colorizer.load('cpu'))
+    rng = np.random.default_rng(0)
+    pages = [Image.fromarray(rng.integers(0, 255, size, dtype=np.uint8)) for size in ((300, 200), (600, 400), (200, 300))]
+    kwargs = dict(colorization_size=128, denoise_sigma=-1)
+    batched = asyncio.run(colorizer.colorize_batch(pages, colorization_batch_size=4, **kwargs))
+    # The two portrait pages share an inference size
+    assert sorted(colorizer.batch_sizes) == [1, 2]
+    for page, result in zip(pages, batched):
+        single = asyncio.run(colorizer.colorize(page, **kwargs))
+        assert single.size == result.size
+        assert np.abs(np.array(single).astype(int) - np.array(result).astype(int)).max() <= 1
+
+
+def test_buffer_is_reused_across_sizes():
+    colorizer = SmallColorizer()
+    asyncio.run(colorizer.load('cpu'))
+    rng = np.random.default_rng(0)
+    kwargs = dict(colorization_size=128, denoise_sigma=-1)
+    large = [Image.fromarray(rng.integers(0, 255, (300, 200), dtype=np.uint8)) for _ in range(2)]
+    small = Image.fromarray(rng.integers(0, 255, (64, 96), dtype=np.uint8))
+    expected = asyncio.run(colorizer.colorize(small, **kwargs))
+    asyncio.run(colorizer.colorize_batch(large, colorization_batch_size=2, **kwargs))
+    buffer = colorizer._buffer
+    # A smaller page afterwards views the same memory, whose hint channels hold the larger batch
+    assert np.array_equal(np.array(asyncio.run(colorizer.colorize(small, **kwargs))), np.array(expected))
+    assert colorizer._buffer is buffer
+    (w, h), = {get_colorization_sizes(*page.size, 128)[1] for page in large}
+    assert buffer.numel() == 2 * 5 * h * w
@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+import pytest
+
+from image_translator.manga_translator.detection.default_utils.dbnet_utils import SegDetectorRepresenter
+
+
+def make_prob_map(seed: int, size=(640, 480)):
+    """Probability map with textline-like blobs, some with holes, touching or nested."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    pred = np.zeros((h, w), dtype=np.float32)
+    for _ in range(rng.integers(50, 150)):
+        x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+        angle = float(rng.uniform(0, 180))
+        axes = (int(rng.integers(2, 60)), int(rng.integers(1, 12)))
+        cv2.ellipse(pred, (x, y), axes, angle, 0, 360, float(rng.uniform(0.5, 1)), -1)
+        if rng.random() < 0.2:
+            cv2.ellipse(pred, (x, y), (axes[0] // 2, axes[1] // 2), angle, 0, 360, 0, -1)
+    pred += rng.normal(0, 0.05, pred.shape).astype(np.float32)
+    return np.clip(pred, 0, 1)
+
+
+def boxes_from_bitmap_reference(det: SegDetectorRepresenter, pred, bitmap, dest_width, dest_height):
+    """The per contour implementation boxes_from_bitmap replaced."""
+    height, width = bitmap.shape
+    contours, _ = cv2.findContours((bitmap * 255).astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    num_contours = min(len(contours), det.max_candidates)
+    boxes = np.zeros((num_contours, 4, 2), dtype=np.int64)
+    scores = np.zeros((num_contours,), dtype=np.float32)
+
+    for index in range(num_contours):
+        contour = contours[index].squeeze(1)
+        points, sside = det.get_mini_boxes(contour)
+        if sside < det.min_size:
+            continue
+        points = np.array(points)
+        score = det.box_score_fast(pred, contour)
+        if det.box_thresh > score:
+            continue
+
+        box = det.unclip(points, unclip_ratio=det.unclip_ratio).reshape(-1, 1, 2)
+        box, sside = det.get_mini_boxes(box)
+        if sside < det.min_size + 2:
+            continue
+        box = np.array(box)
+        box[:, 0] = np.clip(np.round(box[:, 0] / width * dest_width), 0, dest_width)
+        box[:, 1] = np.clip(np.round(box[:, 1] / height * dest_height), 0, dest_height)
+        startidx = box.sum(axis=1).argmin()
+        box = np.roll(box, 4-startidx, 0)
+        boxes[index, :, :] = box.astype(np.int64)
+        scores[index] = score
+    return boxes, scores
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_same_boxes_as_reference(seed):
+    pred = make_prob_map(seed)
+    det = SegDetectorRepresenter(thresh=0.6, box_thresh=0.7, unclip_ratio=2.3)
+    bitmap = det.binarize(pred)
+    boxes, scores = det.boxes_from_bitmap(pred, bitmap, 1280, 960)
+    ref_boxes, ref_scores = boxes_from_bitmap_reference(det, pred, bitmap, 1280, 960)
+    assert (scores > 0).sum() > 5
+    np.testing.assert_array_equal(boxes, ref_boxes)
+    np.testing.assert_allclose(scores, ref_scores, rtol=1e-5)
+
+
+def test_empty_map():
+    det = SegDetectorRepresenter()
+    pred = np.zeros((64, 64), dtype=np.float32)
+    boxes, scores = det.boxes_from_bitmap(pred, det.binarize(pred), 64, 64)
+    assert len(boxes) == 0 and len(scores) == 0
@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_translator.manga_translator.dedup import PageDeduplicator
+
+
+def make_page(seed, text='CHAPTER 1'):
+    rng = np.random.default_rng(seed)
+    page = np.full((1200, 800, 3), 255, dtype=np.uint8)
+    for _ in range(12):
+        x, y = rng.integers(0, 700), rng.integers(0, 1100)
+        cv2.rectangle(page, (int(x), int(y)), (int(x + rng.integers(40, 300)), int(y + rng.integers(40, 300))), (0, 0, 0), -1 if rng.random() < 0.3 else 6)
+    cv2.putText(page, text, (200, 600), cv2.FONT_HERSHEY_SIMPLEX, 2.5, (0, 0, 0), 6)
+    return page
+
+
+def save(tmp_path, name, page):
+    path = str(tmp_path / name)
+    Image.fromarray(page).save(path)
+    return path
+
+
+def test_duplicates_are_grouped_and_reprojected(tmp_path):
+    page = make_page(0)
+    paths = [
+        save(tmp_path, 'a.png', page),
+        save(tmp_path, 'b.png', make_page(1)),
+        save(tmp_path, 'c.png', page),
+        save(tmp_path, 'd.png', cv2.resize(page, (400, 600), interpolation=cv2.INTER_AREA)),
+        save(tmp_path, 'e.png', make_page(0, 'CHAPTER 2')),
+    ]
+    dedup = PageDeduplicator(paths, 10)
+    # The other chapter number is too close to tell apart by its hash
+    assert len(dedup.clusters) == 1 and sorted(dedup.clusters[0]) == sorted([paths[0], paths[2], paths[3], paths[4]])
+    assert dedup.representative_of(paths[1]) is None
+
+    representative = dedup.clusters[0][0]
+    # A translation that changed the text
+    translated = np.array(Image.open(representative).convert('RGB'))
+    cv2.rectangle(translated, (180, 520), (700, 620), (255, 255, 255), -1)
+    cv2.putText(translated, 'KAPITEL 1', (200, 600), cv2.FONT_HERSHEY_SIMPLEX, 2.5, (0, 0, 0), 6)
+    translated_path = save(tmp_path, 'translated.png', translated)
+
+    same = dedup.reproject(paths[2] if representative != paths[2] else paths[0], translated_path)
+    assert np.array_equal(np.array(same), translated)
+    small = dedup.reproject(paths[3], translated_path)
+    assert small.size == (400, 600)
+    expected = cv2.resize(translated, (400, 600), interpolation=cv2.INTER_AREA)
+    assert np.abs(np.array(small).astype(int) - expected).mean() < 2
+    # Only the changed text tells this page apart, it has to be translated itself
+    assert dedup.reproject(paths[4], translated_path) is None
+    assert dedup.reused == 2 and dedup.rejected == 1
+
+
+def test_trimmed_duplicate_is_aligned(tmp_path):
+    page = make_page(2)
+    paths = [save(tmp_path, 'a.png', page), save(tmp_path, 'b.png', page[8:1192, 6:794])]
+    dedup = PageDeduplicator(paths, 20)
+    assert dedup.clusters == [paths]
+    reprojected = dedup.reproject(paths[1], paths[0])
+    assert reprojected.size == (788, 1184)
+    assert np.abs(np.array(reprojected).astype(int) - page[8:1192, 6:794]).mean() < 2
@@ -0,0 +1,108 @@
+import asyncio
+
+import cv2
+import numpy as np
+
+from image_translator.manga_translator.detection.common import CommonDetector
+from image_translator.manga_translator.utils import Quadrilateral
+
+
+class BlobDetector(CommonDetector):
+    """Detects every bright rectangle as a textline and records the passes."""
+
+    def __init__(self):
+        super().__init__()
+        self.passes = []
+
+    async def _detect(self, image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose=False):
+        self.passes.append((image.shape[:2], detect_size))
+        mask = (image[:, :, 0] > 127).astype(np.uint8)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        textlines = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            textlines.append(Quadrilateral(np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]]), '', 1))
+        return textlines, mask * 255, mask * 255
+
+
+def make_page(orientation: str):
+    image = np.zeros((800, 600, 3), dtype=np.uint8)
+    for i in range(4):
+        if orientation == 'h':
+            image[100 + i * 100:130 + i * 100, 100:500] = 255
+        else:
+            image[100:700, 100 + i * 100:130 + i * 100] = 255
+    return image
+
+
+def detect(detector, image, rotate=False):
+    return asyncio.run(detector.detect(image, 1536, 0.5, 0.7, 2.3, False, False, rotate, auto_rotate=True))
+
+
+def test_horizontal_page_is_rotated_once():
+    detector = BlobDetector()
+    textlines, raw_mask, _ = detect(detector, make_page('h'))
+    # A downscaled pre-pass and a single full detection on the rotated page
+    assert detector.passes == [((800, 600), 640), ((600, 800), 1536)]
+    assert raw_mask.shape == (800, 600)
+    assert len(textlines) == 4
+    assert all(txtln.aspect_ratio > 1 for txtln in textlines)
+
+
+def test_vertical_page_is_not_rotated():
+    detector = BlobDetector()
+    textlines, _, _ = detect(detector, make_page('v'), rotate=True)
+    assert detector.passes == [((800, 600), 640), ((800, 600), 1536)]
+    assert len(textlines) == 4
+    assert all(txtln.aspect_ratio < 1 for txtln in textlines)
+
+
+class SmallTextDetector(BlobDetector):
+    """Only finds text when detecting at more than 640px, like text lost in the downscale."""
+
+    async def _detect(self, image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose=False):
+        textlines, raw_mask, mask = await super()._detect(image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose)
+        if detect_size <= 640:
+            return [], raw_mask * 0, mask * 0
+        return textlines, raw_mask, mask
+
+
+def test_small_text_falls_back_to_full_size_vote():
+    detector = SmallTextDetector()
+    textlines, _, _ = detect(detector, make_page('v'))
+    # The full detection decides and is kept since the page needs no rotation
+    assert detector.passes == [((800, 600), 640), ((800, 600), 1536)]
+    assert len(textlines) == 4
+
+    detector = SmallTextDetector()
+    textlines, _, _ = detect(detector, make_page('h'))
+    assert detector.passes == [((800, 600), 640), ((800, 600), 1536), ((600, 800), 1536)]
+    assert all(txtln.aspect_ratio > 1 for txtln in textlines)
+
+
+def test_textless_page_keeps_its_orientation():
+    detector = BlobDetector()
+    textlines, raw_mask, _ = detect(detector, np.zeros((800, 600, 3), dtype=np.uint8))
+    assert detector.passes == [((800, 600), 640), ((800, 600), 1536)]
+    assert textlines == [] and raw_mask.shape == (800, 600)
+
+
+def test_prepass_at_final_size_is_reused():
+    detector = BlobDetector()
+    textlines, _, _ = asyncio.run(detector.detect(make_page('v'), 640, 0.5, 0.7, 2.3, False, False, False, auto_rotate=True))
+    # The pre-pass would be the full detection, so it runs once
+    assert detector.passes == [((800, 600), 640)]
+    assert len(textlines) == 4
+
+    detector = BlobDetector()
+    textlines, _, _ = asyncio.run(detector.detect(make_page('h'), 512, 0.5, 0.7, 2.3, False, False, False, auto_rotate=True))
+    assert detector.passes == [((800, 600), 512), ((600, 800), 512)]
+    assert all(txtln.aspect_ratio > 1 for txtln in textlines)
+
+
+def test_full_size_vote_reruns_with_the_right_rotation():
+    detector = SmallTextDetector()
+    # Asked to rotate, but the full size detection finds vertical text
+    textlines, _, _ = detect(detector, make_page('v'), rotate=True)
+    assert detector.passes == [((800, 600), 640), ((600, 800), 1536), ((800, 600), 1536)]
+    assert all(txtln.aspect_ratio < 1 for txtln in textlines)
@@ -0,0 +1,54 @@
+import os
+import random
+import re
+
+from image_translator.manga_translator.dictionary import Dictionary, load_dictionary
+
+
+def apply_sequentially(text, entries):
+    for pattern, replacement in entries:
+        text = re.sub(pattern, replacement, text)
+    return text
+
+
+def test_same_as_sequential():
+    rng = random.Random(0)
+    alphabet = 'abcde'
+
+    def word(max_length):
+        return ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, max_length)))
+
+    regexes = [(r'a+b', 'x'), (r'(c)d', r'\1\1'), (r'^e', ''), (r'b{2}', 'a'), (r'\s+', ' ')]
+    for _ in range(200):
+        entries = []
+        for _ in range(rng.randint(1, 40)):
+            if rng.random() < 0.1:
+                entries.append(rng.choice(regexes))
+            else:
+                # Short words over a small alphabet overlap, chain and delete a lot
+                entries.append((word(4), '' if rng.random() < 0.15 else word(4)))
+        dictionary = Dictionary(entries)
+        for _ in range(20):
+            text = ' '.join(word(12) for _ in range(rng.randint(0, 6)))
+            assert dictionary.apply(text) == apply_sequentially(text, entries)
+
+
+def test_glossary_in_one_pass():
+    names = [f'Name{i}x' for i in range(1000)]
+    entries = [(name, name.upper()) for name in names] + [('さん', '-san')]
+    dictionary = Dictionary(entries)
+    assert len(dictionary.steps) == 1
+    text = 'Name12x met Name999x and Name100xさん'
+    assert dictionary.apply(text) == apply_sequentially(text, entries) == 'NAME12X met NAME999X and NAME100X-san'
+
+
+def test_reload_on_change(tmp_path):
+    path = tmp_path / 'dict.txt'
+    path.write_text('# comment\nfoo bar // note\nbaz\n', encoding='utf-8')
+    dictionary = load_dictionary(str(path))
+    assert list(dictionary) == [('foo', 'bar'), ('baz', '')]
+    assert load_dictionary(str(path)) is dictionary
+    path.write_text('foo qux\n', encoding='utf-8')
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert load_dictionary(str(path)).apply('foo baz') == 'qux baz'
+    assert len(load_dictionary(None)) == 0
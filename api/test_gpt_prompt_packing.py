@@ -0,0 +1,100 @@
+import asyncio
+import re
+
+import pytest
+from aiohttp import web
+
+openai = pytest.importorskip('openai')
+
+from image_translator.manga_translator.translators.chatgpt import GPT3Translator
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setattr(openai, 'api_key', 'test')
+
+
+class FakeCompletionServer:
+    """Completion endpoint that answers with the uppercased queries of the prompt."""
+
+    def __init__(self, drop_last_above: int = None, delay: float = 0):
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.drop_last_above = drop_last_above
+        self.delay = delay
+
+    async def completions(self, request):
+        data = await request.json()
+        prompt = data['prompt']
+        self.prompts.append(prompt)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+        queries = re.findall(r'<\|\d+\|>(.*)', prompt.split('Original:')[1])[:-1]
+        translations = [q.upper() for q in queries]
+        if self.drop_last_above is not None and len(translations) > self.drop_last_above:
+            translations = translations[:-1]
+        # The prompt already ends with <|1|>
+        text = '\n'.join(t if i == 0 else f'<|{i+1}|>{t}' for i, t in enumerate(translations))
+        return web.json_response({
+            'id': 'cmpl', 'object': 'text_completion', 'created': 0, 'model': data['model'],
+            'choices': [{'text': text, 'index': 0, 'logprobs': None, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/v1/completions', self.completions)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        return f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/v1'
+
+
+async def translate_pages(server: FakeCompletionServer, pages, max_tokens: int = None):
+    url = await server.start()
+    translator = GPT3Translator(check_openai_key=False)
+    translator.client.base_url = url
+    if max_tokens:
+        translator._MAX_TOKENS = max_tokens
+    try:
+        if len(pages) == 1:
+            return [await translator.translate('auto', 'ENG', pages[0])]
+        return await translator._translate_pages('English', pages)
+    finally:
+        await translator.client.close()
+        await server.runner.cleanup()
+
+
+def test_pages_share_prompts():
+    server = FakeCompletionServer()
+    pages = [['page one a', 'page one b', 'page one c'], ['page two a'], ['page three a', 'page three b']]
+    results = asyncio.run(translate_pages(server, pages))
+    assert results == [[q.upper() for q in page] for page in pages]
+    assert len(server.prompts) == 1
+
+
+def test_prompts_are_sent_concurrently():
+    server = FakeCompletionServer(delay=0.2)
+    pages = [[f'query {i} ' + 'x' * 40 for i in range(12)]]
+    results = asyncio.run(translate_pages(server, pages, max_tokens=200))
+    assert results == [[q.upper() for q in page] for page in pages]
+    assert len(server.prompts) > 1
+    assert server.max_in_flight > 1
+
+
+def test_misaligned_batches_are_split():
+    # Responses for more than 2 queries miss the last translation
+    server = FakeCompletionServer(drop_last_above=2)
+    pages = [['a1', 'a2', 'a3'], ['b1', 'b2']]
+    results = asyncio.run(translate_pages(server, pages))
+    assert results == [['A1', 'A2', 'A3'], ['B1', 'B2']]
+    # The batch of 5 queries is retried as 2 + 3, the latter once more as 1 + 2
+    assert len(server.prompts) == 5
+
@@ -0,0 +1,23 @@
+from image_translator.manga_translator.utils.language import classify_language, detect_language, detect_languages, guess_language
+
+
+def test_detect_languages():
+    lines = ['これはテストです', 'This is a test of the language identification.', 'これはテストです', '   ']
+    classify_language.cache_clear()
+    assert detect_languages(lines) == ['ja', 'en', 'ja', None]
+    # The repeated line is only classified once
+    assert classify_language.cache_info().misses == 2
+    assert guess_language(lines[:1]) == 'ja'
+
+
+def test_confidence_threshold():
+    lang, confidence = classify_language('ok')
+    assert detect_language('ok', min_confidence=confidence) == lang
+    assert detect_language('ok', min_confidence=min(confidence + 0.01, 1.01)) is None
+
+
+def test_guess_ignores_threshold():
+    # Short lines are rarely classified confidently but the translators still need a source language
+    lang, confidence = classify_language('Thank you')
+    assert detect_language('Thank you', min_confidence=confidence + 0.01) is None
+    assert guess_language('Thank you') == guess_language(['Thank you']) == lang
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import http.server
+import json
+import os
+import re
+import threading
+from functools import partial
+
+import pytest
+
+from image_translator.manga_translator.utils import ModelWrapper, get_cached_digest
+from image_translator.manga_translator.utils.generic import DIGEST_MANIFEST
+
+
+def make_model_class(url_a: str, url_b: str, hash_a: str, hash_b: str):
+    class DummyModel(ModelWrapper):
+        _MODEL_SUB_DIR = 'dummy'
+        _MODEL_MAPPING = {
+            'a': {'url': url_a, 'hash': hash_a, 'file': '.'},
+            'b': {'url': url_b, 'hash': hash_b, 'file': '.'},
+        }
+
+        async def _load(self, device: str):
+            pass
+
+        async def _unload(self):
+            pass
+
+        async def _infer(self):
+            pass
+
+    return DummyModel
+
+
+@pytest.fixture
+def files(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    contents = {'a.bin': os.urandom(3 * 1024 * 1024 + 17), 'b.bin': os.urandom(1024)}
+    for name, data in contents.items():
+        (src / name).write_bytes(data)
+    hashes = {name: hashlib.sha256(data).hexdigest() for name, data in contents.items()}
+    return src, contents, hashes
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    d = tmp_path / 'models'
+    d.mkdir()
+    monkeypatch.setattr(ModelWrapper, '_MODEL_DIR', str(d))
+    monkeypatch.setattr(ModelWrapper, '_MODEL_MIRROR', None)
+    return d
+
+
+@pytest.fixture
+def http_server(files):
+    src = files[0]
+    handler = partial(http.server.SimpleHTTPRequestHandler, directory=str(src))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves byte ranges like the hosts models are downloaded from."""
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if not match:
+            return super().do_GET()
+        with open(self.translate_path(self.path), 'rb') as f:
+            data = f.read()
+        start = int(match.group(1))
+        if start >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+
+@pytest.fixture
+def range_server(files):
+    handler = partial(RangeRequestHandler, directory=str(files[0]))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+@pytest.mark.parametrize('part_size', ['full', 'partial'])
+def test_corrupt_part_is_downloaded_again(files, model_dir, range_server, part_size):
+    _, contents, hashes = files
+    cls = make_model_class(f'{range_server}/a.bin', f'{range_server}/b.bin', hashes['a.bin'], hashes['b.bin'])
+    (model_dir / 'dummy').mkdir()
+    # An interrupted download of another version of the file
+    size = len(contents['a.bin']) if part_size == 'full' else 1000
+    (model_dir / 'dummy' / 'a.bin.part').write_bytes(os.urandom(size))
+    model = cls()
+    # Fails with an input prompt if the retry from the start didn't work
+    asyncio.run(model.download())
+    assert (model_dir / 'dummy' / 'a.bin').read_bytes() == contents['a.bin']
+    assert not (model_dir / 'dummy' / 'a.bin.part').exists()
+
+
+def test_download_over_http(files, model_dir, http_server):
+    _, contents, hashes = files
+    cls = make_model_class(f'{http_server}/a.bin', f'{http_server}/b.bin', hashes['a.bin'], hashes['b.bin'])
+    model = cls()
+    assert not model.is_downloaded()
+    asyncio.run(model.download())
+    assert model.is_downloaded()
+    for name, data in contents.items():
+        assert (model_dir / 'dummy' / name).read_bytes() == data
+    assert asyncio.run(model.verify())
+
+
+def test_install_from_mirror(files, model_dir, monkeypatch):
+    src, contents, hashes = files
+    # The urls are unreachable, so the files have to come from the mirror
+    cls = make_model_class('http://127.0.0.1:9/a.bin', 'http://127.0.0.1:9/b.bin', hashes['a.bin'], hashes['b.bin'])
+    monkeypatch.setattr(ModelWrapper, '_MODEL_MIRROR', str(src))
+    model = cls()
+    asyncio.run(model.download())
+    for name, data in contents.items():
+        assert (model_dir / 'dummy' / name).read_bytes() == data
+
+
+def test_digest_manifest(tmp_path, monkeypatch):
+    p = tmp_path / 'weights.bin'
+    p.write_bytes(b'1' * 1000)
+    digest = get_cached_digest(str(p))
+    assert digest == hashlib.sha256(b'1' * 1000).hexdigest()
+    manifest = json.loads((tmp_path / DIGEST_MANIFEST).read_text())
+    assert manifest['weights.bin']['sha256'] == digest
+
+    import image_translator.manga_translator.utils.generic as generic
+    calls = []
+    original = generic.get_digest
+    monkeypatch.setattr(generic, 'get_digest', lambda path: calls.append(path) or original(path))
+    assert get_cached_digest(str(p)) == digest
+    assert not calls
+
+    # Changing the file invalidates the entry
+    p.write_bytes(b'2' * 1001)
+    assert get_cached_digest(str(p)) == hashlib.sha256(b'2' * 1001).hexdigest()
+    assert calls
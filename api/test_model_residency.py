@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from image_translator.manga_translator.utils import ModelWrapper, ModelResidency
+from image_translator.manga_translator.utils import inference
+
+
+class FakeModel(ModelWrapper):
+    _MODEL_MAPPING = {}
+
+    def __init__(self, key: str, size: int):
+        self._KEY = key
+        self.size = size
+        self.loads = []
+        # Set to hold _infer until it is set
+        self.release = None
+        super().__init__()
+
+    async def _load(self, device: str, *args, **kwargs):
+        self.loads.append((device, args, kwargs))
+
+    async def _unload(self):
+        pass
+
+    async def _infer(self, *args, **kwargs):
+        if self.release is not None:
+            await self.release.wait()
+        return self._key
+
+
+@pytest.fixture
+def residency(tmp_path, monkeypatch):
+    monkeypatch.setattr(ModelWrapper, '_MODEL_DIR', str(tmp_path))
+    monkeypatch.setattr(inference, 'get_model_size', lambda model: model.size)
+    residency = ModelResidency(budget=250)
+    monkeypatch.setattr(inference, 'model_residency', residency)
+    return residency
+
+
+def loaded(*models):
+    return [model._key for model in models if model.is_loaded()]
+
+
+def test_evicts_least_recently_used(residency):
+    a, b, c = FakeModel('a', 100), FakeModel('b', 100), FakeModel('c', 100)
+
+    async def run():
+        await a.load('cpu')
+        await b.load('cpu')
+        # Using a makes b the least recently used
+        assert await a.infer() == 'a'
+        await c.load('cpu')
+
+    asyncio.run(run())
+    assert loaded(a, b, c) == ['a', 'c']
+    assert residency.used == 200
+    assert [m['key'] for m in residency.report()] == ['a', 'c']
+
+
+def test_no_budget_keeps_everything(residency):
+    residency.budget = 0
+    models = [FakeModel(str(i), 100) for i in range(5)]
+
+    async def run():
+        for model in models:
+            await model.load('cpu')
+
+    asyncio.run(run())
+    assert len(loaded(*models)) == 5
+    assert residency.used == 500
+
+
+def test_running_model_is_pinned(residency):
+    residency.budget = 150
+    a, b, c = FakeModel('a', 100), FakeModel('b', 100), FakeModel('c', 100)
+
+    async def run():
+        a.release = asyncio.Event()
+        await a.load('cpu')
+        task = asyncio.create_task(a.infer())
+        await asyncio.sleep(0)
+        assert residency.report()[0]['pinned']
+
+        await b.load('cpu')
+        await c.load('cpu')
+        # a is the least recently used but still running, so b goes instead
+        assert loaded(a, b, c) == ['a', 'c']
+
+        a.release.set()
+        assert await task == 'a'
+        assert not any(m['pinned'] for m in residency.report())
+        await residency.enforce()
+        assert loaded(a, b, c) == ['c']
+
+    asyncio.run(run())
+
+
+def test_evicted_model_is_reloaded(residency):
+    residency.budget = 150
+    a, b = FakeModel('a', 100), FakeModel('b', 100)
+
+    async def run():
+        await a.load('cpu', option=1)
+        await b.load('cpu')
+        assert loaded(a, b) == ['b']
+        # a comes back with the arguments it was loaded with and b makes room
+        assert await a.infer() == 'a'
+        assert loaded(a, b) == ['a']
+
+    asyncio.run(run())
+    assert a.loads == [('cpu', (), {'option': 1})] * 2
+    assert len(b.loads) == 1
+    assert residency.used == 100
+
+
+def test_infer_without_load_fails(residency):
+    with pytest.raises(Exception, match='without having loaded'):
+        asyncio.run(FakeModel('a', 100).infer())
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+import torch
+
+from image_translator.manga_translator.ocr.model_48px import OCR, Model48pxOCR, get_max_seq_length
+from image_translator.manga_translator.utils.generic import AvgMeter
+
+DICTIONARY = ['<PAD>', '<S>', '</S>', '<SP>', 'a', 'b', 'c', 'd', 'e', 'f']
+START, END = 1, 2
+
+
+def make_ocr(model: OCR = None) -> Model48pxOCR:
+    """Model48pxOCR with what `_load` sets up, without reading the checkpoint."""
+    ocr = Model48pxOCR.__new__(Model48pxOCR)
+    ocr.model = model or OCR(DICTIONARY, 768)
+    ocr._chars = np.array([' ' if ch == '<SP>' else ch for ch in DICTIONARY], dtype = object)
+    ocr._start_ids = [i for i, ch in enumerate(DICTIONARY) if ch == '<S>']
+    ocr._end_ids = [i for i, ch in enumerate(DICTIONARY) if ch == '</S>']
+    return ocr
+
+
+def decode_prediction_reference(dictionary, pred_chars_index, fg_pred, bg_pred, fg_ind_pred, bg_ind_pred):
+    """The per character averaging `_decode_prediction` replaced."""
+    has_fg = (fg_ind_pred[:, 1] > fg_ind_pred[:, 0])
+    has_bg = (bg_ind_pred[:, 1] > bg_ind_pred[:, 0])
+    seq = []
+    fr, fg, fb = AvgMeter(), AvgMeter(), AvgMeter()
+    br, bg, bb = AvgMeter(), AvgMeter(), AvgMeter()
+    for chid, c_fg, c_bg, h_fg, h_bg in zip(pred_chars_index, fg_pred, bg_pred, has_fg, has_bg):
+        ch = dictionary[chid]
+        if ch == '<S>':
+            continue
+        if ch == '</S>':
+            break
+        if ch == '<SP>':
+            ch = ' '
+        seq.append(ch)
+        if h_fg.item():
+            fr(int(c_fg[0] * 255))
+            fg(int(c_fg[1] * 255))
+            fb(int(c_fg[2] * 255))
+        if h_bg.item():
+            br(int(c_bg[0] * 255))
+            bg(int(c_bg[1] * 255))
+            bb(int(c_bg[2] * 255))
+        else:
+            br(int(c_fg[0] * 255))
+            bg(int(c_fg[1] * 255))
+            bb(int(c_fg[2] * 255))
+    fg_color = [min(max(int(v()), 0), 255) for v in (fr, fg, fb)]
+    bg_color = [min(max(int(v()), 0), 255) for v in (br, bg, bb)]
+    return ''.join(seq), fg_color, bg_color
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_decode_prediction_matches_reference(seed):
+    rng = torch.Generator().manual_seed(seed)
+    ocr = make_ocr(model = torch.nn.Module())
+    length = int(torch.randint(0, 30, (1,), generator = rng))
+    chars = torch.randint(0, len(DICTIONARY), (length,), generator = rng)
+    # Colors slightly out of range to exercise the clipping
+    fg_pred = torch.rand(length, 3, generator = rng) * 1.4 - 0.2
+    bg_pred = torch.rand(length, 3, generator = rng) * 1.4 - 0.2
+    fg_ind_pred = torch.randn(length, 2, generator = rng)
+    bg_ind_pred = torch.randn(length, 2, generator = rng)
+    if seed % 2:
+        # Mostly text without a start token inside or an end token
+        chars = chars.clamp(min = 3)
+
+    assert ocr._decode_prediction(chars, fg_pred, bg_pred, fg_ind_pred, bg_ind_pred) == \
+        decode_prediction_reference(DICTIONARY, chars, fg_pred, bg_pred, fg_ind_pred, bg_ind_pred)
+
+
+def make_model(end_bias: float) -> OCR:
+    torch.manual_seed(0)
+    model = OCR(DICTIONARY, 768).eval()
+    with torch.no_grad():
+        # A randomly initialised model hardly ever emits the end token, this makes it the most likely one after two characters
+        model.pred.bias[END] += end_bias
+    return model
+
+
+@pytest.mark.parametrize('end_bias', [0, 1.5])
+def test_greedy_decoding_stays_within_max_length(end_bias):
+    model = make_model(end_bias)
+    widths = [40, 72, 120, 120, 72]
+    images = torch.rand(len(widths), 3, 48, max(widths)) * 2 - 1
+    for i, w in enumerate(widths):
+        images[i, :, :, w:] = 0
+    # The last two repeat earlier images with a shorter limit
+    images[3], images[4] = images[2], images[1]
+    max_lengths = [get_max_seq_length(w, 255) for w in widths]
+    max_lengths[3:] = [4, 3]
+
+    with torch.no_grad():
+        ret = model.infer_greedy_batch_tensor(images, widths, start_tok = START, end_tok = END, max_seq_length = max_lengths)
+
+    assert len(ret) == len(widths)
+    sequences = []
+    for (chars, prob, fg_pred, bg_pred, fg_ind_pred, bg_ind_pred), max_length in zip(ret, max_lengths):
+        chars = chars.tolist()
+        assert len(chars) == max(max_lengths)
+        # Once finished only end tokens follow, at the latest after max_length steps
+        length = chars.index(END) if END in chars[:max_length] else max_length
+        assert all(ch == END for ch in chars[length:])
+        if end_bias:
+            assert length < max_length
+        assert 0 < prob <= 1
+        assert fg_pred.shape == bg_pred.shape == (max(max_lengths), 3)
+        assert fg_ind_pred.shape == bg_ind_pred.shape == (max(max_lengths), 2)
+        sequences.append(chars[:length])
+    if not end_bias:
+        # Every row ran into its own limit, so rows left the batch at different steps
+        assert [len(seq) for seq in sequences] == max_lengths
+    # Removing finished rows from the batch doesn't change the others
+    assert sequences[3] == sequences[2][:len(sequences[3])]
+    assert sequences[4] == sequences[1][:len(sequences[4])]
+
+    ocr = make_ocr(model)
+    for (chars, prob, fg_pred, bg_pred, fg_ind_pred, bg_ind_pred), seq in zip(ret, sequences):
+        txt, fg_color, bg_color = ocr._decode_prediction(chars, fg_pred, bg_pred, fg_ind_pred, bg_ind_pred)
+        assert len(txt) == len(seq)
+        assert all(0 <= v <= 255 for v in fg_color + bg_color)
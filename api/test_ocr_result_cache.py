@@ -0,0 +1,113 @@
+import asyncio
+
+import numpy as np
+
+from image_translator.manga_translator.ocr import CommonOCR, OCRResultCache, recognize_cached
+from image_translator.manga_translator.utils import Quadrilateral
+
+
+class CountingOCR(CommonOCR):
+    """Reads the text from the brightness of the textline and drops dark ones."""
+
+    def __init__(self):
+        super().__init__()
+        self.recognized = 0
+
+    async def _recognize(self, image, textlines, args, verbose=False):
+        out = []
+        for textline in textlines:
+            self.recognized += 1
+            crop = textline.get_transformed_region(image, textline.direction, 48)
+            value = int(np.median(crop))
+            if value < 50:
+                continue
+            textline.text = f'text {value}'
+            textline.prob = 0.9
+            out.append(textline)
+        return out
+
+
+def make_page():
+    # Three horizontal textlines, the first and last one have the same content
+    image = np.zeros((300, 400, 3), dtype=np.uint8)
+    image[10:50, 10:210] = 200
+    image[110:150, 10:210] = 120
+    image[210:250, 10:210] = 200
+    image[210:250, 250:350] = 10
+    boxes = [(10, 10, 210, 50), (10, 110, 210, 150), (10, 210, 210, 250), (250, 210, 350, 250)]
+    textlines = [Quadrilateral(np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]), '', 0) for x1, y1, x2, y2 in boxes]
+    return image, textlines
+
+
+def test_identical_crops_are_recognized_once(tmp_path):
+    ocr = CountingOCR()
+    cache = OCRResultCache(max_size=16, path=str(tmp_path / 'ocr.db'))
+
+    image, textlines = make_page()
+    out = asyncio.run(recognize_cached(ocr, 'test', image, textlines, {}, cache=cache))
+    assert [q.text for q in out] == ['text 200', 'text 120', 'text 200']
+    # The repeated textline of the same page is only recognized once
+    assert ocr.recognized == 3
+
+    # The next page repeats all textlines
+    image, textlines = make_page()
+    out = asyncio.run(recognize_cached(ocr, 'test', image, textlines, {}, cache=cache))
+    assert [q.text for q in out] == ['text 200', 'text 120', 'text 200']
+    assert ocr.recognized == 3
+    assert cache.stats['hits'] == 5
+
+    # Results survive in the persistent tier
+    cache = OCRResultCache(max_size=16, path=str(tmp_path / 'ocr.db'))
+    image, textlines = make_page()
+    out = asyncio.run(recognize_cached(ocr, 'test', image, textlines, {}, cache=cache))
+    assert [q.text for q in out] == ['text 200', 'text 120', 'text 200']
+    assert ocr.recognized == 3
+    assert cache.stats['persistent_hits'] == 3
+
+
+def test_cache_is_per_model():
+    ocr = CountingOCR()
+    cache = OCRResultCache(max_size=16)
+    image, textlines = make_page()
+    asyncio.run(recognize_cached(ocr, 'a', image, textlines, {}, cache=cache))
+    image, textlines = make_page()
+    asyncio.run(recognize_cached(ocr, 'b', image, textlines, {}, cache=cache))
+    assert ocr.recognized == 6
+
+
+def test_lru_eviction():
+    cache = OCRResultCache(max_size=2)
+    for key in 'abc':
+        cache.put(key, (key, 1.0, 0, 0, 0, 0, 0, 0))
+    assert cache.get('a') == (False, None)
+    assert cache.get('c')[0]
+
+
+def test_result_affecting_args_are_part_of_the_key():
+    ocr = CountingOCR()
+    cache = OCRResultCache(max_size=16)
+    for args in ({'ignore_bubble': 0}, {'ignore_bubble': 10}, {'ignore_bubble': 10, 'ocr_decoding': 'greedy'}):
+        image, textlines = make_page()
+        asyncio.run(recognize_cached(ocr, 'test', image, textlines, args, cache=cache))
+    assert ocr.recognized == 9
+
+
+def test_misses_use_the_directions_of_the_whole_page():
+    class DirectionOCR(CountingOCR):
+        async def _recognize(self, image, textlines, args, verbose=False):
+            self.received = args.get('text_directions')
+            return await super()._recognize(image, textlines, args, verbose)
+
+    ocr = DirectionOCR()
+    cache = OCRResultCache(max_size=16)
+    image, textlines = make_page()
+    asyncio.run(recognize_cached(ocr, 'test', image, textlines, {}, cache=cache))
+    # The next page only differs in its second textline
+    image, textlines = make_page()
+    image[110:150, 10:210] = 140
+    out = asyncio.run(recognize_cached(ocr, 'test', image, textlines, {}, cache=cache))
+    assert ocr.recognized == 4
+    expected = {id(q): d for q, d in ocr._generate_text_direction(textlines)}
+    assert ocr.received == expected
+    assert list(ocr._generate_text_direction([textlines[1]], ocr.received)) == [(textlines[1], expected[id(textlines[1])])]
+    assert [q.text for q in out] == ['text 200', 'text 140', 'text 200']
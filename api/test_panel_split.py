@@ -0,0 +1,126 @@
+import asyncio
+
+import cv2
+import numpy as np
+
+from image_translator.manga_translator import detection, inpainting
+from image_translator.manga_translator.detection import find_panels
+from image_translator.manga_translator.detection.common import CommonDetector
+from image_translator.manga_translator.inpainting.common import CommonInpainter
+from image_translator.manga_translator.textline_merge import dispatch as dispatch_textline_merge
+from image_translator.manga_translator.utils import Quadrilateral, sort_regions
+
+
+def make_page():
+    # Two rows, the upper one with two panels
+    page = np.full((1000, 800, 3), 255, dtype=np.uint8)
+    for x1, y1, x2, y2 in [(410, 10, 790, 490), (10, 10, 390, 490), (10, 506, 790, 990)]:
+        cv2.rectangle(page, (x1, y1), (x2, y2), (0, 0, 0), 4)
+    return page
+
+
+def textline(x, y, text):
+    return Quadrilateral(np.array([[x, y], [x + 200, y], [x + 200, y + 40], [x, y + 40]]), text, 0.9)
+
+
+def test_find_panels():
+    panels = find_panels(make_page())
+    # Top right first like manga
+    assert [(x // 10, y // 10) for x, y, w, h in panels] == [(40, 0), (0, 0), (0, 50)]
+    # Single panel pages aren't split
+    page = np.full((1000, 800, 3), 255, dtype=np.uint8)
+    cv2.rectangle(page, (10, 10), (790, 990), (0, 0, 0), 4)
+    assert find_panels(page) == []
+
+
+def test_textlines_are_not_merged_across_panels():
+    panels = find_panels(make_page())
+    # Stacked textlines at the bottom of the upper left panel and the top of the lower panel
+    textlines = [textline(20, 416, 'a1'), textline(20, 466, 'a2'), textline(20, 516, 'b1'), textline(20, 566, 'b2')]
+    regions = asyncio.run(dispatch_textline_merge(textlines, 800, 1000))
+    assert len(regions) == 1
+    regions = asyncio.run(dispatch_textline_merge(textlines, 800, 1000, panels=panels))
+    assert sorted(region.texts for region in regions) == [['a1', 'a2'], ['b1', 'b2']]
+
+
+def test_regions_are_sorted_by_panel():
+    panels = find_panels(make_page())
+    textlines = [textline(20, 600, 'lower'), textline(20, 100, 'left'), textline(420, 300, 'right')]
+    regions = asyncio.run(dispatch_textline_merge(textlines, 800, 1000, panels=panels))
+    # The right panel comes first even though its text is lower than the one of the left panel
+    assert [region.texts[0] for region in sort_regions(regions, panels=panels)] == ['right', 'left', 'lower']
+
+
+class GrayTextDetector(CommonDetector):
+    """Detects the gray (not black) blobs of an image as textlines, which leaves out panel borders."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def _detect(self, image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose=False):
+        self.calls.append((image.shape[:2], detect_size))
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        text = ((gray > 40) & (gray < 100)).astype(np.uint8)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(text)
+        textlines = [Quadrilateral(np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]]), '', 0.9) for x, y, w, h, _ in stats[1:]]
+        return textlines, text * 255, None
+
+
+class FillInpainter(CommonInpainter):
+    """Fills the masked pixels with the value of the call, to tell the passes apart."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def _inpaint(self, image, mask, inpainting_size=1024, verbose=False):
+        self.calls += 1
+        result = image.copy()
+        result[mask > 0] = 100 + self.calls
+        return result
+
+
+def make_page_with_margin():
+    # Three panels over the upper two thirds, a narration line in the bottom margin
+    page = np.full((1000, 800, 3), 255, dtype=np.uint8)
+    panels = [(410, 10, 380, 380), (10, 10, 380, 380), (10, 410, 780, 280)]
+    for x, y, w, h in panels:
+        cv2.rectangle(page, (x, y), (x + w, y + h), (0, 0, 0), 4)
+    for x, y in [(450, 100), (100, 200), (300, 500), (300, 850)]:
+        page[y:y + 20, x:x + 120] = 70
+    return page, panels
+
+
+def test_per_panel_detection_finds_text_outside_panels(monkeypatch):
+    detector = GrayTextDetector()
+    monkeypatch.setitem(detection.detector_cache, 'none', detector)
+    page, panels = make_page_with_margin()
+    textlines, raw_mask, mask = asyncio.run(detection.dispatch_panels('none', page, panels, 1024, 0.5, 0.7, 2.3, False, False, False))
+    assert sorted(tuple(t.pts[0]) for t in textlines) == [(100, 200), (300, 500), (300, 850), (450, 100)]
+    # One pass per panel and one over the margin
+    assert len(detector.calls) == 4
+    assert raw_mask.shape == (1000, 800) and raw_mask[855, 350] > 0 and raw_mask[205, 150] > 0
+
+
+def test_per_panel_detection_skips_blank_gutters(monkeypatch):
+    detector = GrayTextDetector()
+    monkeypatch.setitem(detection.detector_cache, 'none', detector)
+    page, panels = make_page_with_margin()
+    page[850:870, 300:420] = 255
+    textlines, _, _ = asyncio.run(detection.dispatch_panels('none', page, panels, 1024, 0.5, 0.7, 2.3, False, False, False))
+    assert len(textlines) == 3 and len(detector.calls) == 3
+
+
+def test_per_panel_inpainting(monkeypatch):
+    inpainter = FillInpainter()
+    monkeypatch.setitem(inpainting.inpainter_cache, 'none', inpainter)
+    page, panels = make_page_with_margin()
+    mask = np.zeros(page.shape[:2], dtype=np.uint8)
+    mask[100:120, 450:570] = 255
+    mask[850:870, 300:420] = 255
+    result = asyncio.run(inpainting.dispatch_panels('none', page, mask, panels))
+    # The panel with text is inpainted on its own, the margin on the page afterwards
+    assert inpainter.calls == 2
+    assert (result[100:120, 450:570] == 101).all() and (result[850:870, 300:420] == 102).all()
+    assert (result[mask == 0] == page[mask == 0]).all()
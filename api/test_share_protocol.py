@@ -0,0 +1,142 @@
+import re
+
+import msgpack
+import numpy as np
+import pytest
+from omegaconf import OmegaConf
+from PIL import Image
+
+from image_translator.manga_translator.args import DEFAULT_ARGS
+from image_translator.manga_translator.share_protocol import (
+    FRAME_PROGRESS,
+    FRAME_RESULT,
+    PROTOCOL_VERSION,
+    FrameReader,
+    ShareEncoder,
+    ShareProtocolError,
+    decode,
+    encode_frame,
+    iter_frame,
+    read_frames,
+)
+from image_translator.manga_translator.translators import TranslatorChain
+from image_translator.manga_translator.utils import Context, Quadrilateral, TextBlock
+
+
+def assert_same(a, b):
+    assert type(a) is type(b)
+    if isinstance(a, np.ndarray):
+        assert a.dtype == b.dtype and a.shape == b.shape
+        np.testing.assert_array_equal(a, b)
+    elif isinstance(a, Image.Image):
+        assert a.mode == b.mode and a.size == b.size
+        assert a.tobytes() == b.tobytes()
+    elif isinstance(a, dict):
+        assert set(a) == set(b)
+        for key in a:
+            assert_same(a[key], b[key])
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y)
+    elif isinstance(a, TranslatorChain):
+        assert a.chain == b.chain and a.target_lang == b.target_lang
+    elif isinstance(a, (Quadrilateral, TextBlock)):
+        assert_same(a.__dict__, b.__dict__)
+    elif type(a).__name__ == 'DictConfig':
+        assert OmegaConf.to_container(a) == OmegaConf.to_container(b)
+    else:
+        assert a == b
+
+
+def make_context():
+    ctx = Context(**DEFAULT_ARGS)
+    h, w = 64, 48
+    rng = np.random.default_rng(0)
+    img_rgb = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+    mask = rng.integers(0, 255, (h, w), dtype=np.uint8)
+
+    ctx.input = Image.fromarray(img_rgb)
+    ctx.img_colorized = ctx.input.convert('RGBA')
+    ctx.upscaled = ctx.input.convert('L')
+    ctx.img_rgb = img_rgb
+    ctx.img_alpha = None
+    ctx.mask_raw = mask
+    ctx.mask = mask.copy()
+    ctx.img_inpainted = img_rgb.copy()
+    ctx.gimp_mask = np.dstack((img_rgb, mask))
+    ctx.img_rendered = img_rgb.copy()
+    ctx.render_mask = mask.astype(np.float32) / 255
+    ctx.result = ctx.input.convert('P')
+
+    pts = np.array([[2, 2], [30, 2], [30, 12], [2, 12]], dtype=np.int64)
+    ctx.textlines = [Quadrilateral(pts, 'テスト', 0.9, 1, 2, 3, 250, 251, 252)]
+    region = TextBlock([pts], ['テスト'], language='ja', font_size=14, fg_color=(1, 2, 3), bg_color=(250, 251, 252))
+    region.translation = 'test'
+    region.target_lang = 'ENG'
+    ctx.text_regions = [region]
+
+    ctx.translator = TranslatorChain('sugoi:JPN;none:ENG')
+    ctx.target_lang = ctx.translator.target_lang
+    ctx.filter_text = re.compile(r'^\d+$', re.IGNORECASE)
+    ctx.font_color_fg = (255, 0, 0)
+    ctx.font_color_bg = None
+    ctx.gpt_config = OmegaConf.create({'temperature': 0.5, 'chat_system_template': 'x'})
+    ctx.direction = 'auto'
+    ctx.alignment = 'auto'
+    ctx.renderer = 'default'
+    ctx.float_value = np.float32(0.25)
+    return ctx
+
+
+@pytest.mark.parametrize('image_format', ['raw', 'png', 'webp'])
+def test_context_round_trip(image_format):
+    ctx = make_context()
+    decoded = decode(ShareEncoder(image_format).encode(ctx))
+    assert isinstance(decoded, Context)
+    assert_same(ctx, decoded)
+    # Cached properties are recomputed from the transferred fields
+    assert decoded.text_regions[0].xyxy.tolist() == ctx.text_regions[0].xyxy.tolist()
+    assert decoded.textlines[0].aabb.w == ctx.textlines[0].aabb.w
+
+
+def test_decoded_arrays_are_writable():
+    arr = decode(ShareEncoder().encode(np.zeros((4, 4), dtype=np.uint8)))
+    arr[0, 0] = 1
+    assert arr[0, 0] == 1
+
+
+def test_chunked_frames():
+    payload = ShareEncoder().encode(make_context())
+    stream = b''.join([
+        encode_frame(FRAME_PROGRESS, state='detection', finished=False),
+        *iter_frame(FRAME_RESULT, payload),
+    ])
+    reader = FrameReader()
+    frames = []
+    for i in range(0, len(stream), 1000):
+        frames += reader.feed(stream[i:i + 1000])
+    assert not reader.pending
+    assert [header['kind'] for header, _ in frames] == [FRAME_PROGRESS, FRAME_RESULT]
+    assert frames[0][0]['state'] == 'detection'
+    assert_same(decode(frames[1][1]), decode(payload))
+
+
+def test_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        ShareEncoder().encode({'value': object()})
+    with pytest.raises(TypeError):
+        ShareEncoder().encode(np.array([object()]))
+
+
+def test_rejects_truncated_frames():
+    frame = encode_frame(FRAME_RESULT, ShareEncoder().encode([1, 2, 3]))
+    with pytest.raises(ShareProtocolError):
+        read_frames(frame[:-1])
+
+
+def test_rejects_malformed_headers():
+    for header in ({'v': PROTOCOL_VERSION, 'size': 0}, {'v': PROTOCOL_VERSION, 'kind': 'call', 'size': 'x'}):
+        data = msgpack.packb(header)
+        with pytest.raises(ShareProtocolError):
+            read_frames(len(data).to_bytes(4, 'big') + data)
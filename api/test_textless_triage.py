@@ -0,0 +1,89 @@
+import asyncio
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_translator.manga_translator.detection.common import CommonDetector
+from image_translator.manga_translator.manga_translator import MangaTranslator
+from image_translator.manga_translator.utils import Context, Quadrilateral
+
+
+class MapDetector(CommonDetector):
+    """Uses the red channel as the text probability map and records the detection sizes."""
+
+    def __init__(self):
+        super().__init__()
+        self.sizes = []
+
+    async def _detect(self, image, detect_size, text_threshold, box_threshold, unclip_ratio, verbose=False):
+        self.sizes.append(detect_size)
+        raw_mask = image[:, :, 0].copy()
+        ys, xs = np.nonzero(raw_mask > 200)
+        textlines = []
+        if len(xs) > 100:
+            x1, y1, x2, y2 = xs.min(), ys.min(), xs.max(), ys.max()
+            textlines.append(Quadrilateral(np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]), '', 0.95))
+        return textlines, raw_mask, None
+
+
+def text_presence(image):
+    detector = MapDetector()
+    score = asyncio.run(detector.text_presence(image, 512, 0.5, 0.7, 2.3))
+    assert detector.sizes == [512]
+    return score
+
+
+def test_textless_page():
+    image = np.zeros((800, 600, 3), dtype=np.uint8)
+    # Faint noise of an illustration
+    image[:, :, 0] = np.random.default_rng(0).integers(0, 40, (800, 600))
+    assert text_presence(image) < 0.3
+
+
+def test_page_with_textline():
+    image = np.zeros((800, 600, 3), dtype=np.uint8)
+    image[100:130, 100:400, 0] = 250
+    assert text_presence(image) >= 0.95
+
+
+def test_small_text_without_textline():
+    image = np.zeros((800, 600, 3), dtype=np.uint8)
+    # Too small to form a textline at the triage resolution
+    image[100:108, 100:108, 0] = 180
+    assert text_presence(image) > 0.5
+
+
+class TextlessTranslator(MangaTranslator):
+    """Triage finds no text, colorization paints the page red and upscaling doubles its size."""
+
+    async def _run_triage(self, ctx):
+        return True
+
+    async def _run_colorizer(self, ctx):
+        return Image.new('RGB', ctx.input.size, (255, 0, 0))
+
+    async def _run_upscaling(self, ctx):
+        return ctx.img_colorized.resize((ctx.img_colorized.width * ctx.upscale_ratio, ctx.img_colorized.height * ctx.upscale_ratio))
+
+    async def _run_detection(self, ctx):
+        raise AssertionError('Textless pages are not detected')
+
+
+@pytest.mark.parametrize('revert_upscaling', [False, True])
+def test_textless_page_is_colorized_and_upscaled(revert_upscaling):
+    translator = TextlessTranslator({'kernel_size': 3})
+    image = Image.new('RGB', (60, 80), (255, 255, 255))
+    ctx = Context(input=image, skip_textless=True, colorizer='mc2', img_colorized=None,
+                  upscale_ratio=2, revert_upscaling=revert_upscaling)
+    ctx = asyncio.run(translator._translate(ctx))
+    assert ctx.result.size == ((60, 80) if revert_upscaling else (120, 160))
+    assert ctx.result.getpixel((0, 0)) == (255, 0, 0)
+    assert translator.triage_stats == {'pages': 1, 'skipped': 1}
+
+
+def test_textless_page_without_postprocessing():
+    translator = TextlessTranslator({'kernel_size': 3})
+    image = Image.new('RGB', (60, 80), (255, 255, 255))
+    ctx = asyncio.run(translator._translate(Context(input=image, skip_textless=True)))
+    assert ctx.result is image
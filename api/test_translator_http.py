@@ -0,0 +1,140 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from image_translator.manga_translator.translators.http_client import HTTPClient
+
+
+async def start_stub(routes: web.RouteTableDef):
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}'
+
+
+def test_connections_are_reused():
+    peers = []
+    routes = web.RouteTableDef()
+
+    @routes.post('/translate')
+    async def translate(request):
+        peers.append(request.transport.get_extra_info('peername'))
+        data = await request.post()
+        return web.json_response({'translation': [data['q'].upper()]})
+
+    async def run():
+        runner, url = await start_stub(routes)
+        client = HTTPClient()
+        try:
+            results = [await client.post(f'{url}/translate', data={'q': f'text {i}'}) for i in range(5)]
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return results
+
+    results = asyncio.run(run())
+    assert results[3] == {'translation': ['TEXT 3']}
+    # All requests went through the same keep-alive connection
+    assert len(set(peers)) == 1
+
+
+def test_retries_failed_requests():
+    calls = []
+    routes = web.RouteTableDef()
+
+    @routes.get('/flaky')
+    async def flaky(request):
+        calls.append(1)
+        if len(calls) < 3:
+            return web.Response(status=503)
+        return web.json_response({'ok': True})
+
+    async def run():
+        runner, url = await start_stub(routes)
+        client = HTTPClient(retries=2, retry_delay=0)
+        try:
+            return await client.get(f'{url}/flaky')
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == {'ok': True}
+    assert len(calls) == 3
+
+
+def test_posts_are_only_retried_when_opted_in():
+    calls = []
+    routes = web.RouteTableDef()
+
+    @routes.post('/translate')
+    async def translate(request):
+        calls.append(1)
+        if len(calls) < 2:
+            return web.json_response({'error': 'busy'}, status=503)
+        return web.json_response({'ok': True})
+
+    async def run():
+        runner, url = await start_stub(routes)
+        client = HTTPClient(retries=2, retry_delay=0)
+        try:
+            # The server may already have charged for the request
+            first = await client.post(f'{url}/translate')
+            calls.clear()
+            return first, await client.post(f'{url}/translate', idempotent=True)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == ({'error': 'busy'}, {'ok': True})
+    assert len(calls) == 2
+
+
+def test_posts_are_retried_when_the_connection_fails(monkeypatch):
+    attempts = []
+    request = aiohttp.ClientSession.request
+
+    def count(session, *args, **kwargs):
+        attempts.append(1)
+        return request(session, *args, **kwargs)
+
+    monkeypatch.setattr(aiohttp.ClientSession, 'request', count)
+
+    async def run():
+        runner, url = await start_stub(web.RouteTableDef())
+        # Nothing listens on the port anymore, so the request was never sent
+        await runner.cleanup()
+        client = HTTPClient(retries=2, retry_delay=0)
+        try:
+            await client.post(f'{url}/translate')
+        finally:
+            await client.close()
+
+    with pytest.raises(aiohttp.ClientConnectorError):
+        asyncio.run(run())
+    assert len(attempts) == 3
+
+
+def test_cached_lookups():
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'v1.2.3'
+
+    async def run():
+        client = HTTPClient()
+        values = await asyncio.gather(*(client.cached('version', loader) for _ in range(5)))
+        values.append(await client.cached('version', loader))
+        client.invalidate('version')
+        values.append(await client.cached('version', loader))
+        return values
+
+    assert asyncio.run(run()) == ['v1.2.3'] * 7
+    assert len(calls) == 2
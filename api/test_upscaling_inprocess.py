@@ -0,0 +1,96 @@
+import asyncio
+
+import numpy as np
+import torch
+from PIL import Image
+
+from image_translator.manga_translator.upscaling.esrgan_pytorch import RRDBNet, SRVGGNetCompact
+from image_translator.manga_translator.upscaling.inprocess import InProcessUpscaler, plan_tiles, tensor_to_image, tile_starts, \
+    tile_windows, upscale_tiled
+from image_translator.manga_translator.upscaling.waifu2x_pytorch import UpConv7
+
+
+class RandomUpscaler(InProcessUpscaler):
+    """Upscaler with a small randomly initialized network."""
+    _MODEL_MAPPING = {}
+    _VALID_UPSCALE_RATIOS = [2, 3, 4]
+    _MAX_TILE_SIZE = 48
+
+    def _build_model(self):
+        torch.manual_seed(0)
+        return SRVGGNetCompact(num_conv=2)
+
+
+def untiled(model, images):
+    with torch.no_grad():
+        return [model(img[None])[0] for img in images]
+
+
+def rounding_differences(out: np.ndarray, expected: torch.Tensor) -> int:
+    """Pixels where the tiled output rounds to a neighbouring value, otherwise it has to be exact."""
+    diff = np.abs(out.astype(int) - tensor_to_image(expected).astype(int))
+    assert diff.max() <= 1
+    return int(np.count_nonzero(diff))
+
+
+def test_tiled_matches_untiled():
+    torch.manual_seed(0)
+    images = [torch.rand(3, 100, 140), torch.rand(3, 70, 50)]
+    # The receptive fields of these networks fit in the tile padding
+    for model, scale in ((SRVGGNetCompact(num_conv=2).eval(), 4), (UpConv7().eval(), 2)):
+        tiled = upscale_tiled(model, images, scale, 64, 16, 8, 3)
+        for out, expected in zip(tiled, untiled(model, images)):
+            assert out.shape == expected.permute(1, 2, 0).shape
+            assert rounding_differences(out, expected) < out.size // 1000
+
+
+def test_tiled_esrgan_close_to_untiled():
+    torch.manual_seed(0)
+    model = RRDBNet(in_nc=3, out_nc=3, nf=16, nb=2, gc=8, upscale=4).eval()
+    images = [torch.rand(3, 120, 90)]
+    tiled = upscale_tiled(model, images, 4, 64, 16, 8, 4)[0]
+    expected = untiled(model, images)[0]
+    assert tiled.shape == expected.permute(1, 2, 0).shape
+    assert np.abs(tiled.astype(int) - tensor_to_image(expected).astype(int)).mean() < 0.5
+
+
+def test_plan_tiles():
+    tile_size, tiles_per_batch = plan_tiles(2048, 14000, 512, 96)
+    assert tile_size <= 512 and tile_size * tile_size * tiles_per_batch * 14000 <= 2048 * 2 ** 20
+    assert plan_tiles(2048, 1000, 512, 96) == (512, 8)
+    # Never smaller than what the padding and blending need
+    assert plan_tiles(1, 14000, 512, 96) == (96, 1)
+    # Memory per row of the tile height, like the output strip, makes tiles smaller
+    tile_size, tiles_per_batch = plan_tiles(2048, 14000, 512, 96, 2 ** 22)
+    assert tile_size * tile_size * tiles_per_batch * 14000 + tile_size * 2 ** 22 <= 2048 * 2 ** 20
+    assert plan_tiles(2048, 1000, 512, 96, 2 ** 20) == (512, 6)
+
+
+def test_tile_windows_add_up_to_one():
+    for length, tile in ((100, 64), (300, 64), (129, 64), (64, 64)):
+        starts = tile_starts(length, tile, 2 * 16 + 8)
+        windows = tile_windows(length, tile, starts, 16, 8)
+        total = torch.zeros(length)
+        for s, window in windows.items():
+            total[s:s + tile] += window
+        assert torch.allclose(total, torch.ones(length))
+
+
+def test_batched_pages_of_different_sizes():
+    upscaler = RandomUpscaler()
+    asyncio.run(upscaler.load('cpu'))
+    rng = np.random.default_rng(0)
+    pages = [Image.fromarray(rng.integers(0, 255, (h, w, 3), dtype=np.uint8)) for h, w in ((60, 80), (90, 50), (60, 80))]
+    upscaled = asyncio.run(upscaler.upscale(list(pages), 2))
+    assert [img.size for img in upscaled] == [(160, 120), (100, 180), (160, 120)]
+    # Each page gives the same result as when upscaled alone
+    single = asyncio.run(upscaler.upscale([pages[1]], 2))[0]
+    assert np.array_equal(np.array(single), np.array(upscaled[1]))
+
+
+def test_pages_split_by_input_memory(monkeypatch):
+    monkeypatch.setattr('image_translator.manga_translator.upscaling.inprocess.UPSCALE_MEMORY_MB', 1)
+    upscaler = RandomUpscaler()
+    # 1MB holds the float input of 87381 pixels, a page larger than that still gets a call of its own
+    pages = [Image.new('RGB', size) for size in ((200, 200), (200, 200), (100, 100), (400, 400), (10, 10))]
+    assert [len(group) for group in upscaler._split_pages(pages)] == [2, 1, 1, 1]
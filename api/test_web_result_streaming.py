@@ -0,0 +1,104 @@
+import asyncio
+import os
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from image_translator.manga_translator.server import web_main
+
+CONTENT = bytes(range(256)) * 40
+ETAG = '"t1.png"'
+
+
+@pytest.fixture
+def result(tmp_path, monkeypatch):
+    """A finished task `t1` whose result is streamed in small chunks."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(web_main, 'FORMAT', 'png')
+    monkeypatch.setattr(web_main, 'RESULT_CHUNK_SIZE', 1000)
+    os.makedirs(os.path.join('result', 't1'))
+    with open(os.path.join('result', 't1', 'final.png'), 'wb') as f:
+        f.write(CONTENT)
+
+
+def get(headers: dict = None):
+    """Returns the status, headers and body of a request for the result."""
+    async def run():
+        app = web.Application()
+        app.add_routes(web_main.routes)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            resp = await client.get('/result/t1', headers=headers or {})
+            return resp.status, resp.headers, await resp.read()
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+def test_full_get(result):
+    status, headers, body = get()
+    assert status == 200
+    assert body == CONTENT
+    assert headers['Content-Type'] == 'image/png'
+    assert headers['Content-Length'] == str(len(CONTENT))
+    assert headers['ETag'] == ETAG
+    assert headers['Accept-Ranges'] == 'bytes'
+
+
+@pytest.mark.parametrize('if_none_match', [ETAG, f'W/{ETAG}', f'"other", {ETAG}', '*'])
+def test_not_modified(result, if_none_match):
+    status, headers, body = get({'If-None-Match': if_none_match})
+    assert status == 304
+    assert body == b''
+    assert headers['ETag'] == ETAG
+
+
+def test_other_etag_is_sent_in_full(result):
+    status, _, body = get({'If-None-Match': '"t2.png"'})
+    assert status == 200
+    assert body == CONTENT
+
+
+def test_open_range(result):
+    status, headers, body = get({'Range': 'bytes=0-'})
+    assert status == 206
+    assert body == CONTENT
+    assert headers['Content-Range'] == f'bytes 0-{len(CONTENT) - 1}/{len(CONTENT)}'
+
+
+def test_range_across_chunks(result):
+    status, headers, body = get({'Range': 'bytes=900-2099'})
+    assert status == 206
+    assert body == CONTENT[900:2100]
+    assert headers['Content-Range'] == f'bytes 900-2099/{len(CONTENT)}'
+
+
+def test_suffix_range(result):
+    status, headers, body = get({'Range': 'bytes=-100'})
+    assert status == 206
+    assert body == CONTENT[-100:]
+    assert headers['Content-Length'] == '100'
+    assert headers['Content-Range'] == f'bytes {len(CONTENT) - 100}-{len(CONTENT) - 1}/{len(CONTENT)}'
+
+
+@pytest.mark.parametrize('range_header', [f'bytes={len(CONTENT)}-', f'bytes={len(CONTENT) + 10}-{len(CONTENT) + 20}'])
+def test_unsatisfiable_range(result, range_header):
+    status, headers, body = get({'Range': range_header})
+    assert status == 416
+    assert headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+@pytest.mark.parametrize('range_header', ['bytes=abc', 'bytes=20-10', 'pages=1-2'])
+def test_malformed_range(result, range_header):
+    status, headers, _ = get({'Range': range_header})
+    assert status == 416
+    assert headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_missing_result(result):
+    os.remove(os.path.join('result', 't1', 'final.png'))
+    status, _, _ = get()
+    assert status == 404
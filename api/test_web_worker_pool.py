@@ -0,0 +1,180 @@
+import asyncio
+import time
+from collections import deque
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from image_translator.manga_translator.server import web_main
+from image_translator.manga_translator.server.web_main import TranslatorWorker
+
+
+class FakeProc:
+    def __init__(self):
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Fresh webserver state whose worker processes are `FakeProc`s."""
+    monkeypatch.setattr(web_main, 'WORKERS', {})
+    monkeypatch.setattr(web_main, 'QUEUE', deque())
+    monkeypatch.setattr(web_main, 'ONGOING_TASKS', [])
+    monkeypatch.setattr(web_main, 'FINISHED_TASKS', [])
+    monkeypatch.setattr(web_main, 'TASK_STATES', {})
+    monkeypatch.setattr(web_main, 'TASK_DATA', {})
+    monkeypatch.setattr(web_main, 'TASK_CONDITIONS', {})
+    monkeypatch.setattr(web_main, 'QUEUE_CONDITION', asyncio.Condition())
+    monkeypatch.setattr(web_main, 'DRAINING', False)
+    monkeypatch.setattr(web_main, 'NONCE', 'nonce')
+    monkeypatch.setattr(web_main, 'MAX_ONGOING_TASKS', 2)
+    monkeypatch.setattr(web_main, 'WORKER_RESTART_BACKOFF', 0)
+    started = []
+
+    def start_proc(host, port, nonce, params, worker_id='0', num_workers=1):
+        started.append(worker_id)
+        return FakeProc()
+
+    monkeypatch.setattr(web_main, 'start_translator_client_proc', start_proc)
+    for i in range(2):
+        worker = web_main.WORKERS[str(i)] = TranslatorWorker(str(i), managed=True)
+        web_main.start_worker(worker, '127.0.0.1', 0, 'nonce', {})
+    started.clear()
+    return started
+
+
+def add_task(task_id: str, worker: TranslatorWorker = None):
+    web_main.TASK_STATES[task_id] = {'info': 'pending', 'finished': False}
+    web_main.TASK_DATA[task_id] = {'created_at': time.time(), 'requested_at': time.time()}
+    if worker is None:
+        web_main.QUEUE.append(task_id)
+    else:
+        worker.task_id = task_id
+        web_main.ONGOING_TASKS.append(task_id)
+
+
+def supervise():
+    asyncio.run(web_main.supervise_workers('127.0.0.1', 0, 'nonce', {}))
+
+
+async def make_client() -> TestClient:
+    app = web.Application()
+    app.add_routes(web_main.routes)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+def test_crashed_worker_is_restarted(pool):
+    worker = web_main.WORKERS['0']
+    add_task('t1', worker)
+    worker.proc.returncode = 1
+    supervise()
+    assert pool == ['0']
+    assert worker.alive and worker.idle
+    assert web_main.TASK_STATES['t1'] == {'info': 'error', 'finished': True}
+    assert web_main.ONGOING_TASKS == []
+
+
+def test_stalled_worker_is_killed_and_restarted(pool):
+    worker = web_main.WORKERS['1']
+    add_task('t1', worker)
+    proc = worker.proc
+    worker.last_seen = time.time() - web_main.WORKER_STALL_TIMEOUT - 1
+    supervise()
+    assert proc.returncode == -9
+    assert pool == ['1']
+    assert web_main.TASK_STATES['t1']['info'] == 'error'
+
+
+def test_external_worker_is_not_supervised(pool):
+    external = web_main.get_worker('external-1234')
+    add_task('t1', external)
+    # Clients that don't send an id don't take over the first started worker
+    assert web_main.get_worker(None) is not web_main.WORKERS['0']
+    supervise()
+    assert pool == []
+    assert not external.managed and external.alive
+    assert external.task_id == 't1'
+    assert web_main.TASK_STATES['t1']['info'] == 'pending'
+    # While connected it adds to the capacity of the started workers
+    assert web_main.task_capacity() == 4
+
+
+def test_silent_external_worker_is_forgotten(pool):
+    external = web_main.get_worker('external-1234')
+    add_task('t1', external)
+    external.last_seen = time.time() - web_main.WORKER_STALL_TIMEOUT - 1
+    supervise()
+    assert pool == []
+    assert 'external-1234' not in web_main.WORKERS
+    assert web_main.TASK_STATES['t1'] == {'info': 'error', 'finished': True}
+    assert web_main.task_capacity() == 2
+
+
+def test_workers_added_during_supervision(pool, monkeypatch):
+    notify_queue = web_main.notify_queue
+
+    async def connect_during_await():
+        web_main.get_worker(f'external-{len(web_main.WORKERS)}')
+        await notify_queue()
+
+    monkeypatch.setattr(web_main, 'notify_queue', connect_during_await)
+    web_main.WORKERS['0'].proc.returncode = 1
+    web_main.WORKERS['1'].proc.returncode = 1
+    supervise()
+    assert pool == ['0', '1']
+    assert len(web_main.WORKERS) == 4
+
+
+def test_queue_position_counts_free_workers(pool):
+    for i in range(4):
+        add_task(f't{i}')
+
+    async def run():
+        client = await make_client()
+        try:
+            waiting = []
+            for i in range(4):
+                resp = await client.get('/task-state', params={'taskid': f't{i}'})
+                waiting.append((await resp.json())['waiting'])
+            # One worker gets busy
+            resp = await client.get('/task-internal', params={'nonce': 'nonce', 'worker_id': '0'})
+            assert (await resp.json())['task_id'] == 't0'
+            resp = await client.get('/task-state', params={'taskid': 't3'})
+            return waiting, (await resp.json())['waiting']
+        finally:
+            await client.close()
+
+    waiting, after = asyncio.run(run())
+    # Two idle workers pick up the first two tasks right away
+    assert waiting == [0, 0, 1, 2]
+    # t1 is still picked up by the other worker, so t3 stays behind t2
+    assert after == 2
+
+
+def test_drain_stops_handing_out_tasks(pool):
+    add_task('t1')
+
+    async def run():
+        client = await make_client()
+        try:
+            await web_main.drain_workers(timeout=0)
+            resp = await client.get('/task-internal', params={'nonce': 'nonce', 'worker_id': '0', 'wait': 1})
+            return await resp.json()
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == {'data': {'exit': True}}
+    assert list(web_main.QUEUE) == ['t1']
+    assert not any(w.alive for w in web_main.WORKERS.values())
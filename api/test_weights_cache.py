@@ -0,0 +1,108 @@
+import os
+
+import pytest
+import torch
+
+from image_translator.manga_translator.utils import ModelWrapper, load_state_dict, load_weights
+from image_translator.manga_translator.utils.inference import _flatten_weights, _unflatten_weights, get_weights_cache_path
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    d = tmp_path / 'models'
+    d.mkdir()
+    monkeypatch.setattr(ModelWrapper, '_MODEL_DIR', str(d))
+    monkeypatch.delenv('MT_WEIGHTS_CACHE', raising=False)
+    return d
+
+
+def make_module():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Linear(8, 4), torch.nn.BatchNorm1d(4))
+
+
+def test_flatten_round_trip():
+    weight = torch.randn(4, 3)
+    value = {
+        'model': {'weight': weight, 'tied': weight, 'view': weight[1:, :2]},
+        'layers': [torch.arange(5), (torch.ones(2), 'name')],
+        'epoch': 3,
+        'lr': 0.5,
+        'note': None,
+    }
+    tensors = {}
+    structure = _flatten_weights(value, tensors)
+    # The tensors are copies that don't share memory, which safetensors requires
+    assert len(tensors) == 5
+    assert len({t.untyped_storage().data_ptr() for t in tensors.values()}) == 5
+    assert all(t.is_contiguous() for t in tensors.values())
+
+    restored = _unflatten_weights(structure, tensors)
+    assert list(restored) == list(value)
+    assert torch.equal(restored['model']['weight'], weight)
+    assert torch.equal(restored['model']['tied'], weight)
+    assert torch.equal(restored['model']['view'], weight[1:, :2])
+    assert torch.equal(restored['layers'][0], torch.arange(5))
+    assert torch.equal(restored['layers'][1][0], torch.ones(2))
+    assert restored['layers'][1][1] == 'name'
+    assert (restored['epoch'], restored['lr'], restored['note']) == (3, 0.5, None)
+
+
+def test_flatten_rejects_other_keys():
+    with pytest.raises(TypeError):
+        _flatten_weights({0: torch.ones(1)}, {})
+
+
+def test_load_weights_round_trip(model_dir, tmp_path):
+    module = make_module()
+    path = str(tmp_path / 'model.ckpt')
+    torch.save({'model': module.state_dict(), 'epoch': 3}, path)
+
+    first = load_weights(path)
+    cache_path = get_weights_cache_path(path)
+    assert os.path.isfile(cache_path)
+    second = load_weights(path)
+    for sd in (first, second):
+        assert sd['epoch'] == 3
+        assert list(sd['model']) == list(module.state_dict())
+        for key, value in module.state_dict().items():
+            assert torch.equal(sd['model'][key], value)
+            assert sd['model'][key].dtype == value.dtype
+
+    # The module takes over the memory-mapped tensors instead of copying them
+    loaded = torch.nn.Sequential(torch.nn.Linear(8, 4), torch.nn.BatchNorm1d(4))
+    load_state_dict(loaded, second['model'])
+    assert loaded[0].weight.data_ptr() == second['model']['0.weight'].data_ptr()
+    x = torch.randn(2, 8)
+    assert torch.equal(loaded.eval()(x), module.eval()(x))
+
+    # Writes are private to the process and don't reach the cache
+    with torch.no_grad():
+        loaded[0].weight.zero_()
+    assert torch.equal(load_weights(path)['model']['0.weight'], module[0].weight)
+
+
+def test_unconvertible_checkpoint_is_remembered(model_dir, tmp_path, monkeypatch):
+    path = str(tmp_path / 'model.ckpt')
+    torch.save({0: torch.ones(2)}, path)
+
+    assert torch.equal(load_weights(path)[0], torch.ones(2))
+    cache_path = get_weights_cache_path(path)
+    assert not os.path.isfile(cache_path)
+    assert os.path.isfile(cache_path + '.failed')
+    assert not [p for p in os.listdir(os.path.dirname(cache_path)) if p.endswith('.part')]
+
+    def fail(*args):
+        raise AssertionError('Conversion was retried')
+
+    monkeypatch.setattr('image_translator.manga_translator.utils.inference._flatten_weights', fail)
+    assert torch.equal(load_weights(path)[0], torch.ones(2))
+
+
+def test_load_state_dict_converts_dtypes():
+    module = make_module()
+    sd = {k: v.half() if v.is_floating_point() else v for k, v in module.state_dict().items()}
+    loaded = torch.nn.Sequential(torch.nn.Linear(8, 4), torch.nn.BatchNorm1d(4))
+    load_state_dict(loaded, sd)
+    assert loaded[0].weight.dtype == torch.float32
+    assert torch.equal(loaded[0].weight, sd['0.weight'].float())